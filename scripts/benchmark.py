@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Benchmark the pipeline stages on synthetic KeyBR exports.
+
+For every export size a fresh export is generated (generate_synthetic_export.py),
+imported into a fresh DB, and each stage is timed:
+
+    update_keybr          streaming JSON -> SQLite import
+    compute_daily_metrics daily aggregates incl. rolling metrics
+    add_rolling_metrics   rolling metrics on the daily frame alone
+    compute_key_metrics   per-key aggregates
+    get_weak_keys         weak-key ranking
+    compute_all_metrics   in-memory engine (daily + key metrics, one read per table)
+    columnar_rebuild      build the columnar mirror from the DB (pyarrow only)
+    compute_all_columnar  in-memory engine reading the columnar mirror (pyarrow only)
+
+Per stage the wall time, CPU time, output rows and peak Python memory
+(tracemalloc) are recorded, plus the process max RSS. Results are written as
+JSON so runs can be compared; --compare flags stages that got slower than
+--threshold and exits non-zero.
+
+Examples:
+    python3 scripts/benchmark.py --sizes 10000 100000
+    python3 scripts/benchmark.py --compare bench/results-baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sqlite3
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+from columnar_store import ColumnarStore, mirror_dir_for
+from generate_synthetic_export import generate_export, parse_range
+from instrumentation import max_rss_mb
+from metrics import compute_all_metrics, compute_daily_metrics, compute_key_metrics, get_weak_keys
+from metrics.columnar import arrow_available
+from metrics.daily import compute_daily_base
+from metrics.rolling import add_rolling_metrics
+from update_keybr import import_new_data_streaming
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BENCH_DIR = ROOT_DIR / "bench"
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def run_stage(name: str, func, trace_memory: bool = True) -> tuple:
+    """Run one stage, return (result, measurement dict)."""
+    if trace_memory:
+        tracemalloc.start()
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    # Stages print progress; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+
+    peak_mb = None
+    if trace_memory:
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = peak / (1024 * 1024)
+
+    rows = len(result) if isinstance(result, pd.DataFrame) else None
+    measurement = {
+        "seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "rows": rows,
+        "peak_python_mb": round(peak_mb, 2) if peak_mb is not None else None,
+        "max_rss_mb": round(max_rss_mb(), 2),
+    }
+    print(
+        f"  {name:<22} {wall:9.3f}s  cpu {cpu:8.3f}s"
+        + (f"  peak {peak_mb:8.1f} MB" if peak_mb is not None else "")
+        + (f"  rows {rows}" if rows is not None else "")
+    )
+    return result, measurement
+
+
+def benchmark_size(lessons: int, args) -> dict:
+    """Generate an export of `lessons` lessons and time every stage on it."""
+    work_dir = args.work_dir / f"{lessons}"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    json_path = work_dir / "typing-data.json"
+    db_path = work_dir / "keybr.db"
+
+    print(f"\n== {lessons} lessons ==")
+
+    if not json_path.exists() or args.regenerate:
+        start = time.perf_counter()
+        generate_export(
+            json_path,
+            lessons,
+            args.days,
+            histogram_size=args.histogram_size,
+            layouts=args.layouts,
+            seed=args.seed,
+        )
+        print(f"  generated export in {time.perf_counter() - start:.1f}s ({json_path})")
+
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+
+    stages = {}
+    trace = not args.no_trace_memory
+
+    _, stages["update_keybr"] = run_stage(
+        "update_keybr",
+        lambda: import_new_data_streaming(db_path=db_path, json_path=json_path),
+        trace,
+    )
+
+    conn = sqlite3.connect(db_path)
+    try:
+        keystats_rows = conn.execute("SELECT COUNT(*) FROM keystats_raw;").fetchone()[0]
+        stages["update_keybr"]["rows"] = lessons
+        stages["update_keybr"]["keystats_rows"] = keystats_rows
+        stages["update_keybr"]["keystats_rows_per_second"] = round(
+            keystats_rows / stages["update_keybr"]["seconds"]
+        )
+
+        _, stages["compute_daily_metrics"] = run_stage(
+            "compute_daily_metrics", lambda: compute_daily_metrics(conn), trace
+        )
+
+        daily_base = compute_daily_base(conn)
+        _, stages["add_rolling_metrics"] = run_stage(
+            "add_rolling_metrics", lambda: add_rolling_metrics(daily_base), trace
+        )
+
+        key_df, stages["compute_key_metrics"] = run_stage(
+            "compute_key_metrics", lambda: compute_key_metrics(conn), trace
+        )
+
+        _, stages["get_weak_keys"] = run_stage(
+            "get_weak_keys", lambda: get_weak_keys(key_df, min_attempts=200, top_n=20), trace
+        )
+
+        _, stages["compute_all_metrics"] = run_stage(
+            "compute_all_metrics", lambda: compute_all_metrics(conn), trace
+        )
+
+        if arrow_available():
+            columnar_dir = mirror_dir_for(db_path)
+            _, stages["columnar_rebuild"] = run_stage(
+                "columnar_rebuild", lambda: ColumnarStore(columnar_dir).rebuild(conn), trace
+            )
+            _, stages["compute_all_columnar"] = run_stage(
+                "compute_all_columnar", lambda: compute_all_metrics(conn, columnar_dir), trace
+            )
+    finally:
+        conn.close()
+
+    return {
+        "lessons": lessons,
+        "keystats_rows": keystats_rows,
+        "json_mb": round(json_path.stat().st_size / (1024 * 1024), 2),
+        "stages": stages,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(current: dict, previous: dict, threshold: float) -> list:
+    """Stages whose wall time grew by more than `threshold` (relative)."""
+    old_runs = {run["lessons"]: run for run in previous.get("runs", [])}
+    regressions = []
+
+    print(f"\nComparison with previous results (threshold +{threshold:.0%}):")
+    for run in current["runs"]:
+        old = old_runs.get(run["lessons"])
+        if old is None:
+            continue
+        for stage, m in run["stages"].items():
+            old_m = old["stages"].get(stage)
+            if not old_m or not old_m.get("seconds"):
+                continue
+            ratio = m["seconds"] / old_m["seconds"]
+            flag = "REGRESSION" if ratio > 1 + threshold else ""
+            print(
+                f"  {run['lessons']:>9} {stage:<22} "
+                f"{old_m['seconds']:9.3f}s -> {m['seconds']:9.3f}s  x{ratio:5.2f} {flag}"
+            )
+            if flag:
+                regressions.append((run["lessons"], stage, ratio))
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the KeyBR analytics pipeline stages.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Export sizes in lessons (default: 10000 100000 1000000).",
+    )
+    parser.add_argument("--days", type=int, default=730, help="Days covered by each export (default: 730).")
+    parser.add_argument("--histogram-size", type=parse_range, default=(15, 30), help="Keys per lesson, N or MIN-MAX.")
+    parser.add_argument("--layouts", nargs="+", default=["en-us", "de-de"], help="Layouts to mix.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        default=BENCH_DIR / "work",
+        help="Where exports and DBs are kept (exports are reused between runs).",
+    )
+    parser.add_argument("--regenerate", action="store_true", help="Regenerate exports even if present.")
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="Skip tracemalloc (timings without tracing overhead, no peak memory).",
+    )
+    parser.add_argument("--out", type=Path, help="Results file (default: bench/results-<timestamp>.json).")
+    parser.add_argument("--compare", type=Path, help="Previous results file to compare against.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.20,
+        help="Relative slowdown counted as regression (default: 0.20).",
+    )
+    args = parser.parse_args()
+
+    started = datetime.now(timezone.utc)
+    results = {
+        "started": started.isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "params": {
+            "days": args.days,
+            "histogram_size": list(args.histogram_size),
+            "layouts": args.layouts,
+            "seed": args.seed,
+            "trace_memory": not args.no_trace_memory,
+        },
+        "runs": [benchmark_size(n, args) for n in args.sizes],
+    }
+
+    out = args.out or BENCH_DIR / f"results-{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"\nWrote results to {out}")
+
+    if args.compare:
+        previous = json.loads(args.compare.read_text())
+        regressions = compare_results(results, previous, args.threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} stage(s) regressed beyond +{args.threshold:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
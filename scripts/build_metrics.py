@@ -1,12 +1,26 @@
 # scripts/build_metrics.py
 
+import argparse
 import sqlite3
 from pathlib import Path
 
 import pandas as pd
 
+from bulk_writer import BulkWriter, apply_pragmas
 from metrics import compute_daily_metrics, compute_key_metrics, get_weak_keys
-from metrics.weak_keys import export_weak_keys
+from metrics.daily import DAILY_COLUMNS, compute_daily_base
+from metrics.export import write_csv, write_csv_tail
+from metrics.chunked import DEFAULT_MEMORY_MB, compute_all_metrics_chunked
+from metrics.rolling import (
+    MAX_ROLLING_WINDOW,
+    ROLLING_COLUMNS,
+    ROLLING_STATE_COLUMNS,
+    apply_rolling_columns,
+    extra_rolling_columns,
+    rolling_state,
+)
+from metrics.weak_keys import export_weak_keys, key_prefix_sums, windowed_weak_keys
+from schema import ensure_schema
 
 # Base directory of the repo: .../keybr_analytics
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -16,56 +30,168 @@ DB_PATH = ROOT_DIR / "db" / "keybr.db"
 OUTPUT_DIR = ROOT_DIR / "output"
 
 
-def write_daily_metrics(conn: sqlite3.Connection, daily_df: pd.DataFrame) -> None:
-    """
-    Schreibt daily_metrics in die DB.
-    Die Tabelle hat laut Schema.sql folgende Spalten:
-    - date TEXT PRIMARY KEY
-    - total_keystrokes INTEGER
-    - avg_wpm REAL
-    - avg_accuracy REAL
-    - error_rate REAL
-    - avg_latency REAL
-    - ttfe REAL
-    - ttke REAL
-    - rolling_7d_wpm REAL
-    - rolling_30d_wpm REAL
-
-    Zusätzliche Rolling-Spalten wie rolling_7d_error_rate etc.
-    bleiben im DataFrame/CSV, werden aber NICHT in die DB geschrieben.
-    """
+# ttke auf Tagesebene lassen wir vorerst leer (None)
+DAILY_DB_COLUMNS = DAILY_COLUMNS + ["ttke"]
 
-    cols_for_db = [
-        "date",
-        "total_keystrokes",
-        "avg_wpm",
-        "avg_accuracy",
-        "error_rate",
-        "avg_latency",
-        "ttfe",
-        # ttke auf Tagesebene lassen wir vorerst leer (None)
-        "ttke",
-        "rolling_7d_wpm",
-        "rolling_30d_wpm",
-    ]
 
+def _daily_frame_for_db(daily_df: pd.DataFrame) -> pd.DataFrame:
     df_db = daily_df.copy()
 
     # ttke-Spalte auf Tagesebene als Placeholder
     if "ttke" not in df_db.columns:
         df_db["ttke"] = None
 
-    for col in cols_for_db:
+    for col in DAILY_DB_COLUMNS:
         if col not in df_db.columns:
             df_db[col] = None
 
-    df_db = df_db[cols_for_db].copy()
+    return df_db[DAILY_DB_COLUMNS].copy()
 
-    cur = conn.cursor()
-    cur.execute("DELETE FROM daily_metrics;")
-    conn.commit()
 
-    df_db.to_sql("daily_metrics", conn, if_exists="append", index=False)
+def write_daily_metrics(conn: sqlite3.Connection, daily_df: pd.DataFrame) -> None:
+    """
+    Schreibt daily_metrics in die DB (komplett neu).
+    Die Tabelle enthält alle Spalten von daily_metrics.csv (DAILY_COLUMNS)
+    plus ttke, damit inkrementelle Builds die CSV direkt aus der DB
+    exportieren können.
+    """
+
+    df_db = _daily_frame_for_db(daily_df)
+
+    # DELETE + Insert in einer Transaktion (Commit macht der Aufrufer)
+    BulkWriter(conn).replace_all("daily_metrics", df_db)
+
+
+def upsert_daily_metrics(conn: sqlite3.Connection, daily_df: pd.DataFrame) -> None:
+    """Überschreibt bzw. ergänzt nur die übergebenen Tage in daily_metrics."""
+
+    df_db = _daily_frame_for_db(daily_df)
+    BulkWriter(conn).insert_dataframe("daily_metrics", df_db, verb="INSERT OR REPLACE")
+
+
+def read_daily_metrics(conn: sqlite3.Connection, since: str = None) -> pd.DataFrame:
+    """Liest daily_metrics (optional ab `since`) in CSV-Spaltenreihenfolge."""
+
+    sql = f"SELECT {', '.join(DAILY_COLUMNS)} FROM daily_metrics"
+    params = []
+    if since is not None:
+        sql += " WHERE date >= ?"
+        params.append(since)
+    sql += " ORDER BY date"
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def read_rolling_state(conn: sqlite3.Connection, since: str = None) -> pd.DataFrame:
+    """
+    Liest rolling_state nach Datum sortiert. Mit `since` ab diesem Tag, dazu
+    die letzte Zeile davor als Basis der Präfixsummen.
+    """
+
+    sql = f"SELECT {', '.join(ROLLING_STATE_COLUMNS)} FROM rolling_state"
+    params = []
+    if since is not None:
+        sql += " WHERE date >= COALESCE((SELECT MAX(date) FROM rolling_state WHERE date < ?), ?)"
+        params = [since, since]
+    sql += " ORDER BY date"
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def write_rolling_state(conn: sqlite3.Connection, state: pd.DataFrame, since: str = None) -> None:
+    """
+    Schreibt den Fensterzustand: komplett neu, oder mit `since` nur die Tage
+    ab `since` (die Präfixsummen aller späteren Tage ändern sich mit).
+    Commit macht der Aufrufer.
+    """
+
+    if since is None:
+        BulkWriter(conn).replace_all("rolling_state", state[ROLLING_STATE_COLUMNS])
+        return
+
+    conn.execute("DELETE FROM rolling_state WHERE date >= ?;", (since,))
+    BulkWriter(conn).insert_dataframe("rolling_state", state[ROLLING_STATE_COLUMNS])
+
+
+def add_window_columns(conn: sqlite3.Connection, daily_df: pd.DataFrame, windows) -> pd.DataFrame:
+    """Zusätzliche Rolling-Fenster (nur CSV) aus rolling_state, ohne die Rohdaten zu lesen."""
+
+    columns = extra_rolling_columns(windows)
+    if not columns or daily_df.empty:
+        return daily_df
+    return apply_rolling_columns(daily_df, read_rolling_state(conn), columns)
+
+
+def _shift_date(date: str, days: int) -> str:
+    return (pd.Timestamp(date) + pd.Timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def get_pending_dates(conn: sqlite3.Connection) -> list:
+    """Tage, die seit dem letzten Build durch Imports verändert wurden."""
+    return [row[0] for row in conn.execute("SELECT date FROM pending_dates ORDER BY date;")]
+
+
+def needs_full_daily_rebuild(conn: sqlite3.Connection) -> bool:
+    """
+    Inkrementell geht nur, wenn daily_metrics bereits vollständig ist
+    (nicht leer und keine Zeilen aus einer älteren Schema-Version) und
+    rolling_state zu jedem Tag eine Zeile mit Kompensationstermen hat.
+    """
+    total, incomplete = conn.execute(
+        "SELECT COUNT(*), SUM(num_lessons IS NULL) FROM daily_metrics;"
+    ).fetchone()
+    state_rows, state_incomplete = conn.execute(
+        "SELECT COUNT(*), SUM(wpm_sum_err IS NULL) FROM rolling_state;"
+    ).fetchone()
+    return total == 0 or bool(incomplete) or bool(state_incomplete) or state_rows != total
+
+
+def update_daily_metrics_incremental(conn: sqlite3.Connection, dates=None) -> tuple:
+    """
+    Berechnet nur die Tage aus pending_dates neu und schreibt sie per Upsert,
+    dazu die Rolling-Spalten ab dem ersten betroffenen Tag. Die Fenster
+    kommen aus den Präfixsummen in rolling_state: gelesen werden nur die
+    letzten MAX_ROLLING_WINDOW Tage davor, neu summiert nur die Tage ab dem
+    ersten betroffenen Tag (beim Anhängen also nur die neuen).
+    `dates` (z. B. direkt aus dem Import-Schritt) werden zusätzlich
+    berücksichtigt. pending_dates bleibt stehen, bis auch die CSV
+    geschrieben ist (siehe build()).
+
+    Liefert (vollständiger Tages-DataFrame, erster neu geschriebener Tag
+    oder None); ab diesem Tag muss daily_metrics.csv neu geschrieben werden.
+    """
+
+    dates = sorted(set(get_pending_dates(conn)) | set(dates or ()))
+    print(f"Pending dates: {len(dates)}")
+
+    if dates:
+        first = dates[0]
+
+        # Zustand vor dem ersten betroffenen Tag, so weit die Fenster zurückreichen
+        context = read_rolling_state(conn, since=_shift_date(first, 1 - MAX_ROLLING_WINDOW))
+        context = context[context["date"] < first]
+        start = context.iloc[-1] if not context.empty else None
+
+        existing = read_daily_metrics(conn, since=first)
+        existing = existing[~existing["date"].isin(dates)]
+        fresh = compute_daily_base(conn, dates=dates)
+
+        base_cols = [c for c in DAILY_COLUMNS if not c.startswith("rolling_")]
+        frames = [df[base_cols] for df in (existing, fresh) if not df.empty]
+        merged = pd.concat(frames, ignore_index=True) if frames else fresh[base_cols]
+        merged = merged.sort_values("date", ignore_index=True)
+
+        tail_state = rolling_state(merged, start)
+        state = pd.concat([context, tail_state], ignore_index=True)
+        tail = apply_rolling_columns(merged, state, ROLLING_COLUMNS)
+
+        upsert_daily_metrics(conn, tail)
+        write_rolling_state(conn, tail_state, since=first)
+        conn.commit()
+
+        print(f"Recomputed days: {len(fresh)}, updated rows: {len(tail)}")
+
+        return read_daily_metrics(conn), first
+
+    return read_daily_metrics(conn), None
 
 
 def write_key_metrics(conn: sqlite3.Connection, key_df: pd.DataFrame) -> None:
@@ -99,50 +225,220 @@ def write_key_metrics(conn: sqlite3.Connection, key_df: pd.DataFrame) -> None:
 
     df_db = df_db[cols_for_db].copy()
 
-    cur = conn.cursor()
-    cur.execute("DELETE FROM key_metrics;")
-    conn.commit()
+    # DELETE + Insert in einer Transaktion (Commit macht der Aufrufer)
+    BulkWriter(conn).replace_all("key_metrics", df_db)
 
-    df_db.to_sql("key_metrics", conn, if_exists="append", index=False)
 
+def export_csvs(
+    daily_df: pd.DataFrame,
+    key_df: pd.DataFrame,
+    output_dir: Path = OUTPUT_DIR,
+    tail_only: bool = False,
+    changed_since: str = None,
+) -> None:
+    """
+    Schreibt daily_metrics.csv und key_metrics.csv; unveränderte Dateien
+    werden nicht angefasst (mtime bleibt). Mit `tail_only` wird von
+    daily_metrics.csv nur der Teil ab `changed_since` neu formatiert und
+    ersetzt (None: keine Zeile geändert), die Zeilen davor bleiben
+    byteweise erhalten.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    daily_path = output_dir / "daily_metrics.csv"
+    key_path = output_dir / "key_metrics.csv"
+
+    if tail_only:
+        written = write_csv_tail(daily_df, daily_path, "date", changed_since)
+    else:
+        written = write_csv(daily_df, daily_path)
+    if written:
+        print(f"Exported daily metrics to {daily_path}")
+    else:
+        print(f"Daily metrics unchanged: {daily_path}")
+
+    if write_csv(key_df, key_path):
+        print(f"Exported key metrics to {key_path}")
+    else:
+        print(f"Key metrics unchanged: {key_path}")
+
+
+def export_windowed_weak_keys(
+    conn: sqlite3.Connection,
+    daily_df: pd.DataFrame,
+    output_dir: Path,
+    weak_windows=(),
+) -> None:
+    """
+    Weak Keys der letzten N Kalendertage (bis zum letzten Tag mit Daten) je
+    Fenster als weak_keys_<N>d.csv. Die Präfixsummen pro Taste und Tag
+    werden einmal aufgebaut und von allen Fenstern geteilt.
+
+    Spalten: key, attempts, errors, avg_latency, miss_rate, weak_score –
+    nur was sich als Differenz von Präfixsummen ergibt; ttke,
+    last_timestamp und die Latenz-Perzentile von weak_keys.csv gibt es
+    pro Fenster nicht. Ohne passende Tasten (oder ohne Daten) wird nur
+    die Kopfzeile geschrieben.
+    """
 
-def export_csvs(daily_df: pd.DataFrame, key_df: pd.DataFrame) -> None:
-    OUTPUT_DIR.mkdir(exist_ok=True)
+    if not weak_windows:
+        return
+
+    prefix = key_prefix_sums(conn)
+    last = None if daily_df.empty else daily_df["date"].max()
+    for days in sorted(set(weak_windows)):
+        since = None if last is None else _shift_date(last, 1 - days)
+        weak_df = windowed_weak_keys(prefix, since=since, until=last)
+        export_weak_keys(weak_df, output_dir, f"weak_keys_{days}d.csv")
+
+
+def build(
+    conn: sqlite3.Connection,
+    incremental: bool = False,
+    engine: str = "sql",
+    output_dir: Path = OUTPUT_DIR,
+    dates=None,
+    windows=(),
+    weak_windows=(),
+    memory_mb: float = DEFAULT_MEMORY_MB,
+) -> tuple:
+    """
+    Metrik-Schritt auf einer offenen Verbindung (Schema bereits geprüft):
+    Tages- und Tastenmetriken berechnen, in die DB schreiben, CSVs
+    exportieren. `dates` sind die vom Import frisch geänderten Tage,
+    `windows` zusätzliche Rolling-Fenster (in Kalendertagen) für daily_metrics.csv,
+    `weak_windows` Zeitfenster (in Kalendertagen) für zusätzliche
+    weak_keys_<N>d.csv, `memory_mb` das Speicherbudget pro Batch für
+    engine="chunked". Liefert (daily_df, key_df) wie exportiert.
+    """
 
-    daily_path = OUTPUT_DIR / "daily_metrics.csv"
-    key_path = OUTPUT_DIR / "key_metrics.csv"
+    tail_only = incremental and not needs_full_daily_rebuild(conn)
+    changed_since = None
 
-    daily_df.to_csv(daily_path, index=False)
-    key_df.to_csv(key_path, index=False)
+    if tail_only:
+        daily_df, changed_since = update_daily_metrics_incremental(conn, dates)
+        key_df = compute_key_metrics(conn)
+    else:
+        if incremental:
+            print("daily_metrics incomplete – falling back to full rebuild.")
+        if engine == "chunked":
+            # Rohtabellen tageweise in Batches innerhalb von memory_mb, Aggregation in pandas
+            daily_df, key_df = compute_all_metrics_chunked(conn, memory_mb)
+        else:
+            daily_df = compute_daily_metrics(conn)
+            key_df = compute_key_metrics(conn)
+        write_daily_metrics(conn, daily_df)
+        write_rolling_state(conn, rolling_state(daily_df))
+        conn.commit()
 
-    print(f"Exported daily metrics to {daily_path}")
-    print(f"Exported key metrics to {key_path}")
+    print(f"Daily rows: {len(daily_df)}")
+    print(f"Key rows:   {len(key_df)}")
 
+    write_key_metrics(conn, key_df)
+    conn.commit()
 
-def main():
-    print(f"Connecting to DB: {DB_PATH}")
-    conn = sqlite3.connect(DB_PATH)
+    daily_df = add_window_columns(conn, daily_df, windows)
+    export_csvs(daily_df, key_df, output_dir, tail_only, changed_since)
 
-    try:
-        daily_df = compute_daily_metrics(conn)
-        key_df = compute_key_metrics(conn)
+    # Erst jetzt sind die Tage auch in der CSV; bricht der Export ab, holt
+    # der nächste inkrementelle Build sie nach
+    conn.execute("DELETE FROM pending_dates;")
+    conn.commit()
 
-        print(f"Daily rows: {len(daily_df)}")
-        print(f"Key rows:   {len(key_df)}")
+    # Weak Keys berechnen & exportieren (optional)
+    weak_df = get_weak_keys(key_df, min_attempts=200, top_n=20)
+    export_weak_keys(weak_df, output_dir)
+    export_windowed_weak_keys(conn, daily_df, output_dir, weak_windows)
 
-        write_daily_metrics(conn, daily_df)
-        write_key_metrics(conn, key_df)
+    print("Metric build finished successfully.")
+    return daily_df, key_df
 
-        export_csvs(daily_df, key_df)
 
-        # Weak Keys berechnen & exportieren (optional)
-        weak_df = get_weak_keys(key_df, min_attempts=200, top_n=20)
-        export_weak_keys(weak_df, OUTPUT_DIR)
+def main(
+    incremental: bool = False,
+    engine: str = "sql",
+    db_path: Path = DB_PATH,
+    output_dir: Path = OUTPUT_DIR,
+    windows=(),
+    weak_windows=(),
+    memory_mb: float = DEFAULT_MEMORY_MB,
+):
+    print(f"Connecting to DB: {db_path}")
+    conn = sqlite3.connect(db_path)
 
-        print("Metric build finished successfully.")
+    try:
+        apply_pragmas(conn)
+        ensure_schema(conn)
+        build(
+            conn,
+            incremental=incremental,
+            engine=engine,
+            output_dir=output_dir,
+            windows=windows,
+            weak_windows=weak_windows,
+            memory_mb=memory_mb,
+        )
     finally:
         conn.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build metrics tables and CSVs from the KeyBR DB.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Recompute only days touched by imports since the last build.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["sql", "chunked"],
+        default="sql",
+        help=(
+            "Full rebuild via SQL GROUP BY queries (default), or 'chunked': the raw "
+            "tables read in batches of whole days and aggregated in pandas, for DBs "
+            "larger than RAM (see --memory-mb)."
+        ),
+    )
+    parser.add_argument(
+        "--memory-mb",
+        type=float,
+        default=DEFAULT_MEMORY_MB,
+        metavar="MB",
+        help=f"Memory budget per batch for --engine chunked (default: {DEFAULT_MEMORY_MB}).",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        action="append",
+        default=[],
+        metavar="DAYS",
+        help=(
+            "Extra rolling window in calendar days; adds rolling_<DAYS>d_* columns "
+            "to daily_metrics.csv (repeatable)."
+        ),
+    )
+    parser.add_argument(
+        "--weak-window",
+        type=int,
+        action="append",
+        default=[],
+        metavar="DAYS",
+        help=(
+            "Also rank weak keys over the last DAYS calendar days; writes "
+            "weak_keys_<DAYS>d.csv (repeatable, e.g. --weak-window 7 --weak-window 30)."
+        ),
+    )
+    args = parser.parse_args()
+    if any(days < 1 for days in args.window):
+        parser.error("--window must be at least 1 day")
+    if any(days < 1 for days in args.weak_window):
+        parser.error("--weak-window must be at least 1 day")
+    if args.memory_mb <= 0:
+        parser.error("--memory-mb must be positive")
+    main(
+        incremental=args.incremental,
+        engine=args.engine,
+        windows=args.window,
+        weak_windows=args.weak_window,
+        memory_mb=args.memory_mb,
+    )
@@ -0,0 +1,165 @@
+# scripts/bulk_writer.py
+
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pandas is only needed by callers that pass DataFrames
+    import pandas as pd
+
+# Default connection tuning for bulk loads. WAL + synchronous=NORMAL is safe
+# against application crashes and much faster than the rollback journal;
+# a negative cache_size is in KiB (here: 64 MiB page cache).
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+}
+
+# Rows per executemany() call
+BULK_BATCH_SIZE = 10_000
+
+
+def apply_pragmas(conn: sqlite3.Connection, **pragmas) -> None:
+    """Apply connection pragmas (DEFAULT_PRAGMAS, overridden by keyword args)."""
+    settings = {**DEFAULT_PRAGMAS, **pragmas}
+    for name, value in settings.items():
+        if value is None:
+            continue
+        conn.execute(f"PRAGMA {name} = {value};")
+
+
+def add_pragma_arguments(parser) -> None:
+    """Add --journal-mode/--synchronous/--cache-size options to an ArgumentParser."""
+    parser.add_argument(
+        "--journal-mode",
+        default=DEFAULT_PRAGMAS["journal_mode"],
+        help=f"SQLite journal_mode (default: {DEFAULT_PRAGMAS['journal_mode']}).",
+    )
+    parser.add_argument(
+        "--synchronous",
+        default=DEFAULT_PRAGMAS["synchronous"],
+        help=f"SQLite synchronous level (default: {DEFAULT_PRAGMAS['synchronous']}).",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_PRAGMAS["cache_size"],
+        help=f"SQLite cache_size, negative = KiB (default: {DEFAULT_PRAGMAS['cache_size']}).",
+    )
+
+
+def pragmas_from_args(args) -> dict:
+    """Pragma settings from options added by add_pragma_arguments()."""
+    return {
+        "journal_mode": args.journal_mode,
+        "synchronous": args.synchronous,
+        "cache_size": args.cache_size,
+    }
+
+
+def dataframe_rows(df: "pd.DataFrame"):
+    """Rows of a DataFrame as plain Python tuples, NaN/NaT mapped to None."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+@contextmanager
+def deferred_indexes(conn: sqlite3.Connection, tables):
+    """
+    Drop the secondary (non-unique) indexes of `tables` for the duration of a
+    large load and recreate them afterwards, so SQLite builds each index once
+    instead of updating it per row. Unique indexes stay, they enforce data
+    integrity during the load.
+
+    The drop happens inside the caller's transaction, so a rollback restores
+    the indexes as well.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN;")
+
+    dropped = []
+    for table in tables:
+        unique = {row[1] for row in conn.execute(f"PRAGMA index_list({table});") if row[2]}
+        for name, sql in conn.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL;",
+            (table,),
+        ).fetchall():
+            if name in unique:
+                continue
+            conn.execute(f"DROP INDEX {name};")
+            dropped.append((name, sql))
+
+    try:
+        yield
+    finally:
+        start = time.perf_counter()
+        for _name, sql in dropped:
+            conn.execute(sql)
+        if dropped:
+            print(
+                f"Rebuilt {len(dropped)} index(es) in "
+                f"{time.perf_counter() - start:.2f}s"
+            )
+
+
+class BulkWriter:
+    """
+    Prepared executemany() inserts in fixed-size batches.
+
+    The writer never commits: all writes of a run share the caller's
+    transaction. Rows and time are tracked per table for report().
+    """
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = BULK_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.stats = {}
+
+    def insert(self, table: str, columns, rows, verb: str = "INSERT") -> int:
+        """
+        Insert an iterable of row tuples. `verb` may be e.g. "INSERT OR IGNORE"
+        or "INSERT OR REPLACE". Returns the number of rows passed in.
+        """
+        columns = list(columns)
+        sql = (
+            f"{verb} INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))});"
+        )
+
+        start = time.perf_counter()
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.conn.executemany(sql, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.conn.executemany(sql, batch)
+            total += len(batch)
+
+        self._track(table, total, time.perf_counter() - start)
+        return total
+
+    def insert_dataframe(self, table: str, df: "pd.DataFrame", verb: str = "INSERT") -> int:
+        """Insert all rows of a DataFrame (column names = table columns)."""
+        return self.insert(table, df.columns, dataframe_rows(df), verb=verb)
+
+    def replace_all(self, table: str, df: "pd.DataFrame") -> int:
+        """DELETE + insert in the same transaction (no commit in between)."""
+        self.conn.execute(f"DELETE FROM {table};")
+        return self.insert_dataframe(table, df)
+
+    def _track(self, table: str, rows: int, seconds: float) -> None:
+        entry = self.stats.setdefault(table, [0, 0.0])
+        entry[0] += rows
+        entry[1] += seconds
+
+    def report(self) -> None:
+        """Print rows written and throughput per table."""
+        for table, (rows, seconds) in self.stats.items():
+            rate = rows / seconds if seconds > 0 else float("inf")
+            print(f"  {table}: {rows} rows in {seconds:.2f}s ({rate:,.0f} rows/s)")
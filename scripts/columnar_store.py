@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Optional columnar mirror of lessons_raw and keystats_raw.
+
+The mirror holds the raw rows as Arrow IPC files partitioned by month
+(db/columnar/<table>/month=YYYY-MM/part-*.arrow). It is written by the
+ingest step (update_keybr.py --columnar, automatically once it exists) and
+read by the in-memory metric engine (metrics/engine.py, timed by
+benchmark.py), which memory-maps just the columns it needs instead of
+converting every row through the sqlite3 cursor. Arrow IPC rather than Parquet, because
+uncompressed IPC files can be memory-mapped without decoding.
+
+SQLite stays the source of truth. New part files are only published in
+manifest.json after the DB commit, and the manifest records a fingerprint
+(row count, max id) of each raw table. If the DB was changed behind the
+mirror's back (initial_import.py, schema migrations), the fingerprints no
+longer match: readers fall back to SQLite and the next publish rebuilds
+the mirror from the DB.
+
+Requires pyarrow.
+
+Examples:
+    python3 scripts/columnar_store.py            # build or refresh the mirror
+    python3 scripts/columnar_store.py --rebuild  # rewrite it from scratch (merges small parts)
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from metrics.columnar import (
+    FORMAT_VERSION,
+    MANIFEST_NAME,
+    MIRRORED_TABLES,
+    arrow,
+    arrow_available,
+    mirror_is_current,
+    mirror_schema,
+    read_manifest,
+    table_fingerprint,
+)
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+
+
+def mirror_dir_for(db_path: Path) -> Path:
+    """The mirror lives next to its DB: <db dir>/columnar."""
+    return Path(db_path).parent / "columnar"
+
+
+COLUMNAR_DIR = mirror_dir_for(DB_PATH)
+
+# Rows buffered per table before they are written out as part files
+FLUSH_ROWS = 500_000
+
+
+class ColumnarStore:
+    """
+    Writer for the columnar mirror. append() buffers rows per month,
+    publish() writes the remaining parts and makes them visible after the
+    caller's DB commit, discard() drops everything not yet published.
+    """
+
+    def __init__(self, root: Path = COLUMNAR_DIR, flush_rows: int = FLUSH_ROWS):
+        self.root = Path(root)
+        self.flush_rows = flush_rows
+        self._run = f"{time.time_ns() // 1_000_000}-{os.getpid()}"
+        self._seq = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._columns = {}
+        self._buffers = {table: {} for table in MIRRORED_TABLES}
+        self._buffered = dict.fromkeys(MIRRORED_TABLES, 0)
+        self._staged = {table: [] for table in MIRRORED_TABLES}
+        self._staged_rows = dict.fromkeys(MIRRORED_TABLES, 0)
+
+    def exists(self) -> bool:
+        return read_manifest(self.root) is not None
+
+    def append(self, table: str, columns, rows) -> None:
+        """Buffer row tuples (with a `date` column) of a mirrored table."""
+        columns = tuple(columns)
+        self._columns[table] = columns
+        date_index = columns.index("date")
+        buffers = self._buffers[table]
+        for row in rows:
+            month = row[date_index][:7] if row[date_index] else "unknown"
+            buffers.setdefault(month, []).append(row)
+            self._buffered[table] += 1
+
+        if self._buffered[table] >= self.flush_rows:
+            self._flush(table)
+
+    def _flush(self, table: str) -> None:
+        """Write the buffered rows of `table` as one part file per month."""
+        if not self._buffers[table]:
+            return
+
+        pa = arrow()
+        schema = mirror_schema(table)
+        columns = self._columns[table]
+        for month, rows in sorted(self._buffers[table].items()):
+            data = dict(zip(columns, zip(*rows)))
+            arrow_table = pa.Table.from_pydict(
+                {name: data[name] for name in schema.names}, schema=schema
+            )
+
+            self._seq += 1
+            part = f"{table}/month={month}/part-{self._run}-{self._seq:05d}.arrow"
+            path = self.root / part
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with pa.ipc.new_file(str(path), schema) as writer:
+                writer.write_table(arrow_table)
+
+            self._staged[table].append(part)
+            self._staged_rows[table] += len(rows)
+
+        self._buffers[table] = {}
+        self._buffered[table] = 0
+
+    def publish(self, conn: sqlite3.Connection) -> None:
+        """
+        Make the appended rows part of the mirror; call after the DB commit.
+        Rebuilds the mirror instead if it is missing or does not match the
+        DB it is supposed to mirror.
+        """
+        for table in MIRRORED_TABLES:
+            self._flush(table)
+
+        if not any(self._staged_rows.values()) and mirror_is_current(conn, self.root):
+            self._reset()
+            return
+
+        # A missing mirror counts as empty: a first load into an empty DB
+        # publishes its parts directly, anything else needs a rebuild
+        manifest = read_manifest(self.root) or {"tables": {}}
+
+        tables = {}
+        for table in MIRRORED_TABLES:
+            entry = manifest["tables"].get(table, {"parts": [], "fingerprint": {}})
+            fingerprint = table_fingerprint(conn, table)
+            expected_rows = entry["fingerprint"].get("rows", 0) + self._staged_rows[table]
+            if fingerprint["rows"] != expected_rows:
+                print(f"Columnar mirror missing or out of sync with {table} – rebuilding ...")
+                self.rebuild(conn)
+                return
+            tables[table] = {
+                "parts": entry["parts"] + self._staged[table],
+                "fingerprint": fingerprint,
+            }
+
+        self._write_manifest(tables)
+        added = sum(self._staged_rows.values())
+        self._reset()
+        if added:
+            print(f"Columnar mirror: {added} rows published to {self.root}")
+
+    def discard(self) -> None:
+        """Delete part files that were written but never published."""
+        for parts in self._staged.values():
+            for part in parts:
+                (self.root / part).unlink(missing_ok=True)
+        self._reset()
+
+    def rebuild(self, conn: sqlite3.Connection) -> None:
+        """Rewrite the whole mirror from the DB (also merges small parts)."""
+        self.discard()
+        start = time.perf_counter()
+
+        tables = {}
+        for table in MIRRORED_TABLES:
+            columns = mirror_schema(table).names
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id;")
+            for rows in iter(lambda: cursor.fetchmany(self.flush_rows), []):
+                self.append(table, columns, rows)
+            self._flush(table)
+
+            tables[table] = {
+                "parts": self._staged[table],
+                "fingerprint": table_fingerprint(conn, table),
+            }
+
+        self._write_manifest(tables)
+        rows = sum(self._staged_rows.values())
+        self._reset()
+        print(f"Columnar mirror rebuilt: {rows} rows in {time.perf_counter() - start:.2f}s")
+
+    def _write_manifest(self, tables: dict) -> None:
+        """Replace manifest.json atomically, then delete parts no longer listed."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        manifest = {"version": FORMAT_VERSION, "tables": tables}
+        tmp = self.root / (MANIFEST_NAME + ".tmp")
+        tmp.write_text(json.dumps(manifest, indent=1) + "\n")
+        os.replace(tmp, self.root / MANIFEST_NAME)
+
+        listed = {part for entry in tables.values() for part in entry["parts"]}
+        for table in MIRRORED_TABLES:
+            for path in (self.root / table).glob("month=*/*.arrow"):
+                if path.relative_to(self.root).as_posix() not in listed:
+                    path.unlink()
+            for month_dir in (self.root / table).glob("month=*"):
+                if not any(month_dir.iterdir()):
+                    month_dir.rmdir()
+
+
+def open_store(enable: bool = False, root: Path = COLUMNAR_DIR):
+    """
+    The mirror an import should maintain: requested via `enable`, or kept
+    up to date because it already exists. None if there is nothing to do.
+    """
+    store = ColumnarStore(root)
+    if not (enable or store.exists()):
+        return None
+    if not arrow_available():
+        if enable:
+            raise SystemExit("The columnar mirror needs pyarrow (pip install pyarrow).")
+        print("pyarrow not installed – columnar mirror not updated (rebuilt on next use).")
+        return None
+    return store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build or refresh the columnar mirror of the raw tables.")
+    parser.add_argument("--rebuild", action="store_true", help="Rewrite the mirror from scratch.")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help=f"SQLite DB (default: {DB_PATH}).")
+    parser.add_argument("--dir", type=Path, help="Mirror directory (default: <db dir>/columnar).")
+    args = parser.parse_args()
+    args.dir = args.dir or mirror_dir_for(args.db)
+
+    store = open_store(enable=True, root=args.dir)
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.rebuild:
+            store.rebuild(conn)
+        elif mirror_is_current(conn, args.dir):
+            print(f"Columnar mirror at {args.dir} is up to date.")
+        else:
+            store.publish(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Retention for keystats_raw: roll the keystats of old days up into
+keystats_daily (one row per day and key: hits, misses, latency sum, count
+and minimum, ...), delete the compacted raw rows and VACUUM the DB file.
+
+The metrics do not change. compute_daily_metrics reads the per-lesson
+summary (lesson_metrics) and compute_key_metrics the running per-key sums
+(key_stats_acc); both are kept up to date at ingest time and are not
+touched here. The in-memory engines and the rebuild functions add the
+rollup to what is left in keystats_raw (see metrics/compaction.py).
+Before anything is deleted, the summaries are rebuilt if they are
+missing, since the raw rows are their last source.
+
+The horizon is --keep-days days back from the newest lesson (default
+365), or an explicit --before date. Run it as often as you like: days
+that are already compacted are skipped, and lessons imported later for a
+compacted day are rolled in by the next run.
+
+Examples:
+    python3 scripts/compact_keystats.py                      # keep the last 365 days raw
+    python3 scripts/compact_keystats.py --keep-days 90
+    python3 scripts/compact_keystats.py --before 2024-01-01 --dry-run
+"""
+
+import argparse
+import sqlite3
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from bulk_writer import apply_pragmas
+from columnar_store import mirror_dir_for, open_store
+from metrics.compaction import compact_keystats_before, compacted_through
+from metrics.cube import ensure_cube
+from metrics.keys import ensure_key_accumulators
+from metrics.lessons import ensure_lesson_metrics
+from metrics.sketch import ensure_latency_sketches
+from pipeline_manifest import db_data_version, load_manifest, manifest_path_for, save_manifest
+from schema import ensure_schema
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+
+KEEP_DAYS = 365
+
+
+def default_horizon(conn: sqlite3.Connection, keep_days: int):
+    """First day kept raw: `keep_days` days up to the newest lesson (None without lessons)."""
+    newest = conn.execute("SELECT MAX(date) FROM lessons_raw;").fetchone()[0]
+    if newest is None:
+        return None
+    return (date.fromisoformat(newest) - timedelta(days=keep_days - 1)).isoformat()
+
+
+def ensure_summaries(conn: sqlite3.Connection) -> None:
+    """Fill the ingest-time summaries that are still empty while keystats_raw has their rows."""
+    ensure_lesson_metrics(conn)
+    ensure_cube(conn)
+    ensure_key_accumulators(conn)
+    ensure_latency_sketches(conn)
+
+
+def file_mb(path: Path) -> float:
+    return Path(path).stat().st_size / 2**20
+
+
+def compact(
+    db_path: Path = DB_PATH,
+    before: str = None,
+    keep_days: int = KEEP_DAYS,
+    vacuum: bool = True,
+    dry_run: bool = False,
+) -> int:
+    """
+    Compact the keystats of the days before `before` (default: see
+    default_horizon) and reclaim the space. Returns the raw rows removed.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        apply_pragmas(conn)
+        ensure_schema(conn)
+
+        before = before or default_horizon(conn, keep_days)
+        if before is None:
+            print("No lessons – nothing to compact.")
+            return 0
+
+        rows, days = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT date) FROM keystats_raw WHERE date < ?;", (before,)
+        ).fetchone()
+        print(
+            f"Keystats before {before}: {rows} raw rows on {days} day(s) "
+            f"(compacted through: {compacted_through(conn) or '-'})."
+        )
+        if dry_run or rows == 0:
+            return 0
+
+        ensure_summaries(conn)
+
+        manifest_path = manifest_path_for(db_path)
+        manifest = load_manifest(manifest_path)
+        version_before = db_data_version(conn)
+
+        start = time.perf_counter()
+        removed = compact_keystats_before(conn, before)
+        print(f"Rolled {removed} raw rows up into keystats_daily in {time.perf_counter() - start:.2f}s.")
+
+        # Same data, new raw-table fingerprints: keep the pipeline from
+        # re-ingesting and rebuilding because of the compaction alone
+        if manifest.get("db") == version_before:
+            manifest["db"] = db_data_version(conn)
+            save_manifest(manifest_path, manifest)
+
+        store = open_store(root=mirror_dir_for(db_path))
+        if store is not None:
+            store.rebuild(conn)
+
+        if vacuum:
+            size = file_mb(db_path)
+            start = time.perf_counter()
+            conn.execute("VACUUM;")
+            print(f"VACUUM: {size:.1f} MB -> {file_mb(db_path):.1f} MB in {time.perf_counter() - start:.2f}s.")
+        return removed
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Roll old keystats_raw rows up into keystats_daily.")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help=f"SQLite DB (default: {DB_PATH}).")
+    horizon = parser.add_mutually_exclusive_group()
+    horizon.add_argument(
+        "--keep-days",
+        type=int,
+        default=KEEP_DAYS,
+        metavar="DAYS",
+        help=f"Keep the keystats of the last DAYS days (up to the newest lesson) raw (default: {KEEP_DAYS}).",
+    )
+    horizon.add_argument(
+        "--before",
+        metavar="YYYY-MM-DD",
+        help="Compact the keystats of all days before this date instead.",
+    )
+    parser.add_argument("--no-vacuum", action="store_true", help="Do not VACUUM the DB file afterwards.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be compacted.")
+    args = parser.parse_args()
+
+    if args.keep_days < 1:
+        parser.error("--keep-days must be at least 1")
+    if args.before is not None:
+        try:
+            date.fromisoformat(args.before)
+        except ValueError:
+            parser.error("--before must be a date (YYYY-MM-DD)")
+
+    compact(args.db, args.before, args.keep_days, vacuum=not args.no_vacuum, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic KeyBR export (typing-data.json) for tests and benchmarks.
+
+The output has the same shape as a real export: a top-level JSON array of
+lessons with layout, textType, timeStamp, length, time, errors, speed and a
+per-key histogram (codePoint, hitCount, missCount, timeToType). Values follow
+a simple learning curve: speed rises and the error rate falls over the
+covered period, and rare / awkward keys are slower and missed more often.
+
+Examples:
+    python3 scripts/generate_synthetic_export.py --lessons 100000 --days 730
+    python3 scripts/generate_synthetic_export.py --lessons 10000 --layouts en-us de-de \\
+        --histogram-size 15-30 --out /tmp/typing-data.json
+"""
+
+import argparse
+import json
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+# Next to the benchmark exports (git-ignored), not in raw/ with the real data
+DEFAULT_OUT = ROOT_DIR / "bench" / "work" / "synthetic-typing-data.json"
+
+# Relative letter frequencies (per mille) per layout; space and a few
+# punctuation keys are added to every layout.
+_LETTERS = {
+    "en-us": "e127 t91 a82 o75 i70 n67 s63 h61 r60 d43 l40 c28 u28 m24 w24 f22 "
+    "g20 y20 p19 b15 v10 k8 j2 x2 q1 z1",
+    "de-de": "e174 n98 i76 s73 r70 a65 t62 d51 h48 u44 l34 c31 g30 m25 o25 b19 "
+    "w19 f17 k12 z11 p8 v7 ü7 ä5 ß3 ö3 j3 y1 x1 q1",
+    "fr-fr": "e147 a76 i75 s79 n71 t72 r66 u63 l55 o54 d37 c33 p30 m30 é19 v16 "
+    "q14 f11 b9 g9 h7 j6 à5 x4 è3 y3 z1 k1 w1",
+}
+_COMMON_KEYS = [(" ", 180), (",", 10), (".", 9), ("-", 3), ("!", 1), ("?", 1)]
+
+TEXT_TYPES = ["generated", "natural", "numbers", "code"]
+
+
+def _layout_keys(layout: str) -> list:
+    """[(char, weight), ...] for a layout."""
+    spec = _LETTERS.get(layout, _LETTERS["en-us"])
+    keys = [(item[0], int(item[1:])) for item in spec.split()]
+    return keys + _COMMON_KEYS
+
+
+def parse_range(text: str) -> tuple:
+    """'20' -> (20, 20), '15-30' -> (15, 30)."""
+    lo, _, hi = text.partition("-")
+    lo = int(lo)
+    hi = int(hi) if hi else lo
+    if lo < 1 or hi < lo:
+        raise argparse.ArgumentTypeError(f"invalid range: {text!r}")
+    return lo, hi
+
+
+def iter_lessons(
+    lessons: int,
+    days: int,
+    histogram_size: tuple = (15, 30),
+    layouts=("en-us",),
+    seed: int = 42,
+    start: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc),
+):
+    """Yield `lessons` lesson dicts in chronological order over `days` days."""
+    rng = random.Random(seed)
+
+    # Per-layout key tables and a fixed "difficulty" per key (1.0 = average)
+    tables = {}
+    for layout in layouts:
+        keys = _layout_keys(layout)
+        total = sum(w for _, w in keys)
+        tables[layout] = [
+            (ord(ch), w / total, 0.8 + 0.6 * rng.random() + 0.4 / math.sqrt(w))
+            for ch, w in keys
+        ]
+
+    # Spread lessons over practice days (~80 % of days, uneven volume)
+    practice_days = [d for d in range(days) if rng.random() < 0.8] or [0]
+    weights = [rng.expovariate(1.0) for _ in practice_days]
+    scale = lessons / sum(weights)
+    per_day = [int(w * scale) for w in weights]
+    for i in range(lessons - sum(per_day)):
+        per_day[i % len(per_day)] += 1
+
+    produced = 0
+    for day, count in zip(practice_days, per_day):
+        if count == 0:
+            continue
+
+        progress = day / max(days - 1, 1)
+        t = start + timedelta(days=day, hours=rng.uniform(6, 20))
+        for _ in range(count):
+            layout = layouts[0] if rng.random() < 0.85 else rng.choice(layouts)
+            keys = tables[layout]
+
+            # Learning curve: 150 -> 320 CPM, 8 % -> 3 % errors
+            cpm = max(60.0, rng.gauss(150 + 170 * progress, 18))
+            error_rate = max(0.0, rng.gauss(0.08 - 0.05 * progress, 0.012))
+
+            length = rng.randint(80, 220)
+            time_ms = int(length / cpm * 60_000)
+            errors = max(0, int(round(rng.gauss(length * error_rate, 2))))
+
+            lo, hi = histogram_size
+            size = min(rng.randint(lo, hi), len(keys))
+            histogram = []
+            for code_point, freq, difficulty in rng.sample(keys, size):
+                hits = max(1, int(round(length * freq * rng.uniform(0.6, 1.4))))
+                expected_miss = hits * error_rate * difficulty
+                misses = max(0, int(round(rng.gauss(expected_miss, math.sqrt(expected_miss + 0.25)))))
+                latency = 60_000 / cpm * difficulty * rng.lognormvariate(0, 0.25)
+                histogram.append(
+                    {
+                        "codePoint": code_point,
+                        "hitCount": hits,
+                        "missCount": misses,
+                        "timeToType": int(latency),
+                    }
+                )
+
+            yield {
+                "layout": layout,
+                "textType": rng.choice(TEXT_TYPES),
+                "timeStamp": t.strftime("%Y-%m-%dT%H:%M:%S.") + f"{t.microsecond // 1000:03d}Z",
+                "length": length,
+                "time": time_ms,
+                "errors": errors,
+                "speed": round(cpm, 2),
+                "histogram": histogram,
+            }
+
+            produced += 1
+            # Next lesson: lesson duration plus a short pause, now and then a break
+            pause = rng.uniform(5, 40) if rng.random() < 0.9 else rng.uniform(600, 5400)
+            t += timedelta(milliseconds=time_ms + int(pause * 1000) + rng.randint(0, 999))
+
+
+def generate_export(path: Path, lessons: int, days: int, **kwargs) -> int:
+    """
+    Write a synthetic export to `path` lesson by lesson (constant memory).
+    Returns the number of lessons written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    with path.open("w", encoding="utf-8") as f:
+        f.write("[")
+        for lesson in iter_lessons(lessons, days, **kwargs):
+            if written:
+                f.write(",\n")
+            json.dump(lesson, f, ensure_ascii=False, separators=(",", ":"))
+            written += 1
+        f.write("]\n")
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic KeyBR JSON export.")
+    parser.add_argument("--lessons", type=int, default=10_000, help="Number of lessons (default: 10000).")
+    parser.add_argument("--days", type=int, default=365, help="Days covered by the export (default: 365).")
+    parser.add_argument(
+        "--histogram-size",
+        type=parse_range,
+        default=(15, 30),
+        help="Keys per lesson histogram, N or MIN-MAX (default: 15-30).",
+    )
+    parser.add_argument(
+        "--layouts",
+        nargs="+",
+        default=["en-us"],
+        help=f"Keyboard layouts to mix; the first dominates (known: {', '.join(_LETTERS)}).",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42).")
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help=f"Output file (default: {DEFAULT_OUT}).")
+    args = parser.parse_args()
+
+    n = generate_export(
+        args.out,
+        args.lessons,
+        args.days,
+        histogram_size=args.histogram_size,
+        layouts=args.layouts,
+        seed=args.seed,
+    )
+    print(f"Wrote {n} lessons to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
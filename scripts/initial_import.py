@@ -1,63 +1,407 @@
+#!/usr/bin/env python3
+"""
+Bulk backfill of raw/lessons.csv and raw/keystats.csv into the SQLite DB.
+
+The CSVs are read in blocks of whole records (--chunk-mb), and each block
+is parsed by a pool of worker processes (--workers) with explicit column
+types. The workers also derive date, epoch_ms and lesson_hash, so the
+rows come back finished, in update_keybr's column order. One writer in
+the main process inserts the parsed blocks in file order. Everything
+goes into a single transaction, and the raw-table indexes are rebuilt
+once at the end. Progress and throughput are printed per block.
+
+Re-running is safe: rows that are already in the DB are ignored through
+the unique lesson and keystats identities. Keystats rows without a single
+lesson of their timestamp get a deterministic identity of their own
+(lesson_identity.unlinked_hash), so they are not loaded twice either.
+Keystats of days that were already compacted (compact_keystats.py) are
+skipped, since the raw tables no longer hold those days.
+
+Examples:
+    python3 scripts/initial_import.py
+    python3 scripts/initial_import.py --workers 8 --chunk-mb 64
+    python3 scripts/initial_import.py --lessons old/lessons.csv --keystats old/keystats.csv
+"""
+
+import argparse
+import io
+import os
 import sqlite3
-import pandas as pd
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
-DB_PATH = Path("../db/keybr.db")
+import numpy as np
+import pandas as pd
+
+from bulk_writer import (
+    BulkWriter,
+    add_pragma_arguments,
+    apply_pragmas,
+    deferred_indexes,
+    pragmas_from_args,
+)
+from lesson_identity import lesson_hash, unlinked_hash
+from metrics.compaction import compacted_through
+from metrics.cube import rebuild_cube
+from metrics.keys import rebuild_key_accumulators
+from metrics.lessons import rebuild_lesson_metrics
+from metrics.sketch import rebuild_latency_sketches
+from schema import ensure_schema
+from update_keybr import KEYSTATS_COLUMNS, LESSON_COLUMNS, mark_pending_dates, timestamp_keys
+
+# Base directory of the repo; absolute paths so the script works from anywhere
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+
+LESSONS_CSV = ROOT_DIR / "raw" / "lessons.csv"
+KEYSTATS_CSV = ROOT_DIR / "raw" / "keystats.csv"
+
+# CSV bytes per parse task
+CHUNK_MB = 16
+
+# Column types of the CSVs. Integer columns are parsed as float64 (NULL as
+# NaN; pandas' nullable Int64 parser is several times slower) and handed
+# to SQLite as Python ints again, see _int_values().
+LESSON_DTYPES = {
+    "timeStamp": "str",
+    "layout": "str",
+    "textType": "str",
+    "length": "int",
+    "time_ms": "int",
+    "errors": "int",
+    "speed": "float64",
+}
+
+KEYSTATS_DTYPES = {
+    "timeStamp": "str",
+    "codePoint": "int",
+    "key": "str",
+    "hitCount": "int",
+    "missCount": "int",
+    "timeToType_ms": "int",
+}
+
+# Set in each worker by _init_parser(): lesson_hash by timeStamp for the
+# keystats, and the last compacted day
+_PARSER_STATE = {}
+
+
+def csv_blocks(path: Path, block_bytes: int):
+    """
+    Yield (header, block, bytes read so far) for a CSV file: blocks of
+    about `block_bytes` that end at a record boundary (a newline outside
+    quotes), so each one parses on its own.
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        rest = b""
+        while True:
+            data = f.read(block_bytes)
+            if not data:
+                break
+            data = rest + data
+            cut = _record_end(data)
+            block, rest = data[:cut], data[cut:]
+            if block:
+                yield header, block, f.tell() - len(rest)
+        if rest.strip():
+            yield header, rest, f.tell()
+
+
+def _record_end(data: bytes) -> int:
+    """End of the last complete record in `data` (0 if there is none)."""
+    pos = data.rfind(b"\n")
+    while pos >= 0:
+        # an even number of quotes before the newline: it ends a record
+        if data.count(b'"', 0, pos) % 2 == 0:
+            return pos + 1
+        pos = data.rfind(b"\n", 0, pos)
+    return 0
+
+
+def _int_values(values: np.ndarray) -> list:
+    """Integer column parsed as float64 -> Python ints, NaN -> None."""
+    missing = np.isnan(values)
+    ints = np.where(missing, 0, values).astype(np.int64).tolist()
+    for i in np.flatnonzero(missing):
+        ints[i] = None
+    return ints
+
+
+def _read_columns(header: bytes, block: bytes, dtypes: dict) -> dict:
+    """Parse one CSV block into per-column lists of Python values (None for missing)."""
+    read_dtypes = {col: "float64" if dtype == "int" else dtype for col, dtype in dtypes.items()}
+    df = pd.read_csv(io.BytesIO(header + block), dtype=read_dtypes, usecols=list(dtypes))
 
-LESSONS_CSV = Path("../raw/lessons.csv")
-KEYSTATS_CSV = Path("../raw/keystats.csv")
+    columns = {}
+    for col, dtype in dtypes.items():
+        if dtype == "int":
+            columns[col] = _int_values(df[col].to_numpy())
+        else:
+            series = df[col]
+            columns[col] = series.astype(object).where(series.notna(), None).tolist()
+    return columns
 
-def import_lessons(cursor):
-    print("Importing lessons.csv...")
 
-    df = pd.read_csv(LESSONS_CSV)
+def _time_keys(timestamps: list) -> tuple:
+    """(dates, epochs) per row; timestamp_keys() runs once per distinct timestamp."""
+    codes, distinct = pd.factorize(np.array(timestamps, dtype=object), use_na_sentinel=False)
+    keys = [timestamp_keys(ts) for ts in distinct]
+    dates = np.array([k[0] for k in keys], dtype=object)[codes]
+    epochs = np.array([k[1] for k in keys], dtype=object)[codes]
+    return dates.tolist(), epochs.tolist()
 
-    df = df.rename(columns={
-        "timeStamp": "timeStamp",
-        "layout": "layout",
-        "textType": "textType",
-        "length": "length",
-        "time_ms": "time_ms",
-        "errors": "errors",
-        "speed": "speed"
-    })
 
-    df.to_sql("lessons_raw", cursor.connection, if_exists="append", index=False)
-    print(f"Inserted {len(df)} lesson rows.")
+def _init_parser(hash_by_ts: dict = None, last_compacted: str = None) -> None:
+    _PARSER_STATE["hash_by_ts"] = hash_by_ts or {}
+    _PARSER_STATE["last_compacted"] = last_compacted
 
 
-def import_keystats(cursor):
-    print("Importing keystats.csv...")
+def parse_lessons_block(header: bytes, block: bytes) -> tuple:
+    """lessons_raw rows (LESSON_COLUMNS order) of one CSV block."""
+    columns = _read_columns(header, block, LESSON_DTYPES)
+    fields = list(zip(*columns.values()))
+    dates, epochs = _time_keys(columns["timeStamp"])
+    hashes = [lesson_hash(*row) for row in fields]
 
-    df = pd.read_csv(KEYSTATS_CSV)
+    rows = list(zip(*columns.values(), dates, epochs, hashes))
+    return rows, 0
 
-    df = df.rename(columns={
-        "timeStamp": "timeStamp",
-        "codePoint": "codePoint",
-        "key": "key",
-        "hitCount": "hitCount",
-        "missCount": "missCount",
-        "timeToType_ms": "timeToType_ms"
-    })
 
-    df.to_sql("keystats_raw", cursor.connection, if_exists="append", index=False)
-    print(f"Inserted {len(df)} keystats rows.")
+def parse_keystats_block(header: bytes, block: bytes) -> tuple:
+    """
+    keystats_raw rows (KEYSTATS_COLUMNS order) of one CSV block, linked to
+    their lesson by timeStamp (lesson_hash None if there is no single
+    lesson with it, see hash_unlinked); rows of compacted days are left out (and counted).
+    """
+    columns = _read_columns(header, block, KEYSTATS_DTYPES)
+    dates, epochs = _time_keys(columns["timeStamp"])
+    hash_by_ts = _PARSER_STATE.get("hash_by_ts", {})
+    hashes = [hash_by_ts.get(ts) for ts in columns["timeStamp"]]
 
+    rows = list(zip(*columns.values(), dates, epochs, hashes))
 
-def main():
-    print("Connecting to DB:", DB_PATH)
+    last_compacted = _PARSER_STATE.get("last_compacted")
+    if last_compacted is None:
+        return rows, 0
+    kept = [row for row in rows if row[6] is None or row[6] > last_compacted]
+    return kept, len(rows) - len(kept)
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
 
-    import_lessons(cursor)
-    import_keystats(cursor)
+def hash_unlinked(rows: list, seen: dict) -> list:
+    """
+    Fill in the lesson_hash of rows without a lesson: the n-th such row
+    with a given (timeStamp, codePoint) gets unlinked_hash(timeStamp, n).
+    `seen` carries the counts across the blocks of one file, so the
+    identities only depend on the file, not on how it was cut.
+    """
+    if all(row[-1] is not None for row in rows):
+        return rows
+    linked = []
+    for row in rows:
+        if row[-1] is None:
+            n = seen.get(row[:2], 0)
+            seen[row[:2]] = n + 1
+            row = (*row[:-1], unlinked_hash(row[0], n))
+        linked.append(row)
+    return linked
+
+
+def _parsed_blocks(path: Path, parse, workers: int, chunk_bytes: int, initargs: tuple):
+    """
+    Yield (rows, skipped, bytes read) per block of `path`, in file
+    order. With several workers the blocks are parsed in a process pool,
+    at most two per worker ahead of the writer.
+    """
+    blocks = csv_blocks(path, chunk_bytes)
+    if workers <= 1:
+        _init_parser(*initargs)
+        for header, block, done in blocks:
+            yield (*parse(header, block), done)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_parser, initargs=initargs) as pool:
+        pending = deque()
+        for header, block, done in blocks:
+            pending.append((pool.submit(parse, header, block), done))
+            if len(pending) >= 2 * workers:
+                future, done_before = pending.popleft()
+                yield (*future.result(), done_before)
+        while pending:
+            future, done_before = pending.popleft()
+            yield (*future.result(), done_before)
+
+
+def load_csv(
+    writer,
+    path: Path,
+    table: str,
+    columns,
+    parse,
+    workers: int,
+    chunk_bytes: int,
+    initargs=(),
+    finish=None,
+) -> tuple:
+    """
+    Parse `path` block by block and insert the rows into `table` (INSERT
+    OR IGNORE), after `finish(rows)` if given. The days of the rows that
+    were really inserted are marked pending. Returns (rows parsed, rows
+    inserted, rows skipped).
+    """
+    size = path.stat().st_size
+    start = time.perf_counter()
+    parsed = inserted = skipped = 0
+    last_id = writer.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table};").fetchone()[0]
+
+    blocks = _parsed_blocks(path, parse, workers, chunk_bytes, initargs)
+    for rows, block_skipped, done in blocks:
+        if finish is not None:
+            rows = finish(rows)
+        before = writer.conn.total_changes
+        writer.insert(table, columns, rows, verb="INSERT OR IGNORE")
+        inserted += writer.conn.total_changes - before
+        parsed += len(rows)
+        skipped += block_skipped
+
+        seconds = time.perf_counter() - start
+        print(
+            f"  {path.name}: {done / size:4.0%}  {parsed:,} rows  "
+            f"{parsed / seconds:,.0f} rows/s  {done / 2**20 / seconds:.1f} MB/s",
+            flush=True,
+        )
+
+    # New rows have ids above the previous maximum (AUTOINCREMENT)
+    new_dates = writer.conn.execute(f"SELECT DISTINCT date FROM {table} WHERE id > ?;", (last_id,))
+    mark_pending_dates(writer.conn, (d for (d,) in new_dates))
+    return parsed, inserted, skipped
+
+
+def import_lessons(
+    writer, path: Path = LESSONS_CSV, workers: int = 1, chunk_bytes: int = CHUNK_MB << 20
+) -> None:
+    print(f"Importing {path} ...")
+    parsed, inserted, _ = load_csv(
+        writer, path, "lessons_raw", LESSON_COLUMNS, parse_lessons_block, workers, chunk_bytes
+    )
+    print(f"Inserted {inserted} of {parsed} lesson rows (rest already imported).")
+
+
+def import_keystats(
+    writer, path: Path = KEYSTATS_CSV, workers: int = 1, chunk_bytes: int = CHUNK_MB << 20
+) -> None:
+    print(f"Importing {path} ...")
+
+    # Link rows to their lesson. A timestamp shared by several lessons does
+    # not tell which one a row belongs to: those rows stay unlinked
+    hash_by_ts = dict(
+        writer.conn.execute(
+            "SELECT timeStamp, MIN(lesson_hash) FROM lessons_raw "
+            "GROUP BY timeStamp HAVING COUNT(DISTINCT lesson_hash) = 1;"
+        )
+    )
+    last_compacted = compacted_through(writer.conn)
+
+    parsed, inserted, skipped = load_csv(
+        writer,
+        path,
+        "keystats_raw",
+        KEYSTATS_COLUMNS,
+        parse_keystats_block,
+        workers,
+        chunk_bytes,
+        initargs=(hash_by_ts, last_compacted),
+        finish=partial(hash_unlinked, seen={}),
+    )
+    print(f"Inserted {inserted} of {parsed} keystats rows (rest already imported).")
+    if skipped:
+        print(
+            f"Skipped {skipped} keystats rows of days already compacted "
+            f"(through {last_compacted})."
+        )
+
+
+def main(
+    pragmas: dict = None,
+    db_path: Path = DB_PATH,
+    lessons_csv: Path = LESSONS_CSV,
+    keystats_csv: Path = KEYSTATS_CSV,
+    workers: int = 1,
+    chunk_mb: float = CHUNK_MB,
+):
+    print("Connecting to DB:", db_path)
+
+    conn = sqlite3.connect(db_path)
+    apply_pragmas(conn, **(pragmas or {}))
+    ensure_schema(conn)
+
+    writer = BulkWriter(conn)
+    chunk_bytes = max(1, int(chunk_mb * 2**20))
+    start = time.perf_counter()
+
+    # One transaction for both files, indexes are rebuilt once at the end
+    with deferred_indexes(conn, ["lessons_raw", "keystats_raw"]):
+        import_lessons(writer, lessons_csv, workers, chunk_bytes)
+        import_keystats(writer, keystats_csv, workers, chunk_bytes)
 
     conn.commit()
+    writer.report()
+    print(f"Loaded in {time.perf_counter() - start:.2f}s with {workers} worker(s).")
+
+    # keystats_raw was written directly -> refresh the per-key running sums
+    # latency sketches, per-lesson summary and cube
+    rebuild_key_accumulators(conn)
+    rebuild_latency_sketches(conn)
+    rebuild_lesson_metrics(conn)
+    rebuild_cube(conn)
+
     conn.close()
 
     print("Initial import finished successfully.")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Bulk-load raw/lessons.csv and raw/keystats.csv.")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help=f"SQLite DB (default: {DB_PATH}).")
+    parser.add_argument(
+        "--lessons",
+        type=Path,
+        default=LESSONS_CSV,
+        help=f"Lessons CSV (default: {LESSONS_CSV}).",
+    )
+    parser.add_argument(
+        "--keystats",
+        type=Path,
+        default=KEYSTATS_CSV,
+        help=f"Keystats CSV (default: {KEYSTATS_CSV}).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Parser processes (default: one per CPU; 1 parses in the main process).",
+    )
+    parser.add_argument(
+        "--chunk-mb",
+        type=float,
+        default=CHUNK_MB,
+        metavar="MB",
+        help=f"CSV megabytes per parse task (default: {CHUNK_MB}).",
+    )
+    add_pragma_arguments(parser)
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.chunk_mb <= 0:
+        parser.error("--chunk-mb must be positive")
+    main(
+        pragmas=pragmas_from_args(args),
+        db_path=args.db,
+        lessons_csv=args.lessons,
+        keystats_csv=args.keystats,
+        workers=args.workers,
+        chunk_mb=args.chunk_mb,
+    )
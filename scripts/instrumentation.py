@@ -0,0 +1,214 @@
+# scripts/instrumentation.py
+"""
+Run instrumentation for the pipeline: per-stage wall/CPU time, rows and
+throughput, SQLite statements with their time, and peak RSS, collected into
+a JSON run report.
+
+SQLite timing works through InstrumentedConnection (pass it as `factory`
+to sqlite3.connect): every statement run through the connection or one of
+its cursors is counted and timed, grouped by its SQL text. The time of a
+SELECT covers execute() plus fetchone/fetchmany/fetchall; rows consumed by
+iterating over the cursor are not timed (that would cost a Python call per
+row).
+"""
+
+import json
+import re
+import resource
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Statements listed in the report, slowest first
+TOP_QUERIES = 20
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def max_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Peak resident set size so far (Linux reports KiB, macOS bytes)."""
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _normalize_sql(sql: str) -> str:
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports every execution and fetch to its connection."""
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.record_statement(sql, time.perf_counter() - start, 1)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        if not hasattr(seq_of_parameters, "__len__"):
+            seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.record_statement(
+                sql, time.perf_counter() - start, len(seq_of_parameters)
+            )
+
+    def executescript(self, sql_script):
+        self._sql = sql_script
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.connection.record_statement(sql_script, time.perf_counter() - start, 1)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        rows = fetch(*args)
+        if self._sql is not None:
+            n = len(rows) if isinstance(rows, list) else int(rows is not None)
+            self.connection.record_fetch(self._sql, time.perf_counter() - start, n)
+        return rows
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed_fetch(super().fetchmany)
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection that counts and times statements per SQL text.
+    Usage: sqlite3.connect(path, factory=InstrumentedConnection).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = 0
+        self.query_stats = {}
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    # Connection.execute() & co. create their cursor in C, bypassing cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def _entry(self, sql: str) -> dict:
+        entry = self.query_stats.get(sql)
+        if entry is None:
+            entry = self.query_stats[sql] = {"executions": 0, "seconds": 0.0, "rows_fetched": 0}
+        return entry
+
+    def record_statement(self, sql: str, seconds: float, executions: int) -> None:
+        self.statements += executions
+        entry = self._entry(sql)
+        entry["executions"] += executions
+        entry["seconds"] += seconds
+
+    def record_fetch(self, sql: str, seconds: float, rows: int) -> None:
+        entry = self._entry(sql)
+        entry["seconds"] += seconds
+        entry["rows_fetched"] += rows
+
+    def top_queries(self, limit: int = TOP_QUERIES) -> list:
+        """The `limit` statements with the most total time, for the report."""
+        merged = {}
+        for sql, entry in self.query_stats.items():
+            target = merged.setdefault(
+                _normalize_sql(sql), {"executions": 0, "seconds": 0.0, "rows_fetched": 0}
+            )
+            for k in target:
+                target[k] += entry[k]
+        ranked = sorted(merged.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        return [
+            {"sql": sql[:300], **entry, "seconds": round(entry["seconds"], 4)}
+            for sql, entry in ranked[:limit]
+        ]
+
+
+class RunReport:
+    """
+    Collects the measurements of one pipeline run. stage() times a block;
+    with an InstrumentedConnection it also records the statements run in it.
+    """
+
+    def __init__(self, **info):
+        self.info = info
+        self.stages = {}
+        self.queries = []
+        self._started = datetime.now(timezone.utc)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    @contextmanager
+    def stage(self, name: str, conn: sqlite3.Connection = None):
+        """Time the enclosed block; yields the stage dict (set "rows" on it)."""
+        measurement = {"rows": None}
+        statements = getattr(conn, "statements", None)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield measurement
+        finally:
+            wall = time.perf_counter() - wall
+            measurement["seconds"] = round(wall, 4)
+            measurement["cpu_seconds"] = round(time.process_time() - cpu, 4)
+            if statements is not None:
+                measurement["statements"] = conn.statements - statements
+            rows = measurement["rows"]
+            if rows is not None and wall > 0:
+                measurement["rows_per_second"] = round(rows / wall)
+            measurement["max_rss_mb"] = round(max_rss_mb(), 2)
+            self.stages[name] = measurement
+
+    def add_queries(self, conn: sqlite3.Connection) -> None:
+        """Take the statement statistics of an InstrumentedConnection into the report."""
+        if isinstance(conn, InstrumentedConnection):
+            self.queries = conn.top_queries()
+            self.info["statements"] = conn.statements
+
+    def as_dict(self) -> dict:
+        return {
+            "started_at": self._started.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - self._wall, 4),
+            "cpu_seconds": round(time.process_time() - self._cpu, 4),
+            "max_rss_mb": round(max_rss_mb(), 2),
+            "max_rss_children_mb": round(max_rss_mb(resource.RUSAGE_CHILDREN), 2),
+            **self.info,
+            "stages": self.stages,
+            "queries": self.queries,
+        }
+
+
+def write_report(report: dict, path: Path, history: Path = None) -> None:
+    """Write the run report as JSON; with `history`, also append it as one JSON line."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=1) + "\n")
+    if history is not None:
+        history = Path(history)
+        history.parent.mkdir(parents=True, exist_ok=True)
+        with history.open("a") as f:
+            f.write(json.dumps(report, separators=(",", ":")) + "\n")
@@ -0,0 +1,49 @@
+# scripts/lesson_identity.py
+
+import hashlib
+
+# Hex digits kept from the digest; together with timeStamp in the unique
+# key, 64 bits are plenty to tell lessons apart.
+HASH_LENGTH = 16
+
+
+def _canonical(value) -> str:
+    """Type-independent text form, so JSON, CSV and DB values hash alike."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if number != number:  # NaN from pandas = missing
+        return ""
+    if number.is_integer():
+        return str(int(number))
+    return repr(number)
+
+
+def lesson_hash(time_stamp, layout, text_type, length, time_ms, errors, speed) -> str:
+    """
+    Content hash identifying one lesson (lessons_raw columns, in order).
+
+    The histogram is not part of the hash, so lessons from the JSON export
+    and from raw/lessons.csv get the same identity.
+    """
+    text = "|".join(
+        _canonical(v)
+        for v in (time_stamp, layout, text_type, length, time_ms, errors, speed)
+    )
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:HASH_LENGTH]
+
+
+def unlinked_hash(time_stamp, occurrence: int) -> str:
+    """
+    Identity for keystats rows loaded without their lesson (no lesson, or
+    several different ones, with their timeStamp): the timestamp and the
+    row's occurrence among the rows with the same timeStamp and codePoint,
+    so loading the same rows again maps them onto the ones already stored.
+    """
+    text = f"unlinked|{_canonical(time_stamp)}|{occurrence}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:HASH_LENGTH]
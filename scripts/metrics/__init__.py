@@ -1,5 +1,23 @@
 # scripts/metrics/__init__.py
 
-from .daily import compute_daily_metrics
-from .keys import compute_key_metrics
-from .weak_keys import get_weak_keys
+# The metric functions are loaded on first access (PEP 562), so importing
+# a light submodule such as metrics.columnar does not pull in pandas.
+_EXPORTS = {
+    "compute_daily_metrics": ".daily",
+    "compute_all_metrics": ".engine",
+    "compute_key_metrics": ".keys",
+    "get_weak_keys": ".weak_keys",
+    "rollup": ".cube",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
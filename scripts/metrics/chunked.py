@@ -0,0 +1,126 @@
+# scripts/metrics/chunked.py
+
+import sqlite3
+
+import pandas as pd
+
+from .compaction import compacted_lessons, rollup_key_partials
+from .engine import daily_from_raw, key_partials, keys_from_partials, merge_key_partials
+from .keys import add_latency_percentiles
+from .rolling import add_rolling_metrics
+from .typed import READ_CHUNK_ROWS, compact_keystats, compact_lessons, read_compact
+
+# Out-of-core variant of the in-memory engine: the raw tables are read in
+# batches of whole days, each batch is aggregated with the engine's
+# functions and only the small results are kept. Daily metrics of a day
+# depend on that day alone, so the per-batch daily rows are final; the
+# key metrics are carried as mergeable partial sums (engine.key_partials)
+# and finished once at the end. Rolling windows and percentiles work on
+# the finished daily/key frames as in the other engines.
+
+# Default memory budget for one batch
+DEFAULT_MEMORY_MB = 256
+
+# Rough peak bytes per raw row while a batch is read and aggregated
+# (read_sql_query's object frame, the compacted copy and the group-by
+# temporaries); used to turn the memory budget into rows per batch
+ROW_BYTES = 400
+
+_LESSONS_SQL = """
+    SELECT date, epoch_ms, timeStamp, length, errors, speed
+    FROM lessons_raw
+    WHERE {where}
+    ORDER BY date, epoch_ms, length, errors, speed
+"""
+
+_KEYSTATS_SQL = """
+    SELECT date, epoch_ms, timeStamp, codePoint, hitCount, missCount, timeToType_ms
+    FROM keystats_raw
+    WHERE {where}
+"""
+
+
+def rows_per_batch(memory_mb: float) -> int:
+    """Raw rows (lessons + keystats) one batch may hold within `memory_mb`."""
+    return max(1, int(memory_mb * 2**20 / ROW_BYTES))
+
+
+def plan_batches(conn: sqlite3.Connection, max_rows: int) -> list:
+    """
+    Consecutive date ranges (first, last) with at most `max_rows` raw rows
+    each; a day is never split, a day larger than the budget is a batch of
+    its own. The row counts come from the date indexes.
+    """
+    counts = {}
+    for table in ("lessons_raw", "keystats_raw"):
+        for date, n in conn.execute(
+            f"SELECT date, COUNT(*) FROM {table} WHERE date IS NOT NULL GROUP BY date;"
+        ):
+            counts[date] = counts.get(date, 0) + n
+
+    batches = []
+    first = last = None
+    rows = 0
+    for date in sorted(counts):
+        if first is not None and rows + counts[date] > max_rows:
+            batches.append((first, last))
+            first = None
+        if first is None:
+            first, rows = date, 0
+        last = date
+        rows += counts[date]
+    if first is not None:
+        batches.append((first, last))
+    return batches
+
+
+def _read_batch(conn: sqlite3.Connection, where: str, params, chunk_rows: int) -> tuple:
+    """lessons_raw and keystats_raw rows matching `where`, compacted like read_raw_tables."""
+    lessons = read_compact(
+        conn, _LESSONS_SQL.format(where=where), compact_lessons, chunk_rows, params
+    )
+    keystats = read_compact(
+        conn, _KEYSTATS_SQL.format(where=where), compact_keystats, chunk_rows, params
+    )
+    return lessons, keystats
+
+
+def compute_all_metrics_chunked(conn: sqlite3.Connection, memory_mb: float = DEFAULT_MEMORY_MB) -> tuple:
+    """
+    Full rebuild of daily and key metrics like engine.compute_all_metrics,
+    but holding at most about `memory_mb` of raw rows at a time, for DBs
+    larger than RAM. Same columns and values as the other engines.
+    """
+    max_rows = rows_per_batch(memory_mb)
+    chunk_rows = min(READ_CHUNK_ROWS, max_rows)
+    batches = plan_batches(conn, max_rows)
+    print(f"Chunked engine: {len(batches)} batch(es) of up to {max_rows} raw rows ({memory_mb:g} MB).")
+
+    daily_parts = []
+    key_parts = []
+    for i, (first, last) in enumerate(batches, 1):
+        lessons, keystats = _read_batch(conn, "date BETWEEN ? AND ?", (first, last), chunk_rows)
+        compacted = compacted_lessons(conn, first, last)
+        daily_parts.append(daily_from_raw(lessons, keystats, compacted))
+        key_parts.append(key_partials(keystats))
+        print(f"  batch {i}/{len(batches)}: {first} .. {last} ({len(lessons)} lessons, {len(keystats)} keystats)")
+        del lessons, keystats
+
+    # Rows without a date only count towards the key metrics (the daily
+    # frame of this batch is empty unless there were no batches at all)
+    lessons, keystats = _read_batch(conn, "date IS NULL", (), chunk_rows)
+    if not daily_parts:
+        daily_parts.append(daily_from_raw(lessons, keystats))
+    if len(keystats) or not key_parts:
+        key_parts.append(key_partials(keystats))
+    del lessons, keystats
+
+    # Days compacted into keystats_daily (metrics/compaction.py)
+    key_parts.append(rollup_key_partials(conn))
+
+    daily = pd.concat(daily_parts, ignore_index=True)
+    keys = keys_from_partials(merge_key_partials(key_parts))
+
+    daily = add_rolling_metrics(daily)
+    keys = add_latency_percentiles(conn, keys)
+    return daily.sort_values("date"), keys
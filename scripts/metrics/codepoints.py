@@ -0,0 +1,13 @@
+# scripts/metrics/codepoints.py
+
+# Shared by ingest (update_keybr.histogram_to_rows, once per keystats row)
+# and the typed reads of metrics/typed.py; kept free of numpy/pandas so
+# importing update_keybr does not load them.
+
+
+def code_point_key(code_point):
+    """The key of a histogram entry: chr(codePoint), None if missing or invalid."""
+    try:
+        return chr(code_point) if code_point is not None else None
+    except (TypeError, ValueError, OverflowError):
+        return None
@@ -0,0 +1,159 @@
+# scripts/metrics/columnar.py
+
+import importlib.util
+import json
+import sqlite3
+from pathlib import Path
+
+# Layout of the mirror directory:
+#   <root>/manifest.json
+#   <root>/<table>/month=<YYYY-MM>/part-*.arrow   (Arrow IPC file format)
+# Only parts listed in the manifest belong to the mirror.
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+MIRRORED_TABLES = ("lessons_raw", "keystats_raw")
+
+# Column order used when sorting lessons like idx_lessons_date
+_LESSON_ORDER = ["date", "epoch_ms", "length", "errors", "speed"]
+
+
+def arrow_available() -> bool:
+    """pyarrow is optional: without it there is no columnar mirror."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def arrow():
+    """The pyarrow module, imported on first use (importing it is slow)."""
+    import pyarrow
+    import pyarrow.ipc
+
+    return pyarrow
+
+
+def mirror_schema(table: str):
+    """Arrow schema of a mirrored table; repeated strings are dictionary-encoded."""
+    pa = arrow()
+    text = pa.string()
+    category = pa.dictionary(pa.int32(), pa.string())
+    if table == "lessons_raw":
+        return pa.schema(
+            [
+                ("timeStamp", text),
+                ("layout", category),
+                ("textType", category),
+                ("length", pa.int64()),
+                ("time_ms", pa.int64()),
+                ("errors", pa.int64()),
+                ("speed", pa.float64()),
+                ("date", category),
+                ("epoch_ms", pa.int64()),
+                ("lesson_hash", text),
+            ]
+        )
+    if table == "keystats_raw":
+        return pa.schema(
+            [
+                ("timeStamp", text),
+                ("codePoint", pa.int64()),
+                ("key", category),
+                ("hitCount", pa.int64()),
+                ("missCount", pa.int64()),
+                ("timeToType_ms", pa.int64()),
+                ("date", category),
+                ("epoch_ms", pa.int64()),
+                ("lesson_hash", text),
+            ]
+        )
+    raise ValueError(f"table is not mirrored: {table}")
+
+
+def table_fingerprint(conn: sqlite3.Connection, table: str) -> dict:
+    """Row count and highest id of a raw table; cheap, and changes with every write."""
+    # Two statements: each one alone is answered without a table scan
+    rows = conn.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0]
+    max_id = conn.execute(f"SELECT MAX(id) FROM {table};").fetchone()[0]
+    return {"rows": rows, "max_id": max_id}
+
+
+def read_manifest(root: Path):
+    """
+    Parsed manifest of the mirror at `root`, or None if there is none or it
+    cannot be read (e.g. truncated by a crash): readers then fall back to
+    SQLite and the next publish rebuilds the mirror.
+    """
+    path = Path(root) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    try:
+        manifest = json.loads(path.read_text())
+    except (OSError, ValueError) as exc:
+        print(f"Columnar manifest {path} unreadable ({exc}) – ignoring the mirror.")
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def mirror_is_current(conn: sqlite3.Connection, root: Path) -> bool:
+    """True if pyarrow is available and the mirror holds exactly the DB's raw rows."""
+    if not arrow_available():
+        return False
+    manifest = read_manifest(root)
+    if manifest is None:
+        return False
+    return all(
+        manifest["tables"].get(table, {}).get("fingerprint") == table_fingerprint(conn, table)
+        for table in MIRRORED_TABLES
+    )
+
+
+def read_mirror_table(root: Path, table: str, columns):
+    """
+    Load `columns` of a mirrored table. The part files are memory-mapped and
+    only the buffers of the selected columns are touched; numeric columns
+    reach pandas without going through Python objects.
+    """
+    import pandas as pd
+
+    pa = arrow()
+    root = Path(root)
+    manifest = read_manifest(root)
+    columns = list(columns)
+
+    tables = []
+    for part in manifest["tables"][table]["parts"]:
+        source = pa.memory_map(str(root / part), "r")
+        tables.append(pa.ipc.open_file(source).read_all().select(columns))
+
+    if not tables:
+        schema = mirror_schema(table)
+        tables = [schema.empty_table().select(columns)]
+
+    frame = pa.concat_tables(tables).to_pandas()
+
+    # Dictionaries of different parts are unified in arbitrary order; sorted
+    # categories make sorting and grouping follow the string order (as in SQLite)
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = frame[col].cat.set_categories(sorted(frame[col].cat.categories))
+
+    return frame
+
+
+def read_mirror_tables(root: Path) -> tuple:
+    """
+    Same frames as metrics.engine.read_raw_tables(), read from the mirror.
+    Lessons are sorted like idx_lessons_date, as the engine expects.
+    """
+    lessons = read_mirror_table(
+        root, "lessons_raw", ["date", "epoch_ms", "timeStamp", "length", "errors", "speed"]
+    )
+    lessons = lessons.sort_values(
+        _LESSON_ORDER, na_position="first", kind="stable", ignore_index=True
+    )
+    keystats = read_mirror_table(
+        root,
+        "keystats_raw",
+        ["date", "epoch_ms", "timeStamp", "key", "hitCount", "missCount", "timeToType_ms"],
+    )
+    return lessons, keystats
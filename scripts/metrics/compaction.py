@@ -0,0 +1,138 @@
+# scripts/metrics/compaction.py
+
+import sqlite3
+
+# Retention for keystats_raw: rows of old days are rolled up into
+# keystats_daily (one row per day and key) and deleted from the raw table.
+# The rollup holds every per-key measure the metrics need (sums, counts,
+# minima, latest lesson); the per-day and per-lesson summaries that were
+# maintained at ingest time (lesson_metrics, latency sketches, key_cube)
+# stay as they are. Days up to compacted_through() are therefore never
+# rebuilt from keystats_raw: the rebuild functions keep their rows for
+# those days, and the key-level rebuilds and the in-memory engines add
+# the rollup to what is left in keystats_raw. Lessons imported later for
+# an already compacted day go to keystats_raw as usual and are folded in
+# by the next compaction.
+
+ROLLUP_UPSERT_SQL = """
+    INSERT INTO keystats_daily (
+        date, key, rows, hits, misses, latency_sum, latency_count,
+        min_latency, min_miss_latency, last_timestamp, last_epoch_ms
+    )
+    SELECT
+        date,
+        COALESCE(key, ''),
+        COUNT(*),
+        COALESCE(SUM(hitCount), 0),
+        COALESCE(SUM(missCount), 0),
+        COALESCE(SUM(timeToType_ms), 0),
+        COUNT(timeToType_ms),
+        MIN(timeToType_ms),
+        MIN(CASE WHEN missCount > 0 THEN timeToType_ms END),
+        MAX(timeStamp),
+        MAX(epoch_ms)
+    FROM keystats_raw
+    WHERE date < ?
+    GROUP BY 1, 2
+    ON CONFLICT(date, key) DO UPDATE SET
+        rows = rows + excluded.rows,
+        hits = hits + excluded.hits,
+        misses = misses + excluded.misses,
+        latency_sum = latency_sum + excluded.latency_sum,
+        latency_count = latency_count + excluded.latency_count,
+        min_latency = COALESCE(MIN(min_latency, excluded.min_latency), min_latency, excluded.min_latency),
+        min_miss_latency = COALESCE(
+            MIN(min_miss_latency, excluded.min_miss_latency),
+            min_miss_latency,
+            excluded.min_miss_latency
+        ),
+        last_timestamp = COALESCE(
+            MAX(last_timestamp, excluded.last_timestamp),
+            last_timestamp,
+            excluded.last_timestamp
+        ),
+        last_epoch_ms = COALESCE(
+            MAX(last_epoch_ms, excluded.last_epoch_ms),
+            last_epoch_ms,
+            excluded.last_epoch_ms
+        );
+"""
+
+
+def compacted_through(conn: sqlite3.Connection):
+    """Last day whose keystats were compacted into keystats_daily (None if none)."""
+    return conn.execute("SELECT MAX(date) FROM keystats_daily;").fetchone()[0]
+
+
+def compaction_boundary(conn: sqlite3.Connection) -> str:
+    """
+    compacted_through() as a bound for "date > ?" conditions: '' (before
+    every date) if nothing was compacted.
+    """
+    return compacted_through(conn) or ""
+
+
+def compact_keystats_before(conn: sqlite3.Connection, before: str) -> int:
+    """
+    Roll the keystats_raw rows of all days before `before` (YYYY-MM-DD)
+    into keystats_daily and delete them from keystats_raw, in one
+    transaction. Returns the number of raw rows removed.
+    """
+    with conn:
+        conn.execute(ROLLUP_UPSERT_SQL, (before,))
+        removed = conn.execute("DELETE FROM keystats_raw WHERE date < ?;", (before,)).rowcount
+    return removed
+
+
+def rollup_key_partials(conn: sqlite3.Connection):
+    """
+    The rollup in the form of engine.key_partials() (one row per day and
+    key, keys '' left out), to be merged with the partials of keystats_raw.
+    """
+    import pandas as pd
+
+    return pd.read_sql_query(
+        """
+        SELECT
+            key,
+            hits,
+            misses,
+            latency_sum,
+            latency_count,
+            CAST(min_miss_latency AS REAL) AS ttke,
+            last_timestamp
+        FROM keystats_daily
+        WHERE key <> ''
+        ORDER BY key, date
+        """,
+        conn,
+    )
+
+
+def compacted_lessons(conn: sqlite3.Connection, first: str = None, last: str = None):
+    """
+    lesson_metrics rows (date, epoch_ms, keystrokes, latency_sum,
+    latency_count, ttfe) of the compacted days, optionally limited to
+    [first, last]: for these days the per-day keystroke, latency and TTFE
+    aggregates come from the per-lesson summary instead of keystats_raw.
+    """
+    import pandas as pd
+
+    conditions = ["date <= ?"]
+    params = [compaction_boundary(conn)]
+    if first is not None:
+        conditions.append("date >= ?")
+        params.append(first)
+    if last is not None:
+        conditions.append("date <= ?")
+        params.append(last)
+    return pd.read_sql_query(
+        f"""
+        SELECT date, epoch_ms, keystrokes, latency_sum, latency_count, ttfe
+        FROM lesson_metrics
+        WHERE {" AND ".join(conditions)}
+        ORDER BY date, epoch_ms
+        """,
+        conn,
+        params=params,
+    )
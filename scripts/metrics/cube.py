@@ -0,0 +1,292 @@
+# scripts/metrics/cube.py
+
+import sqlite3
+
+from .compaction import compaction_boundary
+
+# Pre-aggregated cube over (date, layout, textType, key), maintained at
+# ingest time. Two fact tables share the first three dimensions:
+#   lesson_cube (date, layout, textType)       lesson counts, chars, errors, speed
+#   key_cube    (date, layout, textType, key)  hits, misses, latencies
+# Every measure merges by adding up (MIN/MAX for the extremes), so any
+# combination of dimensions is a GROUP BY over a few thousand cells.
+# Unknown values (NULL) are stored as '' to keep the primary keys usable
+# for upserts.
+CUBE_DIMENSIONS = ("date", "layout", "textType", "key")
+
+LESSON_CUBE_UPSERT_SQL = """
+    INSERT INTO lesson_cube (
+        date, layout, textType, lessons, chars, errors, speed_sum, speed_count
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(date, layout, textType) DO UPDATE SET
+        lessons = lessons + excluded.lessons,
+        chars = chars + excluded.chars,
+        errors = errors + excluded.errors,
+        speed_sum = speed_sum + excluded.speed_sum,
+        speed_count = speed_count + excluded.speed_count;
+"""
+
+KEY_CUBE_UPSERT_SQL = """
+    INSERT INTO key_cube (
+        date, layout, textType, key, hits, misses, latency_sum, latency_count,
+        min_miss_latency, last_timestamp
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(date, layout, textType, key) DO UPDATE SET
+        hits = hits + excluded.hits,
+        misses = misses + excluded.misses,
+        latency_sum = latency_sum + excluded.latency_sum,
+        latency_count = latency_count + excluded.latency_count,
+        min_miss_latency = COALESCE(
+            MIN(min_miss_latency, excluded.min_miss_latency),
+            min_miss_latency,
+            excluded.min_miss_latency
+        ),
+        last_timestamp = COALESCE(
+            MAX(last_timestamp, excluded.last_timestamp),
+            last_timestamp,
+            excluded.last_timestamp
+        );
+"""
+
+
+def update_cube(conn: sqlite3.Connection, lesson_rows, keystats_rows) -> None:
+    """
+    Fold a batch of new lessons_raw and keystats_raw rows (update_keybr
+    column order) into lesson_cube and key_cube. The keystats rows find
+    their lesson's layout and textType via lesson_hash.
+    """
+    lessons = {}
+    dims_by_lesson = {}
+    for row in lesson_rows:
+        ts, layout, text_type, length, _time_ms, errors, speed, date = row[:8]
+        dims = (date or "", layout or "", text_type or "")
+        dims_by_lesson[row[9]] = dims
+
+        c = lessons.get(dims)
+        if c is None:
+            c = lessons[dims] = [*dims, 0, 0, 0, 0.0, 0]
+        c[3] += 1
+        c[4] += length or 0
+        c[5] += errors or 0
+        if speed is not None:
+            c[6] += speed
+            c[7] += 1
+
+    keys = {}
+    for row in keystats_rows:
+        ts, _code_point, key, hits, misses, latency, date = row[:7]
+        dims = dims_by_lesson.get(row[8], (date or "", "", ""))
+        cell = (*dims, key or "")
+
+        c = keys.get(cell)
+        if c is None:
+            c = keys[cell] = [*cell, 0, 0, 0, 0, None, None]
+        c[4] += hits or 0
+        c[5] += misses or 0
+        if latency is not None:
+            c[6] += latency
+            c[7] += 1
+            if misses and (c[8] is None or latency < c[8]):
+                c[8] = latency
+        if ts is not None and (c[9] is None or ts > c[9]):
+            c[9] = ts
+
+    conn.executemany(LESSON_CUBE_UPSERT_SQL, lessons.values())
+    conn.executemany(KEY_CUBE_UPSERT_SQL, keys.values())
+
+
+def rebuild_cube(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild lesson_cube and key_cube from the raw tables (one full scan of
+    each). Needed for DBs filled before the cube existed or written past
+    update_keybr. key_cube rows of compacted days are kept as they are.
+    """
+    conn.execute("DELETE FROM lesson_cube;")
+    conn.execute(
+        """
+        INSERT INTO lesson_cube (
+            date, layout, textType, lessons, chars, errors, speed_sum, speed_count
+        )
+        SELECT
+            COALESCE(date, ''), COALESCE(layout, ''), COALESCE(textType, ''),
+            COUNT(*),
+            COALESCE(SUM(length), 0),
+            COALESCE(SUM(errors), 0),
+            COALESCE(SUM(speed), 0.0),
+            COUNT(speed)
+        FROM lessons_raw
+        GROUP BY 1, 2, 3
+        """
+    )
+    boundary = compaction_boundary(conn)
+    conn.execute("DELETE FROM key_cube WHERE date = '' OR date > ?;", (boundary,))
+    conn.execute(
+        """
+        INSERT INTO key_cube (
+            date, layout, textType, key, hits, misses, latency_sum, latency_count,
+            min_miss_latency, last_timestamp
+        )
+        SELECT
+            COALESCE(k.date, ''), COALESCE(l.layout, ''), COALESCE(l.textType, ''),
+            COALESCE(k.key, ''),
+            COALESCE(SUM(k.hitCount), 0),
+            COALESCE(SUM(k.missCount), 0),
+            COALESCE(SUM(k.timeToType_ms), 0),
+            COUNT(k.timeToType_ms),
+            MIN(CASE WHEN k.missCount > 0 THEN k.timeToType_ms END),
+            MAX(k.timeStamp)
+        FROM keystats_raw k
+        LEFT JOIN lessons_raw l
+            ON l.lesson_hash = k.lesson_hash AND l.timeStamp = k.timeStamp
+        WHERE k.date IS NULL OR k.date > ?
+        GROUP BY 1, 2, 3, 4
+        """,
+        (boundary,),
+    )
+    conn.commit()
+
+
+def _cube_missing(conn: sqlite3.Connection) -> bool:
+    """True if lessons_raw has rows but lesson_cube is empty."""
+    cube_empty = conn.execute("SELECT 1 FROM lesson_cube LIMIT 1;").fetchone() is None
+    raw_empty = conn.execute("SELECT 1 FROM lessons_raw LIMIT 1;").fetchone() is None
+    return cube_empty and not raw_empty
+
+
+def ensure_cube(conn: sqlite3.Connection) -> None:
+    """Rebuild the cube if it is empty while lessons_raw is not."""
+    if _cube_missing(conn):
+        print("Cube is empty – rebuilding from the raw tables ...")
+        rebuild_cube(conn)
+
+
+def _where(dimensions, since, until, filters) -> tuple:
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append("date >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("date <= ?")
+        params.append(until)
+    for dim, values in filters.items():
+        if isinstance(values, str):
+            values = [values]
+        values = list(values)
+        conditions.append(f"{dim} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    if "key" in dimensions:
+        # like the key metrics: rows without a key only count towards totals
+        conditions.append("key <> ''")
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+def _grouped(dimensions) -> tuple:
+    if not dimensions:
+        return "", "", ""
+    columns = ", ".join(dimensions)
+    return columns + ",", f"GROUP BY {columns}", f"ORDER BY {columns}"
+
+
+def rollup(
+    conn: sqlite3.Connection,
+    dimensions=("date",),
+    since: str = None,
+    until: str = None,
+    **filters,
+):
+    """
+    Roll the cube up to `dimensions` (any subset of CUBE_DIMENSIONS, in the
+    given order; empty: grand total) for the days in [since, until], with
+    optional filters per dimension, e.g. rollup(conn, ("date", "layout"),
+    textType="words").
+
+    Without "key" in `dimensions`, one row per group with the daily-style
+    measures num_lessons, total_chars, total_errors, avg_wpm,
+    total_keystrokes, avg_latency, error_rate and avg_accuracy (TTFE and
+    rolling windows need per-lesson data and are not in the cube).
+    With "key", the key-style measures attempts, errors, miss_rate,
+    avg_latency, last_timestamp and ttke.
+    """
+    import pandas as pd
+
+    dimensions = list(dimensions)
+    unknown = [d for d in [*dimensions, *filters] if d not in CUBE_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"unknown cube dimension(s): {', '.join(unknown)}")
+    if len(set(dimensions)) != len(dimensions):
+        raise ValueError("cube dimensions must not repeat")
+
+    ensure_cube(conn)
+
+    select, group_by, order_by = _grouped(dimensions)
+    where, params = _where(dimensions, since, until, filters)
+
+    if "key" in dimensions:
+        df = pd.read_sql_query(
+            f"""
+            SELECT
+                {select}
+                SUM(hits) + SUM(misses) AS attempts,
+                SUM(misses) AS errors,
+                CAST(SUM(latency_sum) AS REAL) / NULLIF(SUM(latency_count), 0) AS avg_latency,
+                MAX(last_timestamp) AS last_timestamp,
+                MIN(min_miss_latency) AS ttke
+            FROM key_cube
+            {where}
+            {group_by}
+            {order_by}
+            """,
+            conn,
+            params=params,
+        )
+        df["miss_rate"] = (df["errors"] / df["attempts"].where(df["attempts"] > 0)).fillna(0.0)
+        return df
+
+    if "key" in filters:
+        raise ValueError("a key filter needs 'key' among the dimensions")
+
+    lessons = pd.read_sql_query(
+        f"""
+        SELECT
+            {select}
+            SUM(lessons) AS num_lessons,
+            SUM(chars) AS total_chars,
+            SUM(errors) AS total_errors,
+            SUM(speed_sum) / 5.0 / NULLIF(SUM(speed_count), 0) AS avg_wpm
+        FROM lesson_cube
+        {where}
+        {group_by}
+        {order_by}
+        """,
+        conn,
+        params=params,
+    )
+    keystrokes = pd.read_sql_query(
+        f"""
+        SELECT
+            {select}
+            SUM(hits) + SUM(misses) AS total_keystrokes,
+            CAST(SUM(latency_sum) AS REAL) / NULLIF(SUM(latency_count), 0) AS avg_latency
+        FROM key_cube
+        {where}
+        {group_by}
+        {order_by}
+        """,
+        conn,
+        params=params,
+    )
+
+    if dimensions:
+        df = lessons.merge(keystrokes, on=dimensions, how="outer", sort=True)
+    else:
+        df = pd.concat([lessons, keystrokes], axis=1)
+
+    for col in ("num_lessons", "total_chars", "total_errors", "total_keystrokes"):
+        df[col] = df[col].fillna(0)
+    df["error_rate"] = df["total_errors"] / df["total_chars"].where(df["total_chars"] > 0)
+    df["avg_accuracy"] = 1.0 - df["error_rate"]
+    return df
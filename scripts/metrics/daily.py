@@ -3,12 +3,55 @@
 import pandas as pd
 import sqlite3
 
+from .lessons import ensure_lesson_metrics
 from .rolling import add_rolling_metrics
 
+# Column order of daily_metrics.csv
+DAILY_COLUMNS = [
+    "date",
+    "num_lessons",
+    "total_chars",
+    "total_errors",
+    "avg_wpm",
+    "total_keystrokes",
+    "avg_latency",
+    "ttfe",
+    "error_rate",
+    "avg_accuracy",
+    "rolling_7d_wpm",
+    "rolling_30d_wpm",
+    "rolling_7d_error_rate",
+    "rolling_30d_error_rate",
+    "rolling_7d_latency",
+]
+
+
+def _date_filter(dates, extra_conditions=()):
+    """
+    WHERE clause (and params) restricting a table to the given days, or to
+    all dated rows (served by the date indexes / primary key). Rows without
+    a date only count towards the key metrics.
+    """
+    conditions = list(extra_conditions)
+    params = []
+
+    if dates is not None:
+        dates = sorted(set(dates))
+        placeholders = ", ".join("?" * len(dates))
+        conditions.append(f"date IN ({placeholders})")
+        params = list(dates)
+    else:
+        conditions.append("date IS NOT NULL")
+
+    if not conditions:
+        return "", params
+    return "WHERE " + " AND ".join(conditions), params
+
 
 def compute_daily_metrics(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Compute daily aggregated metrics from lessons_raw and keystats_raw.
+    Compute daily aggregated metrics from lessons_raw and lesson_metrics
+    (the per-lesson summary of keystats_raw).
 
     Output columns:
     - date
@@ -28,46 +71,84 @@ def compute_daily_metrics(conn: sqlite3.Connection) -> pd.DataFrame:
     - rolling_7d_latency
     """
 
+    daily = compute_daily_base(conn)
+
+    # 7) Add rolling metrics
+    daily = add_rolling_metrics(daily)
+
+    # 8) Final sort
+    return daily.sort_values("date")
+
+
+def compute_daily_base(conn: sqlite3.Connection, dates=None) -> pd.DataFrame:
+    """
+    Per-day metrics without the rolling columns (steps 1-6 of
+    compute_daily_metrics). With `dates`, only those days are computed.
+    """
+
+    if dates is not None and not dates:
+        return pd.DataFrame(columns=DAILY_COLUMNS[:10])
+
+    where, params = _date_filter(dates)
+    ttfe_where, ttfe_params = _date_filter(dates, ["ttfe IS NOT NULL"])
+
     # 1) Daily metrics from lessons_raw
     # NOTE: Keybr exports "wpm" per lesson, which is the correct metric.
     # "speed" is CPM (characters per minute) and must NOT be averaged as WPM.
-    lessons_sql = """
+    lessons_sql = f"""
     SELECT
-        substr(timeStamp, 1, 10) AS date,
+        date,
         COUNT(*) AS num_lessons,
         SUM(length) AS total_chars,
         SUM(errors) AS total_errors,
         AVG(speed / 5.0) AS avg_wpm      -- correct WPM calculation
     FROM lessons_raw
-    GROUP BY substr(timeStamp, 1, 10)
+    {where}
+    GROUP BY date
     ORDER BY date
 """
-    lessons_df = pd.read_sql_query(lessons_sql, conn)
+    lessons_df = pd.read_sql_query(lessons_sql, conn, params=params)
 
-    # 2) Daily keystroke and latency metrics
+    # 2) Daily keystroke and latency metrics, from the per-lesson summary
     # total_keystrokes = hitCount + missCount
-    keystats_sql = """
+    # avg_latency = AVG(timeToType_ms) over all keystats rows of the day
+    ensure_lesson_metrics(conn)
+    keystats_sql = f"""
         SELECT
-            substr(timeStamp, 1, 10) AS date,
-            SUM(hitCount + missCount) AS total_keystrokes,
-            AVG(timeToType_ms) AS avg_latency
-        FROM keystats_raw
-        GROUP BY substr(timeStamp, 1, 10)
+            date,
+            SUM(keystrokes) AS total_keystrokes,
+            CAST(SUM(latency_sum) AS REAL) / NULLIF(SUM(latency_count), 0) AS avg_latency
+        FROM lesson_metrics
+        {where}
+        GROUP BY date
         ORDER BY date
     """
-    keystats_df = pd.read_sql_query(keystats_sql, conn)
+    keystats_df = pd.read_sql_query(keystats_sql, conn, params=params)
 
     # 3) TTFE per lesson (minimum latency on keys where a miss occurred)
-    ttfe_lesson_sql = """
+    ttfe_lesson_sql = f"""
         SELECT
-            substr(timeStamp, 1, 10) AS date,
-            timeStamp AS lesson_ts,
-            MIN(timeToType_ms) AS ttfe_lesson
-        FROM keystats_raw
-        WHERE missCount > 0
-        GROUP BY timeStamp
+            date,
+            epoch_ms AS lesson_epoch_ms,
+            ttfe AS ttfe_lesson
+        FROM lesson_metrics
+        {ttfe_where}
+    """
+    ttfe_lesson_df = pd.read_sql_query(ttfe_lesson_sql, conn, params=ttfe_params)
+
+    return combine_daily_frames(lessons_df, keystats_df, ttfe_lesson_df)
+
+
+def combine_daily_frames(
+    lessons_df: pd.DataFrame,
+    keystats_df: pd.DataFrame,
+    ttfe_lesson_df: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Steps 4-6: merge the per-day lesson and keystroke aggregates with the
+    per-lesson TTFE and derive error_rate/avg_accuracy (vectorized).
+    Shared by the SQL path and the in-memory engine (metrics/engine.py).
     """
-    ttfe_lesson_df = pd.read_sql_query(ttfe_lesson_sql, conn)
 
     # 4) TTFE daily average
     ttfe_daily = (
@@ -89,20 +170,10 @@ def compute_daily_metrics(conn: sqlite3.Connection) -> pd.DataFrame:
     daily["total_errors"] = daily["total_errors"].fillna(0)
     daily["total_keystrokes"] = daily["total_keystrokes"].fillna(0)
 
-    daily["error_rate"] = daily.apply(
-        lambda row: (row["total_errors"] / row["total_chars"])
-        if row["total_chars"] > 0 else None,
-        axis=1,
-    )
-
-    daily["avg_accuracy"] = daily.apply(
-        lambda row: 1.0 - row["error_rate"]
-        if row["error_rate"] is not None else None,
-        axis=1,
+    # error_rate bleibt leer (NaN) an Tagen ohne Zeichen
+    daily["error_rate"] = (
+        daily["total_errors"] / daily["total_chars"].where(daily["total_chars"] > 0)
     )
+    daily["avg_accuracy"] = 1.0 - daily["error_rate"]
 
-    # 7) Add rolling metrics
-    daily = add_rolling_metrics(daily)
-
-    # 8) Final sort
-    return daily.sort_values("date")
+    return daily
@@ -0,0 +1,340 @@
+# scripts/metrics/engine.py
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .columnar import mirror_is_current, read_mirror_tables
+from .compaction import compacted_lessons, rollup_key_partials
+from .daily import combine_daily_frames
+from .keys import add_latency_percentiles, finalize_key_metrics
+from .rolling import add_rolling_metrics
+from .typed import compact_keystats, compact_lessons, read_compact
+
+
+def read_raw_tables(conn: sqlite3.Connection) -> tuple:
+    """
+    One read of each raw table, only the columns the metrics need, in the
+    compact typed form of metrics/typed.py (narrow integers, categorical
+    dates, the key derived from codePoint instead of one string per row).
+    lessons_raw comes in the order of idx_lessons_date, so repeated runs
+    see the lessons in the same order.
+    """
+    lessons = read_compact(
+        conn,
+        """
+        SELECT date, epoch_ms, timeStamp, length, errors, speed
+        FROM lessons_raw
+        ORDER BY date, epoch_ms, length, errors, speed
+        """,
+        compact_lessons,
+    )
+    keystats = read_compact(
+        conn,
+        """
+        SELECT date, epoch_ms, timeStamp, codePoint, hitCount, missCount, timeToType_ms
+        FROM keystats_raw
+        """,
+        compact_keystats,
+    )
+    return lessons, keystats
+
+
+class _Groups:
+    """
+    Group-by over one key column, factorized once. The aggregations work on
+    the integer codes with np.bincount / ufunc.at, so the (string) key is
+    never hashed again. Rows with a NULL key (or '' with drop_empty) are
+    dropped; results are ordered by key like SQL's GROUP BY.
+    """
+
+    def __init__(self, keys: pd.Series, drop_empty: bool = False):
+        if isinstance(keys.dtype, pd.CategoricalDtype):
+            # columnar mirror: categories are sorted, the codes come for free
+            codes = keys.cat.codes.to_numpy().astype(np.intp)
+            labels = np.asarray(keys.cat.categories, dtype=object)
+        else:
+            codes, labels = pd.factorize(keys, sort=True)
+            labels = np.asarray(labels, dtype=object)
+
+        if drop_empty:
+            codes = np.where(np.isin(codes, np.flatnonzero(labels == "")), -1, codes)
+
+        self.rows = codes >= 0
+        self.all_rows = bool(self.rows.all())
+        self.codes = codes if self.all_rows else codes[self.rows]
+        self._row_codes = codes
+        self.n = len(labels)
+        self.present = np.bincount(self.codes, minlength=self.n) > 0
+        self.all_labels = labels
+        self.labels = labels[self.present]
+
+    def _values(self, column: pd.Series, mask=None) -> tuple:
+        """(codes, values) of the non-NULL values of `column` in grouped rows."""
+        keep = None if self.all_rows else self.rows
+        if pd.api.types.is_integer_dtype(column.dtype):
+            values = column.to_numpy()
+        else:
+            values = column.to_numpy(dtype=float, na_value=np.nan)
+            notna = ~np.isnan(values)
+            keep = notna if keep is None else keep & notna
+        if mask is not None:
+            mask = np.asarray(mask)
+            keep = mask if keep is None else keep & mask
+        if keep is None:
+            return self._row_codes, values
+        return self._row_codes[keep], values[keep]
+
+    def size(self) -> np.ndarray:
+        return np.bincount(self.codes, minlength=self.n)[self.present]
+
+    def count(self, column: pd.Series) -> np.ndarray:
+        codes, _ = self._values(column)
+        return np.bincount(codes, minlength=self.n)[self.present]
+
+    def sum(self, column: pd.Series, min_count: int = 0) -> np.ndarray:
+        """Exact for integer columns (sums below 2**53); NaN where fewer than min_count values."""
+        codes, values = self._values(column)
+        total = np.bincount(codes, weights=values, minlength=self.n)[self.present]
+        if pd.api.types.is_integer_dtype(column.dtype):
+            return total.astype(np.int64)
+        total = total.astype(np.float64, copy=False)  # bincount of no rows is int64
+        if min_count:
+            total[np.bincount(codes, minlength=self.n)[self.present] < min_count] = np.nan
+        return total
+
+    def _extreme(self, ufunc, column: pd.Series, mask=None) -> np.ndarray:
+        codes, values = self._values(column, mask)
+        result = np.full(self.n, np.inf if ufunc is np.minimum else -np.inf)
+        # float64 values keep ufunc.at on its fast (non-casting) path
+        ufunc.at(result, codes, values.astype(np.float64, copy=False))
+        result = result[self.present]
+        result[np.isinf(result)] = np.nan
+        return result
+
+    def min(self, column: pd.Series, mask=None) -> np.ndarray:
+        return self._extreme(np.minimum, column, mask)
+
+    def max(self, column: pd.Series, mask=None) -> np.ndarray:
+        return self._extreme(np.maximum, column, mask)
+
+
+def _widened(column: pd.Series) -> pd.Series:
+    """Narrow integer columns (metrics/typed.py) as int64, so arithmetic cannot overflow."""
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return column.astype(np.int64)
+    return column
+
+
+def _as_int_if_complete(values: np.ndarray):
+    """Integer aggregates keep int64 unless a group has no value (as in SQL results)."""
+    if np.isnan(values).any():
+        return values
+    return values.astype(np.int64)
+
+
+def daily_from_raw(lessons: pd.DataFrame, keystats: pd.DataFrame, compacted: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Per-day metrics (like compute_daily_base) from the raw frames. For the
+    days in `compacted` (compaction.compacted_lessons()) the keystroke,
+    latency and TTFE aggregates come from those per-lesson rows, and
+    keystats rows of these days are left out.
+    """
+
+    if compacted is not None and len(compacted):
+        in_compacted = keystats["date"].isin(compacted["date"].unique()).to_numpy()
+        if in_compacted.any():
+            keystats = keystats[~in_compacted]
+
+    # 1) Lessons per day. Float sums are plain NumPy sums: equal to SQLite's
+    #    SUM()/AVG() up to rounding, not bit for bit
+    days = _Groups(lessons["date"])
+    wpm_count = days.count(lessons["speed"])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_wpm = np.where(wpm_count > 0, days.sum(lessons["speed"] / 5.0) / wpm_count, np.nan)
+    lessons_df = pd.DataFrame(
+        {
+            "date": days.labels,
+            "num_lessons": days.size(),
+            "total_chars": days.sum(lessons["length"], min_count=1),
+            "total_errors": days.sum(lessons["errors"], min_count=1),
+            "avg_wpm": avg_wpm,
+        }
+    )
+
+    # 2) Keystrokes and latency per day
+    ks_days = _Groups(keystats["date"])
+    keystrokes = _widened(keystats["hitCount"]) + _widened(keystats["missCount"])
+    keystats_df = pd.DataFrame(
+        {
+            "date": ks_days.labels,
+            "total_keystrokes": ks_days.sum(keystrokes, min_count=1),
+            "avg_latency": ks_days.sum(keystats["timeToType_ms"], min_count=1)
+            / ks_days.count(keystats["timeToType_ms"]),
+        }
+    )
+
+    # 3) TTFE per lesson (minimum latency on keys where a miss occurred).
+    #    A lesson is (date, epoch_ms) as in lesson_metrics; rows without
+    #    epoch_ms form one lesson per day there, so they do here as well
+    missed = (keystats["missCount"] > 0).to_numpy() & ks_days.rows
+    ttfe = (
+        pd.DataFrame(
+            {
+                "day": ks_days._row_codes[missed],
+                "lesson_epoch_ms": keystats["epoch_ms"].to_numpy(dtype=float, na_value=np.nan)[missed],
+                "ttfe_lesson": keystats["timeToType_ms"].to_numpy(dtype=float, na_value=np.nan)[missed],
+            }
+        )
+        .groupby(["day", "lesson_epoch_ms"], sort=False, dropna=False)["ttfe_lesson"]
+        .min()
+    )
+    ttfe_lesson_df = pd.DataFrame(
+        {
+            "date": ks_days.all_labels[ttfe.index.get_level_values("day").to_numpy(dtype=np.intp)],
+            "lesson_epoch_ms": ttfe.index.get_level_values("lesson_epoch_ms").to_numpy(),
+            "ttfe_lesson": _as_int_if_complete(ttfe.to_numpy()),
+        }
+    )
+
+    if compacted is not None and len(compacted):
+        keystats_df, ttfe_lesson_df = _with_compacted_days(keystats_df, ttfe_lesson_df, compacted)
+
+    return combine_daily_frames(lessons_df, keystats_df, ttfe_lesson_df)
+
+
+def _with_compacted_days(keystats_df, ttfe_lesson_df, compacted: pd.DataFrame) -> tuple:
+    """Add the per-day aggregates of the compacted days, as compute_daily_base reads them."""
+    days = _Groups(compacted["date"])
+    latency_count = days.sum(compacted["latency_count"])
+    compacted_df = pd.DataFrame(
+        {
+            "date": days.labels,
+            "total_keystrokes": days.sum(compacted["keystrokes"], min_count=1),
+            "avg_latency": days.sum(compacted["latency_sum"])
+            / np.where(latency_count > 0, latency_count, np.nan),
+        }
+    )
+    with_ttfe = compacted[compacted["ttfe"].notna()]
+    compacted_ttfe_df = pd.DataFrame(
+        {
+            "date": with_ttfe["date"].to_numpy(dtype=object),
+            "lesson_epoch_ms": with_ttfe["epoch_ms"].to_numpy(),
+            "ttfe_lesson": _as_int_if_complete(with_ttfe["ttfe"].to_numpy(dtype=float)),
+        }
+    )
+
+    # Empty frames (no raw keystats left) would turn the int64 columns into float
+    keystats_df = pd.concat([df for df in (compacted_df, keystats_df) if len(df)], ignore_index=True)
+    ttfe_lesson_df = pd.concat(
+        [df for df in (compacted_ttfe_df, ttfe_lesson_df) if len(df)] or [ttfe_lesson_df],
+        ignore_index=True,
+    )
+    return keystats_df, ttfe_lesson_df
+
+
+def key_partials(keystats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mergeable per-key aggregates of the keystats frame, ordered by key:
+    hits, misses, latency_sum, latency_count (sums), ttke (min latency of
+    the keys with a miss) and last_timestamp (MAX(timeStamp), as in
+    key_stats_acc). Partials of disjoint row sets merge with
+    merge_key_partials().
+    """
+
+    keys = _Groups(keystats["key"], drop_empty=True)
+
+    # last_timestamp: the categories are sorted, so the largest code is
+    # the largest timeStamp string; rows without one are left out
+    timestamps = pd.Categorical(keystats["timeStamp"])
+    ts_codes = timestamps.codes.astype(np.float64)
+    ts_codes[ts_codes < 0] = np.nan
+    last_code = keys.max(pd.Series(ts_codes))
+    categories = np.asarray(timestamps.categories, dtype=object)
+    last_timestamp = np.full(len(last_code), np.nan, dtype=object)
+    has_ts = ~np.isnan(last_code)
+    last_timestamp[has_ts] = categories[last_code[has_ts].astype(np.intp)]
+
+    return pd.DataFrame(
+        {
+            "key": keys.labels,
+            "hits": keys.sum(keystats["hitCount"]),
+            "misses": keys.sum(keystats["missCount"]),
+            "latency_sum": keys.sum(keystats["timeToType_ms"]),
+            "latency_count": keys.count(keystats["timeToType_ms"]),
+            "ttke": keys.min(keystats["timeToType_ms"], mask=keystats["missCount"] > 0),
+            "last_timestamp": last_timestamp,
+        }
+    )
+
+
+def merge_key_partials(partials) -> pd.DataFrame:
+    """Combine key_partials() of disjoint row sets (sums, min, latest timeStamp)."""
+    partials = list(partials)
+    nonempty = [p for p in partials if len(p)]
+    if not nonempty:
+        return partials[0]
+    df = pd.concat(nonempty, ignore_index=True)
+
+    grouped = df.groupby("key", sort=True)
+    merged = grouped[["hits", "misses", "latency_sum", "latency_count"]].sum()
+    merged["ttke"] = grouped["ttke"].min()
+    merged["last_timestamp"] = grouped["last_timestamp"].max()
+    return merged.reset_index()
+
+
+def keys_from_partials(partials: pd.DataFrame) -> pd.DataFrame:
+    """Per-key metrics (like compute_key_metrics) from key_partials()."""
+
+    latency_count = partials["latency_count"].to_numpy()
+    df = pd.DataFrame(
+        {
+            "key": partials["key"].to_numpy(dtype=object),
+            "attempts": (partials["hits"] + partials["misses"]).to_numpy(),
+            "errors": partials["misses"].to_numpy(),
+            "avg_latency": partials["latency_sum"].to_numpy()
+            / np.where(latency_count > 0, latency_count, np.nan),
+            "last_timestamp": partials["last_timestamp"].to_numpy(dtype=object),
+            "ttke": _as_int_if_complete(partials["ttke"].to_numpy(dtype=float)),
+        }
+    )
+    return finalize_key_metrics(df)
+
+
+def keys_from_raw(keystats: pd.DataFrame) -> pd.DataFrame:
+    """Per-key metrics (like compute_key_metrics) from the keystats frame."""
+    return keys_from_partials(key_partials(keystats))
+
+
+def compute_all_metrics(conn: sqlite3.Connection, columnar_dir=None) -> tuple:
+    """
+    Full rebuild of daily and key metrics from one read of lessons_raw and
+    keystats_raw, aggregated in memory with vectorized pandas/NumPy group
+    operations. Returns (daily_df, key_df) with the same columns and values
+    as compute_daily_metrics() and compute_key_metrics(), float sums up to
+    rounding; the latency percentiles come from the sketches in both cases.
+
+    Not offered by build_metrics.py: reading every raw row is slower than
+    the SQL path, which works off the tables maintained at ingest. It stays
+    as the in-memory reference timed by benchmark.py; the chunked engine
+    builds on its aggregation functions.
+
+    With `columnar_dir`, the raw tables are memory-mapped from the columnar
+    mirror if it matches the DB; otherwise they are read from SQLite.
+    """
+    if columnar_dir is not None and mirror_is_current(conn, columnar_dir):
+        print(f"Reading raw tables from columnar mirror: {columnar_dir}")
+        lessons, keystats = read_mirror_tables(columnar_dir)
+        lessons, keystats = compact_lessons(lessons), compact_keystats(keystats)
+    else:
+        if columnar_dir is not None:
+            print("Columnar mirror missing or out of date – reading raw tables from SQLite.")
+        lessons, keystats = read_raw_tables(conn)
+
+    # Compacted days (metrics/compaction.py) are no longer in keystats_raw
+    partials = merge_key_partials([key_partials(keystats), rollup_key_partials(conn)])
+    daily = add_rolling_metrics(daily_from_raw(lessons, keystats, compacted_lessons(conn)))
+    keys = add_latency_percentiles(conn, keys_from_partials(partials))
+
+    return daily.sort_values("date"), keys
@@ -0,0 +1,115 @@
+# scripts/metrics/export.py
+
+import hashlib
+import os
+from pathlib import Path
+
+# Bytes read per step when hashing files
+_DIGEST_CHUNK = 1 << 20
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a file's content (hex), read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_DIGEST_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_if_changed(path: Path, data: bytes) -> bool:
+    """
+    Write `data` to `path` unless the file already holds exactly these
+    bytes; an unchanged file keeps its mtime (no spurious syncs or diffs).
+    The new content replaces the old one atomically. True if written.
+    """
+    path = Path(path)
+    if path.is_file() and path.stat().st_size == len(data) and path.read_bytes() == data:
+        return False
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return True
+
+
+def write_csv(df, path: Path) -> bool:
+    """DataFrame -> CSV (same bytes as df.to_csv(path, index=False)), skipped if unchanged."""
+    return write_if_changed(path, df.to_csv(index=False).encode("utf-8"))
+
+
+def _split_tail(path: Path, column_index: int, since: str) -> tuple:
+    """
+    Locate the rows of a sorted CSV whose `column_index` field is >= `since`
+    (all data rows are kept if `since` is None), reading backwards from the
+    end of the file so that only the tail and one row before it are read.
+    Returns (offset of the first tail row, header line, last kept line or
+    None if no data row is kept); lines include their newline.
+    """
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        header = f.readline()
+        block = _DIGEST_CHUNK // 16
+        pos = size
+        while True:
+            pos = max(len(header), pos - block)
+            f.seek(pos)
+            data = f.read(size - pos)
+            lines = data.splitlines(keepends=True)
+            # The first line of the block may be cut off unless it starts right after the header
+            first_complete = 0 if pos == len(header) else 1
+            offset = size
+            for line in reversed(lines[first_complete:]):
+                field = line.split(b",", column_index + 1)[column_index].rstrip(b"\r\n").decode()
+                if since is not None and field >= since:
+                    offset -= len(line)
+                    continue
+                return offset, header, line
+            if pos == len(header):
+                return offset, header, None
+            block *= 2
+
+
+def write_csv_tail(df, path: Path, column: str, since=None) -> bool:
+    """
+    Update a CSV written by write_csv() from a frame sorted by `column` in
+    which only rows with `column` >= `since` changed (None: no row changed).
+    Only those rows are formatted; the rows before them are copied over
+    byte for byte and the new file replaces the old one atomically.
+
+    The kept part is trusted only if the header and the last kept row match
+    what `df` renders now (same columns, same number formatting); otherwise,
+    or without an existing file, the whole CSV is written. True if written.
+    """
+    path = Path(path)
+    if not path.is_file():
+        return write_csv(df, path)
+
+    values = df[column]
+    head = df[values < since] if since is not None else df
+    tail = df[values >= since] if since is not None else df.iloc[:0]
+
+    offset, header, last_kept = _split_tail(path, df.columns.get_loc(column), since)
+    expected_header = df.iloc[:0].to_csv(index=False).encode("utf-8")
+    expected_last = head.iloc[-1:].to_csv(index=False, header=False).encode("utf-8")
+    if header != expected_header or (last_kept or b"") != expected_last:
+        return write_csv(df, path)
+
+    new_tail = tail.to_csv(index=False, header=False).encode("utf-8")
+    if path.stat().st_size - offset == len(new_tail):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            if f.read() == new_tail:
+                return False
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        remaining = offset
+        while remaining:
+            chunk = src.read(min(_DIGEST_CHUNK, remaining))
+            dst.write(chunk)
+            remaining -= len(chunk)
+        dst.write(new_tail)
+    os.replace(tmp, path)
+    return True
@@ -4,58 +4,125 @@ import pandas as pd
 import sqlite3
 import numpy as np
 
+from .sketch import LATENCY_QUANTILES, key_latency_percentiles
+
+
+def rebuild_key_accumulators(conn: sqlite3.Connection) -> None:
+    """
+    Baut key_stats_acc komplett aus keystats_raw neu auf (einmaliger Full-Scan),
+    zusammen mit den verdichteten Tagen aus keystats_daily (siehe
+    metrics/compaction.py). Nötig für DBs, die vor key_stats_acc befüllt
+    wurden, oder nach einem Import, der an update_keybr vorbei in
+    keystats_raw schreibt.
+    """
+
+    conn.execute("DELETE FROM key_stats_acc;")
+    conn.execute(
+        """
+        INSERT INTO key_stats_acc (
+            key, hit_sum, miss_sum, latency_sum, latency_count,
+            min_miss_latency, max_timestamp
+        )
+        SELECT key, SUM(hits), SUM(misses), SUM(latency_sum), SUM(latency_count),
+               MIN(min_miss_latency), MAX(last_timestamp)
+        FROM (
+            SELECT
+                key,
+                COALESCE(SUM(hitCount), 0) AS hits,
+                COALESCE(SUM(missCount), 0) AS misses,
+                COALESCE(SUM(timeToType_ms), 0) AS latency_sum,
+                COUNT(timeToType_ms) AS latency_count,
+                MIN(CASE WHEN missCount > 0 THEN timeToType_ms END) AS min_miss_latency,
+                MAX(timeStamp) AS last_timestamp
+            FROM keystats_raw
+            WHERE key IS NOT NULL AND key <> ''
+            GROUP BY key
+            UNION ALL
+            SELECT key, hits, misses, latency_sum, latency_count, min_miss_latency, last_timestamp
+            FROM keystats_daily
+            WHERE key <> ''
+        )
+        GROUP BY key
+        """
+    )
+    conn.commit()
+
+
+def _key_accumulators_missing(conn: sqlite3.Connection) -> bool:
+    """True, wenn keystats_raw (oder keystats_daily) Daten hat, key_stats_acc aber leer ist."""
+    acc_empty = conn.execute("SELECT 1 FROM key_stats_acc LIMIT 1;").fetchone() is None
+    raw_empty = conn.execute("SELECT 1 FROM keystats_raw LIMIT 1;").fetchone() is None
+    rollup_empty = conn.execute("SELECT 1 FROM keystats_daily LIMIT 1;").fetchone() is None
+    return acc_empty and not (raw_empty and rollup_empty)
+
+
+def ensure_key_accumulators(conn: sqlite3.Connection) -> None:
+    """Baut key_stats_acc neu auf, wenn die Tabelle leer ist, keystats_raw aber nicht."""
+    if _key_accumulators_missing(conn):
+        print("key_stats_acc is empty – rebuilding from keystats_raw ...")
+        rebuild_key_accumulators(conn)
+
 
 def compute_key_metrics(conn: sqlite3.Connection) -> pd.DataFrame:
     """
-    Aggregiert Metriken pro Taste aus keystats_raw:
+    Leitet Metriken pro Taste aus den laufenden Summen in key_stats_acc ab
+    (eine Zeile pro Taste, wird beim Import mitgeführt):
 
     Basis:
-    - attempts  = SUM(hitCount + missCount)
+    - attempts  = SUM(hitCount) + SUM(missCount)
     - errors    = SUM(missCount)
     - miss_rate = errors / attempts
-    - avg_latency = AVG(timeToType_ms)
+    - avg_latency = SUM(timeToType_ms) / COUNT(timeToType_ms)  (= AVG)
     - last_timestamp = MAX(timeStamp)
 
     Erweiterungen (nur im DataFrame / CSV):
     - ttke      = MIN(timeToType_ms WHERE missCount > 0)
     - weak_score = gewichtete Kombination aus miss_rate, normierter Latenz und Rarity-Penalty
+    - latency_p50/p90/p99 = Latenz-Perzentile aus key_latency_sketch (±1 %)
     """
 
-    # Basis-Metriken
-    base_sql = """
+    ensure_key_accumulators(conn)
+
+    acc_sql = """
         SELECT
             key,
-            SUM(hitCount + missCount) AS attempts,
-            SUM(missCount) AS errors,
-            AVG(timeToType_ms) AS avg_latency,
-            MAX(timeStamp) AS last_timestamp
-        FROM keystats_raw
-        WHERE key IS NOT NULL AND key <> ''
-        GROUP BY key
+            hit_sum + miss_sum AS attempts,
+            miss_sum AS errors,
+            CAST(latency_sum AS REAL) / latency_count AS avg_latency,
+            max_timestamp AS last_timestamp,
+            min_miss_latency AS ttke
+        FROM key_stats_acc
         ORDER BY key
     """
-    base_df = pd.read_sql_query(base_sql, conn)
+    df = pd.read_sql_query(acc_sql, conn)
+    return add_latency_percentiles(conn, finalize_key_metrics(df))
 
-    # TTKE pro Key: minimaler timeToType_ms bei Fehlertasten
-    ttke_sql = """
-        SELECT
-            key,
-            MIN(timeToType_ms) AS ttke
-        FROM keystats_raw
-        WHERE key IS NOT NULL AND key <> '' AND missCount > 0
-        GROUP BY key
+
+def add_latency_percentiles(conn: sqlite3.Connection, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Hängt latency_p50/p90/p99 an die Tastenmetriken an, zusammengeführt aus
+    den Tages-Sketches in key_latency_sketch (kein Scan über keystats_raw).
+    Tasten ohne Latenzwerte bekommen NaN.
     """
-    ttke_df = pd.read_sql_query(ttke_sql, conn)
 
-    df = base_df.merge(ttke_df, on="key", how="left")
+    percentiles = key_latency_percentiles(conn)
+    df = df.merge(percentiles, on="key", how="left")
+    for col, _ in LATENCY_QUANTILES:
+        df[col] = df[col].astype(float)
+    return df
 
-    # Miss-Rate
-    df["miss_rate"] = df.apply(
-        lambda row: (row["errors"] / row["attempts"])
-        if row["attempts"] and row["attempts"] > 0
-        else 0.0,
-        axis=1,
-    )
+
+def finalize_key_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ergänzt miss_rate und weak_score (vektorisiert). Erwartet die Spalten
+    key, attempts, errors, avg_latency, last_timestamp, ttke.
+    """
+
+    # Miss-Rate (0.0 bei Tasten ohne Versuche)
+    attempts = df["attempts"].to_numpy(dtype=float, na_value=np.nan)
+    errors = df["errors"].to_numpy(dtype=float, na_value=np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        df["miss_rate"] = np.where(attempts > 0, errors / attempts, 0.0)
 
     # Weak-Score berechnen
     df["weak_score"] = _compute_weak_scores(df)
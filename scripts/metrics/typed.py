@@ -0,0 +1,128 @@
+# scripts/metrics/typed.py
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .codepoints import code_point_key
+
+# Compact in-memory form of the raw tables for the metrics engine:
+# - integer columns in the smallest dtype that holds their values
+#   (counts and latencies usually fit uint8/uint16, code points uint32)
+# - the key is not loaded as one string per row but derived from codePoint
+#   through a lookup table (categorical: int8/int16 codes + one label per key)
+# - date (and the keystats timeStamp, one per lesson) as a categorical
+#   with sorted categories, epoch_ms as int64
+# Columns with NULLs stay float64 (NaN), as read_sql_query returns them.
+# Sums over narrowed columns must be taken in int64/float64 (see engine.py).
+#
+# This is the read side only. Ingest still writes keystats_raw row by row
+# (update_keybr.histogram_to_rows): sqlite3 takes one tuple per row, so
+# column arrays built there would just be transposed back, and the table
+# keeps its key TEXT column because the SQL aggregates group by it.
+
+# Rows per chunk when reading from SQLite: bounds the temporary
+# object/int64 frame read_sql_query builds before it is narrowed
+READ_CHUNK_ROWS = 250_000
+
+_INT_DTYPES = [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32, np.int64]
+
+
+def narrow_int(values) -> np.ndarray:
+    """Integer values in the smallest dtype that holds them; floats (NULLs) unchanged."""
+    values = np.asarray(values)
+    if values.dtype.kind not in "iu" or len(values) == 0:
+        return values
+    low, high = values.min(), values.max()
+    for dtype in _INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype, copy=False)
+    return values
+
+
+def key_lookup(code_points) -> pd.Categorical:
+    """
+    Keys for an array of code points: chr() runs once per distinct code
+    point, the rows only hold the category codes. Categories are sorted
+    (string order, as in SQLite); missing or invalid code points are NaN.
+    """
+    code_points = np.asarray(code_points)
+    valid = ~np.isnan(code_points) if code_points.dtype.kind == "f" else slice(None)
+    distinct = np.unique(code_points[valid]).astype(np.int64)
+    labels = [code_point_key(int(cp)) for cp in distinct]
+
+    categories = sorted({label for label in labels if label is not None})
+    category_code = {label: i for i, label in enumerate(categories)}
+    lookup = np.array([category_code.get(label, -1) for label in labels], dtype=np.int64)
+
+    codes = np.full(len(code_points), -1, dtype=np.int64)
+    codes[valid] = lookup[np.searchsorted(distinct, code_points[valid].astype(np.int64))]
+    return pd.Categorical.from_codes(narrow_int(codes), categories=categories)
+
+
+def _categorical(values) -> pd.Categorical:
+    """Strings as a categorical (pandas sorts the categories)."""
+    return pd.Categorical(values)
+
+
+def compact_lessons(lessons: pd.DataFrame) -> pd.DataFrame:
+    """Narrow a lessons_raw frame: lengths and errors as small integers, date categorical."""
+    out = {}
+    for col in lessons.columns:
+        values = lessons[col]
+        if col == "date" and not isinstance(values.dtype, pd.CategoricalDtype):
+            out[col] = _categorical(values)
+        elif col in ("length", "errors", "time_ms"):
+            out[col] = narrow_int(values.to_numpy())
+        else:
+            out[col] = values
+    return pd.DataFrame(out)
+
+
+def compact_keystats(keystats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Narrow a keystats_raw frame: counts, latencies and code points in small
+    integer dtypes, date and timeStamp categorical, and the key derived from
+    codePoint (if the frame has no key column yet).
+    """
+    out = {}
+    for col in keystats.columns:
+        values = keystats[col]
+        if col in ("date", "timeStamp", "key") and not isinstance(values.dtype, pd.CategoricalDtype):
+            out[col] = _categorical(values)
+        elif col in ("codePoint", "hitCount", "missCount", "timeToType_ms"):
+            out[col] = narrow_int(values.to_numpy())
+        else:
+            out[col] = values
+    if "key" not in out and "codePoint" in out:
+        out["key"] = key_lookup(out["codePoint"])
+    return pd.DataFrame(out)
+
+
+def _concat(chunks) -> pd.DataFrame:
+    """Concatenate compacted chunks; categoricals get the union of (sorted) categories."""
+    if len(chunks) == 1:
+        return chunks[0]
+    out = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            out[col] = pd.api.types.union_categoricals(parts, sort_categories=True)
+        else:
+            out[col] = np.concatenate([np.asarray(part) for part in parts])
+    return pd.DataFrame(out)
+
+
+def read_compact(
+    conn: sqlite3.Connection, sql: str, compact, chunk_rows: int = READ_CHUNK_ROWS, params=()
+):
+    """
+    Run `sql` (with `params`) and return its rows compacted chunk by chunk
+    with `compact` (read_sql_query yields at least one, possibly empty, chunk).
+    """
+    reader = pd.read_sql_query(sql, conn, params=params, chunksize=chunk_rows)
+    chunks = [compact(chunk) for chunk in reader]
+    return _concat(chunks)
+
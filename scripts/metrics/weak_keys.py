@@ -1,32 +1,147 @@
 # scripts/metrics/weak_keys.py
 
+import sqlite3
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+from .cube import ensure_cube
+from .export import write_csv
+from .keys import finalize_key_metrics
+
+# Summen pro Taste und Tag, als laufende Summen (Präfixsummen) gehalten
+PREFIX_COLUMNS = ["hits", "misses", "latency_sum", "latency_count"]
+
+# Abstand der Tasten im kombinierten Suchschlüssel code * _KEY_STRIDE + Tag
+_KEY_STRIDE = 1 << 32
+
+
+def top_k(values: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positionen der k größten Werte, absteigend sortiert (bei Gleichstand die
+    frühere Position zuerst, NaN zuletzt). Wählt per argpartition aus und
+    sortiert nur die k Treffer statt des ganzen Arrays.
+    """
+
+    values = np.asarray(values, dtype=float)
+    valid = np.flatnonzero(~np.isnan(values))
+    if k < len(valid):
+        valid = valid[np.argpartition(-values[valid], k - 1)[:k]]
+    order = valid[np.lexsort((valid, -values[valid]))]
+    if len(order) < k:
+        order = np.concatenate([order, np.flatnonzero(np.isnan(values))[: k - len(order)]])
+    return order
+
 
 def get_weak_keys(key_df: pd.DataFrame, min_attempts: int = 200, top_n: int = 20) -> pd.DataFrame:
     """
     Liefert die schwächsten Tasten nach weak_score, gefiltert nach Mindestversuchen.
+    Ohne passende Tasten ein leerer Frame mit den Spalten von key_df.
     """
 
-    if key_df.empty or "weak_score" not in key_df.columns:
+    if "weak_score" not in key_df.columns:
         return pd.DataFrame()
 
-    df = key_df.copy()
-    df = df[df["attempts"] >= min_attempts]
+    attempts = key_df["attempts"].to_numpy(dtype=float, na_value=np.nan)
+    eligible = np.flatnonzero(attempts >= min_attempts)
+    scores = key_df["weak_score"].to_numpy(dtype=float, na_value=np.nan)[eligible]
+    return key_df.iloc[eligible[top_k(scores, top_n)]]
+
+
+def key_prefix_sums(conn: sqlite3.Connection) -> dict:
+    """
+    Präfixsummen pro Taste und Tag aus dem Cube (key_cube, über Layout und
+    Texttyp zusammengefasst): Zeilen nach (Taste, Tag) sortiert, dazu die
+    laufenden Summen der PREFIX_COLUMNS über alle Zeilen. Einmal pro Lauf
+    aufbauen; jedes Zeitfenster kostet danach nur zwei binäre Suchen pro
+    Taste (window_key_totals).
+    """
+
+    ensure_cube(conn)
+    per_day = pd.read_sql_query(
+        """
+        SELECT
+            key,
+            date,
+            SUM(hits) AS hits,
+            SUM(misses) AS misses,
+            SUM(latency_sum) AS latency_sum,
+            SUM(latency_count) AS latency_count
+        FROM key_cube
+        WHERE key <> '' AND date <> ''
+        GROUP BY key, date
+        ORDER BY key, date
+        """,
+        conn,
+    )
 
-    if df.empty:
-        return df
+    codes, labels = pd.factorize(per_day["key"], sort=True)
+    days = per_day["date"].to_numpy(dtype="datetime64[D]").astype(np.int64)
 
-    df = df.sort_values("weak_score", ascending=False)
-    return df.head(top_n)
+    prefix = {"keys": np.asarray(labels, dtype=object), "search": codes * _KEY_STRIDE + days}
+    for col in PREFIX_COLUMNS:
+        prefix[col] = np.concatenate([[0], np.cumsum(per_day[col].to_numpy(dtype=np.int64))])
+    return prefix
 
 
-def export_weak_keys(weak_df: pd.DataFrame, output_dir: Path) -> None:
-    if weak_df.empty:
-        return
+def window_key_totals(prefix: dict, since: str = None, until: str = None) -> pd.DataFrame:
+    """
+    Tastenmetriken (key, attempts, errors, avg_latency, miss_rate,
+    weak_score) über die Tage in [since, until] (None: offen), als
+    Differenz zweier Präfixsummen pro Taste. Tasten ohne Anschläge im
+    Fenster fehlen; weak_score normiert die Latenz innerhalb des Fensters.
+    """
+
+    base = np.arange(len(prefix["keys"]), dtype=np.int64) * _KEY_STRIDE
+    first = 0 if since is None else np.datetime64(since, "D").astype(np.int64)
+    last = _KEY_STRIDE - 1 if until is None else np.datetime64(until, "D").astype(np.int64)
+    lo = np.searchsorted(prefix["search"], base + first, side="left")
+    hi = np.searchsorted(prefix["search"], base + last, side="right")
+
+    totals = {col: prefix[col][hi] - prefix[col][lo] for col in PREFIX_COLUMNS}
+    present = hi > lo
+
+    latency_count = totals["latency_count"][present]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_latency = np.where(
+            latency_count > 0, totals["latency_sum"][present] / latency_count, np.nan
+        )
+
+    df = pd.DataFrame(
+        {
+            "key": prefix["keys"][present],
+            "attempts": (totals["hits"] + totals["misses"])[present],
+            "errors": totals["misses"][present],
+            "avg_latency": avg_latency,
+        }
+    )
+    return finalize_key_metrics(df)
+
+
+def windowed_weak_keys(
+    prefix: dict,
+    since: str = None,
+    until: str = None,
+    min_attempts: int = 200,
+    top_n: int = 20,
+) -> pd.DataFrame:
+    """Schwächste Tasten im Zeitfenster [since, until], siehe window_key_totals."""
+
+    return get_weak_keys(window_key_totals(prefix, since, until), min_attempts, top_n)
+
+
+def export_weak_keys(weak_df: pd.DataFrame, output_dir: Path, name: str = "weak_keys.csv") -> None:
+    """
+    Schreibt die Weak Keys als CSV, auch wenn keine Taste die Mindestversuche
+    erreicht (dann nur die Kopfzeile): die Datei gehört immer zu den
+    Ausgaben, und eine veraltete Liste aus einem früheren Lauf bleibt nicht
+    stehen.
+    """
 
     output_dir.mkdir(exist_ok=True)
-    path = output_dir / "weak_keys.csv"
-    weak_df.to_csv(path, index=False)
-    print(f"Exported weak keys to {path}")
+    path = output_dir / name
+    if write_csv(weak_df, path):
+        print(f"Exported weak keys to {path}")
+    else:
+        print(f"Weak keys unchanged: {path}")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Change-detection manifest of the pipeline (run_pipeline.py).
+
+After every run the pipeline records what it has seen, next to the DB
+(db/pipeline_manifest.json, profiles/<name>/pipeline_manifest.json):
+
+- input:       size, mtime and SHA-256 of the export it ingested
+- last_lesson: timeStamp of the newest lesson in the DB afterwards
+- db:          data version of the DB, i.e. the fingerprint (row count,
+               max id) of lessons_raw and keystats_raw
+- outputs:     SHA-256 of every metric CSV it wrote
+
+The next run compares against it stage by stage: an export with the same
+size and mtime (or, if touched, the same content hash) is not parsed again
+as long as the DB still has the recorded data version, and the metric
+stage is skipped if the DB has not changed since and the CSVs on disk still
+have the recorded hashes. The manifest is only a cache: deleting it just
+makes the next run do all the work once.
+
+Example:
+    python3 scripts/pipeline_manifest.py      # show the manifest of the main DB
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+from metrics.columnar import table_fingerprint
+from metrics.export import file_digest
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+
+MANIFEST_NAME = "pipeline_manifest.json"
+FORMAT_VERSION = 1
+
+# Tables whose fingerprints make up the DB data version
+VERSIONED_TABLES = ("lessons_raw", "keystats_raw")
+
+
+def manifest_path_for(db_path: Path) -> Path:
+    """The manifest lives next to its DB."""
+    return Path(db_path).parent / MANIFEST_NAME
+
+
+def load_manifest(path: Path) -> dict:
+    """Parsed manifest, or an empty one if missing, unreadable or outdated."""
+    try:
+        manifest = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != FORMAT_VERSION:
+        return {}
+    return manifest
+
+
+def save_manifest(path: Path, manifest: dict) -> None:
+    """Replace the manifest atomically."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({**manifest, "version": FORMAT_VERSION}, indent=1) + "\n")
+    os.replace(tmp, path)
+
+
+def describe_input(path: Path, previous: dict = None) -> dict:
+    """
+    Size, mtime and content hash of an input file. The hash of `previous`
+    (the recorded description) is reused if size and mtime are unchanged,
+    so an untouched export is not even read.
+    """
+    stat = Path(path).stat()
+    info = {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    previous = previous or {}
+    if all(previous.get(k) == info[k] for k in ("path", "size", "mtime_ns")):
+        info["sha256"] = previous.get("sha256")
+    else:
+        info["sha256"] = file_digest(path)
+    return info
+
+
+def same_content(current: dict, previous: dict) -> bool:
+    """True if two input descriptions refer to identical content."""
+    return bool(previous) and current["sha256"] == previous.get("sha256")
+
+
+def db_data_version(conn: sqlite3.Connection) -> dict:
+    """
+    Persistent data version of the DB: the raw-table fingerprints change
+    with every ingest, also one that bypasses the pipeline (initial_import.py).
+    PRAGMA data_version would not do: it only counts commits seen by one
+    connection.
+    """
+    return {table: table_fingerprint(conn, table) for table in VERSIONED_TABLES}
+
+
+def output_digests(paths) -> dict:
+    """SHA-256 per existing output file, keyed by file name."""
+    return {Path(p).name: file_digest(p) for p in paths if Path(p).is_file()}
+
+
+def outputs_unchanged(manifest: dict, paths) -> bool:
+    """True if every output exists and still has the hash recorded in the manifest."""
+    recorded = manifest.get("outputs") or {}
+    paths = [Path(p) for p in paths]
+    return all(p.is_file() for p in paths) and output_digests(paths) == {
+        p.name: recorded.get(p.name) for p in paths
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Show the pipeline's change-detection manifest.")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help=f"SQLite DB (default: {DB_PATH}).")
+    args = parser.parse_args()
+
+    path = manifest_path_for(args.db)
+    manifest = load_manifest(path)
+    if not manifest:
+        print(f"No manifest at {path} – the next run does all the work.")
+        return
+    print(json.dumps(manifest, indent=1))
+
+
+if __name__ == "__main__":
+    main()
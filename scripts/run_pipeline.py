@@ -7,14 +7,38 @@ Steps:
 2. Rebuild metrics CSVs (daily_metrics.csv, key_metrics.csv, weak_keys.csv)
 3. Commit & push changes to GitHub (if output/*.csv changed)
 
+Steps 1 and 2 run in this process on one shared DB connection (no Python
+subprocesses); pandas and the metric code are only imported when step 2
+has something to do, so a run without new lessons finishes quickly.
+
+Every run writes a JSON run report (reports/last_run.json; see
+instrumentation.py): wall/CPU time, rows and rows/s per stage, the SQLite
+statements executed with their time, and peak RSS. --history also appends
+it as one line to reports/run_history.jsonl.
+
+Team mode (--profiles): every profile is a directory profiles/<name>/ with
+its own export (typing-data.json) and DB (keybr.db). Steps 1 and 2 run for
+all profiles in parallel worker processes (--jobs); outputs go to
+output/profiles/<name>/, and a combined summary across all profiles to
+output/team/ (team_daily_metrics.csv, team_key_metrics.csv).
+
 You can run this script from:
 - repo root:      python3 scripts/run_pipeline.py
 - scripts folder: python3 run_pipeline.py
 - any location:   python3 /full/path/to/keybr_analytics/scripts/run_pipeline.py
+
+Examples:
+    python3 scripts/run_pipeline.py --profiles            # all profiles
+    python3 scripts/run_pipeline.py --profiles anna ben --jobs 2 --no-git
+    python3 scripts/run_pipeline.py --history                # keep a performance log
 """
 
+import argparse
+import contextlib
+import os
 import subprocess
-import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from datetime import date
 
@@ -25,6 +49,22 @@ from datetime import date
 ROOT_DIR = Path(__file__).resolve().parents[1]
 SCRIPTS_DIR = ROOT_DIR / "scripts"
 OUTPUT_DIR = ROOT_DIR / "output"
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+JSON_PATH = ROOT_DIR / "raw" / "typing-data.json"
+
+# Files written by step 2; missing ones force a metric build
+METRIC_CSVS = ("daily_metrics.csv", "key_metrics.csv", "weak_keys.csv")
+
+# Run reports (instrumentation.py)
+REPORTS_DIR = ROOT_DIR / "reports"
+REPORT_PATH = REPORTS_DIR / "last_run.json"
+HISTORY_PATH = REPORTS_DIR / "run_history.jsonl"
+
+# Team mode: profiles/<name>/{typing-data.json,keybr.db}
+PROFILES_DIR = ROOT_DIR / "profiles"
+PROFILE_OUTPUT_DIR = OUTPUT_DIR / "profiles"
+TEAM_OUTPUT_DIR = OUTPUT_DIR / "team"
+PROFILE_EXPORT_NAME = "typing-data.json"
 
 
 def run(cmd, cwd: Path = ROOT_DIR, check: bool = True) -> int:
@@ -42,51 +82,257 @@ def run(cmd, cwd: Path = ROOT_DIR, check: bool = True) -> int:
 # --------------------------------------------------------------------
 # Pipeline steps
 # --------------------------------------------------------------------
-def update_database() -> None:
-    """Step 1: JSON → SQLite DB via update_keybr.py."""
-    print("\n[1/3] Updating SQLite DB from raw/typing-data.json ...")
-    run([sys.executable, str(SCRIPTS_DIR / "update_keybr.py")])
+def metrics_up_to_date(conn, dates, output_dir: Path) -> bool:
+    """
+    True if step 2 has nothing to do: no lessons imported now or since the
+    last build, daily_metrics and rolling_state complete and all CSVs
+    present. Plain SQL, so the check itself needs neither pandas nor the
+    metric code.
+    """
+    if dates:
+        return False
+    if conn.execute("SELECT 1 FROM pending_dates LIMIT 1;").fetchone():
+        return False
+    total, incomplete = conn.execute(
+        "SELECT COUNT(*), SUM(num_lessons IS NULL) FROM daily_metrics;"
+    ).fetchone()
+    if total == 0 or incomplete:
+        return False
+    state_rows, state_incomplete = conn.execute(
+        "SELECT COUNT(*), SUM(wpm_sum_err IS NULL) FROM rolling_state;"
+    ).fetchone()
+    if state_rows != total or state_incomplete:
+        return False
+    return all((output_dir / name).is_file() for name in METRIC_CSVS)
+
+
+def run_stages(conn, db_path: Path, json_path: Path, output_dir: Path, report=None) -> None:
+    """
+    Steps 1 and 2 on an open connection: ingest the export, then build
+    metrics. Each step is skipped if the change-detection manifest
+    (pipeline_manifest.py) shows that its inputs have not changed.
+    Both steps are measured as stages "ingest" and "metrics" of `report`.
+    """
+    from instrumentation import RunReport
+    from bulk_writer import apply_pragmas
+    from columnar_store import mirror_dir_for, open_store
+    from pipeline_manifest import (
+        db_data_version,
+        describe_input,
+        load_manifest,
+        manifest_path_for,
+        output_digests,
+        outputs_unchanged,
+        same_content,
+        save_manifest,
+    )
+    from schema import ensure_schema
+    from update_keybr import get_last_timestamp, ingest_stream
+
+    report = report or RunReport()
+    apply_pragmas(conn)
+    ensure_schema(conn)
 
+    manifest_path = manifest_path_for(db_path)
+    manifest = load_manifest(manifest_path)
+    outputs = [output_dir / name for name in METRIC_CSVS]
+
+    print(f"\n[1/3] Updating SQLite DB from {json_path} ...")
+    with report.stage("ingest", conn) as stage:
+        previous_version = db_data_version(conn)
+        export = describe_input(json_path, manifest.get("input"))
+        if same_content(export, manifest.get("input")) and previous_version == manifest.get("db"):
+            print("Export and DB unchanged since the last run – skipping ingest.")
+            dates = set()
+            stage["skipped"] = True
+        else:
+            store = open_store(root=mirror_dir_for(db_path))
+            try:
+                dates = ingest_stream(conn, json_path, store=store)
+            finally:
+                if store is not None:
+                    store.discard()
+        data_version = db_data_version(conn)
+        stage.update(
+            {
+                "export_bytes": export["size"],
+                "lessons": data_version["lessons_raw"]["rows"]
+                - previous_version["lessons_raw"]["rows"],
+                "keystats_rows": data_version["keystats_raw"]["rows"]
+                - previous_version["keystats_raw"]["rows"],
+            }
+        )
+        stage["rows"] = stage["lessons"] + stage["keystats_rows"]
 
-def rebuild_metrics() -> None:
-    """Step 2: DB → CSVs via build_metrics.py."""
     print("\n[2/3] Rebuilding metrics CSVs ...")
-    run([sys.executable, str(SCRIPTS_DIR / "build_metrics.py")])
+    with report.stage("metrics", conn) as stage:
+        if (
+            data_version == manifest.get("db")
+            and metrics_up_to_date(conn, dates, output_dir)
+            and outputs_unchanged(manifest, outputs)
+        ):
+            print("No new lessons, metrics complete and CSVs unchanged – skipping metric build.")
+            stage["skipped"] = True
+        else:
+            import build_metrics
+
+            daily_df, key_df = build_metrics.build(
+                conn,
+                incremental=True,
+                output_dir=output_dir,
+                dates=dates,
+            )
+            stage["rows"] = len(daily_df) + len(key_df)
+
+    updated = {
+        "input": export,
+        "last_lesson": get_last_timestamp(conn),
+        "db": data_version,
+        "outputs": output_digests(outputs),
+    }
+    if updated != {k: manifest.get(k) for k in updated}:
+        save_manifest(manifest_path, updated)
+
+
+def run_pipeline(
+    db_path: Path = DB_PATH,
+    json_path: Path = JSON_PATH,
+    output_dir: Path = OUTPUT_DIR,
+    report=None,
+) -> None:
+    """Steps 1 and 2 for the main DB; statements are timed into `report`."""
+    import sqlite3
+
+    from instrumentation import InstrumentedConnection
 
+    print(f"Connecting to DB: {db_path}")
+    conn = sqlite3.connect(db_path, factory=InstrumentedConnection)
+    try:
+        run_stages(conn, db_path, json_path, output_dir, report)
+    finally:
+        if report is not None:
+            report.add_queries(conn)
+        conn.close()
 
-def git_has_output_changes() -> bool:
+
+# --------------------------------------------------------------------
+# Team mode
+# --------------------------------------------------------------------
+def discover_profiles() -> list:
+    """Names of all profile directories that contain an export."""
+    if not PROFILES_DIR.is_dir():
+        return []
+    return sorted(
+        p.name for p in PROFILES_DIR.iterdir() if (p / PROFILE_EXPORT_NAME).is_file()
+    )
+
+
+def process_profile(name: str) -> dict:
+    """
+    Steps 1 and 2 for one profile, in a worker process. The stage output
+    goes to profiles/<name>/pipeline.log; returned are the daily metrics and
+    the per-key running sums for the team summary, plus the profile's run
+    report.
     """
-    Check whether there are changes under output/.
+    # Imported here so the parent process stays light
+    import sqlite3
 
-    'git diff --quiet -- output' returns:
-      0 → no changes
-      1 → there are changes
+    from build_metrics import read_daily_metrics
+    from instrumentation import InstrumentedConnection, RunReport
+    from metrics.team import read_key_partials
+
+    profile_dir = PROFILES_DIR / name
+    db_path = profile_dir / "keybr.db"
+    output_dir = PROFILE_OUTPUT_DIR / name
+
+    start = time.perf_counter()
+    report = RunReport(db=str(db_path))
+    with open(profile_dir / "pipeline.log", "w") as log, contextlib.redirect_stdout(log):
+        conn = sqlite3.connect(db_path, factory=InstrumentedConnection)
+        try:
+            run_stages(conn, db_path, profile_dir / PROFILE_EXPORT_NAME, output_dir, report)
+            daily = read_daily_metrics(conn)
+            key_partials = read_key_partials(conn)
+        finally:
+            report.add_queries(conn)
+            conn.close()
+
+    return {
+        "profile": name,
+        "seconds": time.perf_counter() - start,
+        "daily": daily,
+        "key_partials": key_partials,
+        "report": report.as_dict(),
+    }
+
+
+def process_profiles(names: list, jobs: int) -> tuple:
+    """Run all profiles on a process pool; returns (results, failed names)."""
+    print(f"\n[1-2/3] Updating {len(names)} profile(s) with {jobs} worker(s) ...")
+    results = {}
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(process_profile, name): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as exc:
+                failed.append(name)
+                print(f"  {name}: FAILED ({exc!r}) – see {PROFILES_DIR / name / 'pipeline.log'}")
+            else:
+                print(f"  {name}: done in {results[name]['seconds']:.1f}s")
+
+    return results, sorted(failed)
+
+
+def write_team_summary(results: dict) -> None:
+    """Combined daily and key metrics across all processed profiles."""
+    from metrics.export import write_csv
+    from metrics.team import combine_profile_daily, combine_profile_keys
+
+    TEAM_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    daily = combine_profile_daily({name: r["daily"] for name, r in results.items()})
+    keys = combine_profile_keys({name: r["key_partials"] for name, r in results.items()})
+
+    daily_path = TEAM_OUTPUT_DIR / "team_daily_metrics.csv"
+    key_path = TEAM_OUTPUT_DIR / "team_key_metrics.csv"
+    for path, df in ((daily_path, daily), (key_path, keys)):
+        if write_csv(df, path):
+            print(f"Exported {path}")
+        else:
+            print(f"Unchanged: {path}")
+
+
+# --------------------------------------------------------------------
+# Git
+# --------------------------------------------------------------------
+def git_has_output_changes(paths) -> bool:
+    """
+    Check whether there are changes (including new files) under `paths`.
+    'git status --porcelain' prints one line per changed or untracked file.
     """
-    rc = subprocess.run(
-        ["git", "diff", "--quiet", "--", "output"],
+    status = subprocess.run(
+        ["git", "status", "--porcelain", "--", *paths],
         cwd=ROOT_DIR,
-    ).returncode
-    return rc != 0
+        capture_output=True,
+        text=True,
+    ).stdout
+    return bool(status.strip())
 
 
-def git_commit_and_push() -> None:
+def git_commit_and_push(paths) -> None:
     """Step 3: commit CSVs and push to GitHub if there are changes."""
     print("\n[3/3] Committing and pushing changes to GitHub ...")
 
-    if not git_has_output_changes():
-        print("No changes in output/*.csv – skipping commit & push.")
+    if not git_has_output_changes(paths):
+        print("No changes in output CSVs – skipping commit & push.")
         return
 
     # Stage CSV files
-    run(
-        [
-            "git",
-            "add",
-            "output/daily_metrics.csv",
-            "output/key_metrics.csv",
-            "output/weak_keys.csv",
-        ]
-    )
+    run(["git", "add", *paths])
 
     # Commit message with current date
     msg = f"Update metrics from {date.today().isoformat()}"
@@ -106,12 +352,86 @@ def git_commit_and_push() -> None:
 # Main
 # --------------------------------------------------------------------
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the KeyBR analytics pipeline.")
+    parser.add_argument(
+        "--profiles",
+        nargs="*",
+        metavar="NAME",
+        help=f"Team mode: process these profiles from {PROFILES_DIR} "
+        "(no names = all profiles with an export).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes in team mode (default: number of CPUs).",
+    )
+    parser.add_argument("--no-git", action="store_true", help="Skip the commit & push step.")
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=REPORT_PATH,
+        help=f"Where to write the JSON run report (default: {REPORT_PATH}).",
+    )
+    parser.add_argument(
+        "--history",
+        nargs="?",
+        type=Path,
+        const=HISTORY_PATH,
+        help=f"Also append the report to a JSON-lines history file (default: {HISTORY_PATH}).",
+    )
+    args = parser.parse_args()
+
+    from instrumentation import RunReport, write_report
+
     print(f"Project root: {ROOT_DIR}")
-    update_database()
-    rebuild_metrics()
-    git_commit_and_push()
+    report = RunReport(mode="single" if args.profiles is None else "team", status="failed")
+
+    try:
+        run_steps(args, report)
+        report.info["status"] = "ok"
+    finally:
+        write_report(report.as_dict(), args.report, args.history)
+        print(f"Run report written to {args.report}")
     print("\nAll done ✅")
 
 
+def run_steps(args, report) -> None:
+    """Steps 1-3 as selected on the command line, measured into `report`."""
+    if args.profiles is None:
+        report.info["db"] = str(DB_PATH)
+        start = time.perf_counter()
+        run_pipeline(report=report)
+        print(f"Steps 1-2 finished in {time.perf_counter() - start:.2f}s")
+        paths = ["output/daily_metrics.csv", "output/key_metrics.csv", "output/weak_keys.csv"]
+    else:
+        names = args.profiles or discover_profiles()
+        if not names:
+            raise SystemExit(f"No profiles found in {PROFILES_DIR}.")
+        missing = [n for n in names if not (PROFILES_DIR / n / PROFILE_EXPORT_NAME).is_file()]
+        if missing:
+            raise SystemExit(f"No {PROFILE_EXPORT_NAME} for profile(s): {', '.join(missing)}")
+
+        start = time.perf_counter()
+        jobs = max(1, min(args.jobs, len(names)))
+        with report.stage("profiles") as stage:
+            results, failed = process_profiles(names, jobs)
+            stage.update({"profiles": len(names), "jobs": jobs, "failed": failed})
+        report.info["profiles"] = {name: r["report"] for name, r in sorted(results.items())}
+        if results:
+            with report.stage("team_summary"):
+                write_team_summary(results)
+        print(f"Profiles finished in {time.perf_counter() - start:.1f}s")
+        if failed:
+            raise SystemExit(f"{len(failed)} profile(s) failed: {', '.join(failed)}")
+        paths = ["output/profiles", "output/team"]
+
+    if args.no_git:
+        print("\n[3/3] Skipping commit & push (--no-git).")
+    else:
+        with report.stage("git"):
+            git_commit_and_push(paths)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,237 @@
+# scripts/schema.py
+
+import sqlite3
+from pathlib import Path
+
+from lesson_identity import lesson_hash, unlinked_hash
+from metrics.cube import rebuild_cube
+from metrics.lessons import rebuild_lesson_metrics
+from metrics.sketch import LEGACY_ZERO_BUCKET, ZERO_BUCKET, rebuild_latency_sketches
+
+SCHEMA_PATH = Path(__file__).resolve().parent / "schema.sql"
+
+# PRAGMA user_version of an up-to-date DB. Migrations that cannot tell
+# from the tables themselves whether they already ran check it:
+#   1  sketch bucket of latency 0 moved from -1 to ZERO_BUCKET
+SCHEMA_VERSION = 1
+
+
+def _rebuild_key_accumulators(conn: sqlite3.Connection) -> None:
+    # metrics.keys pulls in pandas; only needed when the table is (re)filled
+    from metrics.keys import rebuild_key_accumulators
+
+    rebuild_key_accumulators(conn)
+
+
+# Tables maintained at ingest time from the raw tables. When one is added to
+# an existing DB it is filled from keystats_raw right away; otherwise the
+# next import would leave it holding only the new lessons.
+DERIVED_TABLES = {
+    "key_stats_acc": _rebuild_key_accumulators,
+    "lesson_metrics": rebuild_lesson_metrics,
+    "key_latency_sketch": rebuild_latency_sketches,
+    "key_cube": rebuild_cube,
+}
+
+# Columns added after a table was first created. CREATE TABLE IF NOT EXISTS
+# leaves existing tables untouched, so older DBs get them via ALTER TABLE.
+ADDED_COLUMNS = {
+    "lessons_raw": [
+        ("date", "TEXT"),
+        ("epoch_ms", "INTEGER"),
+        ("lesson_hash", "TEXT"),
+    ],
+    "keystats_raw": [
+        ("date", "TEXT"),
+        ("epoch_ms", "INTEGER"),
+        ("lesson_hash", "TEXT"),
+    ],
+    "daily_metrics": [
+        ("num_lessons", "INTEGER"),
+        ("total_chars", "INTEGER"),
+        ("total_errors", "INTEGER"),
+        ("rolling_7d_error_rate", "REAL"),
+        ("rolling_30d_error_rate", "REAL"),
+        ("rolling_7d_latency", "REAL"),
+    ],
+    "rolling_state": [
+        ("wpm_sum_err", "REAL"),
+        ("error_rate_sum_err", "REAL"),
+        ("latency_sum_err", "REAL"),
+    ],
+}
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list:
+    """Column names of a table (empty list if the table does not exist)."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table});")]
+
+
+def backfill_time_columns(conn: sqlite3.Connection) -> None:
+    """
+    Fill date/epoch_ms for raw rows written without them (rows from before
+    these columns existed, or CSV loads). Same values as
+    update_keybr.timestamp_keys(); the date index makes the NULL check cheap.
+    """
+    for table in ("lessons_raw", "keystats_raw"):
+        conn.execute(
+            f"""
+            UPDATE {table}
+            SET date = substr(timeStamp, 1, 10),
+                epoch_ms = CAST(ROUND((julianday(timeStamp) - 2440587.5) * 86400000.0) AS INTEGER)
+            WHERE date IS NULL AND timeStamp IS NOT NULL;
+            """
+        )
+
+
+def _has_unique_index(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """True if some unique index/constraint of `table` includes `column`."""
+    for _seq, name, unique, *_ in conn.execute(f"PRAGMA index_list({table});").fetchall():
+        if not unique:
+            continue
+        if column in [row[2] for row in conn.execute(f"PRAGMA index_info({name});")]:
+            return True
+    return False
+
+
+def migrate_lesson_identity(conn: sqlite3.Connection) -> bool:
+    """
+    One-time migration of a DB created before lessons had an identity:
+    hash all lessons, link keystats rows to their lesson via timeStamp,
+    drop duplicate rows and add the unique indexes. Keystats rows whose
+    timeStamp has no lesson, or several different ones, cannot be told
+    apart by lesson; they get unlinked_hash() identities instead and are
+    never dropped as duplicates.
+
+    If duplicates were removed, the DERIVED_TABLES and daily_metrics are
+    cleared and True is returned; ensure_schema() then refills the
+    DERIVED_TABLES from the cleaned raw tables before the next import
+    writes to them, the next build_metrics run recomputes daily_metrics.
+    """
+    if _has_unique_index(conn, "lessons_raw", "lesson_hash"):
+        return False
+
+    print("Migrating raw tables to unique lesson identities ...")
+    conn.create_function("py_lesson_hash", 7, lesson_hash, deterministic=True)
+
+    conn.execute(
+        """
+        UPDATE lessons_raw
+        SET lesson_hash = py_lesson_hash(
+            timeStamp, layout, textType, length, time_ms, errors, speed
+        )
+        WHERE lesson_hash IS NULL;
+        """
+    )
+    conn.execute(
+        """
+        UPDATE keystats_raw
+        SET lesson_hash = (
+            SELECT CASE WHEN COUNT(DISTINCT l.lesson_hash) = 1 THEN MIN(l.lesson_hash) END
+            FROM lessons_raw l
+            WHERE l.timeStamp = keystats_raw.timeStamp
+        )
+        WHERE lesson_hash IS NULL;
+        """
+    )
+    # Same identities as initial_import.hash_unlinked (rows in id order)
+    seen = {}
+    unlinked = []
+    for row_id, ts, code_point in conn.execute(
+        "SELECT id, timeStamp, codePoint FROM keystats_raw WHERE lesson_hash IS NULL ORDER BY id;"
+    ).fetchall():
+        n = seen.get((ts, code_point), 0)
+        seen[(ts, code_point)] = n + 1
+        unlinked.append((unlinked_hash(ts, n), row_id))
+    conn.executemany("UPDATE keystats_raw SET lesson_hash = ? WHERE id = ?;", unlinked)
+
+    removed_lessons = conn.execute(
+        """
+        DELETE FROM lessons_raw
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM lessons_raw GROUP BY timeStamp, lesson_hash
+        );
+        """
+    ).rowcount
+    removed_keystats = conn.execute(
+        """
+        DELETE FROM keystats_raw
+        WHERE lesson_hash IS NOT NULL
+          AND id NOT IN (
+            SELECT MIN(id) FROM keystats_raw
+            WHERE lesson_hash IS NOT NULL
+            GROUP BY lesson_hash, codePoint
+          );
+        """
+    ).rowcount
+
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_lessons_identity "
+        "ON lessons_raw(timeStamp, lesson_hash);"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_keystats_identity "
+        "ON keystats_raw(lesson_hash, codePoint);"
+    )
+
+    if removed_lessons or removed_keystats:
+        print(
+            f"Removed {removed_lessons} duplicate lesson rows and "
+            f"{removed_keystats} duplicate keystats rows."
+        )
+        conn.execute("DELETE FROM key_stats_acc;")
+        conn.execute("DELETE FROM key_latency_sketch;")
+        conn.execute("DELETE FROM key_latency_sketch_acc;")
+        conn.execute("DELETE FROM lesson_metrics;")
+        conn.execute("DELETE FROM lesson_cube;")
+        conn.execute("DELETE FROM key_cube;")
+        conn.execute("DELETE FROM daily_metrics;")
+        return True
+    return False
+
+
+def migrate_zero_bucket(conn: sqlite3.Connection) -> None:
+    """
+    Move the zero-latency sketch bucket from LEGACY_ZERO_BUCKET (-1, also
+    the index of latencies just below 1 ms) to ZERO_BUCKET. Sketches of
+    such DBs only ever held zero latencies in bucket -1, as latencies are
+    whole milliseconds.
+    """
+    for table in ("key_latency_sketch", "key_latency_sketch_acc"):
+        conn.execute(
+            f"UPDATE {table} SET bucket = ? WHERE bucket = ?;",
+            (ZERO_BUCKET, LEGACY_ZERO_BUCKET),
+        )
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """
+    Bring an existing (or empty) DB up to the current schema.sql:
+    add missing columns to old tables, create missing tables/indexes,
+    backfill derived columns and fill newly created (or, after the
+    identity migration, cleared) DERIVED_TABLES.
+    """
+    for table, columns in ADDED_COLUMNS.items():
+        existing = table_columns(conn, table)
+        if not existing:
+            continue
+        for name, col_type in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type};")
+
+    created = [table for table in DERIVED_TABLES if not table_columns(conn, table)]
+
+    conn.executescript(SCHEMA_PATH.read_text())
+    backfill_time_columns(conn)
+    if migrate_lesson_identity(conn):
+        created = list(DERIVED_TABLES)
+
+    version = conn.execute("PRAGMA user_version;").fetchone()[0]
+    if version < 1:
+        migrate_zero_bucket(conn)
+    if version < SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+    conn.commit()
+
+    for table in created:
+        DERIVED_TABLES[table](conn)
@@ -8,11 +8,19 @@ CREATE TABLE IF NOT EXISTS lessons_raw (
     length INTEGER,
     time_ms INTEGER,
     errors INTEGER,
-    speed REAL
+    speed REAL,
+    date TEXT,          -- substr(timeStamp, 1, 10), UTC day
+    epoch_ms INTEGER,   -- timeStamp as milliseconds since 1970-01-01 UTC
+    lesson_hash TEXT,   -- content hash, see lesson_identity.py
+    UNIQUE (timeStamp, lesson_hash)
 );
 
 CREATE INDEX IF NOT EXISTS idx_lessons_timestamp ON lessons_raw(timeStamp);
 
+-- Covering index for the daily lesson aggregates (GROUP BY date)
+CREATE INDEX IF NOT EXISTS idx_lessons_date
+    ON lessons_raw(date, epoch_ms, length, errors, speed);
+
 
 -- RAW: keystats
 
@@ -23,17 +31,130 @@ CREATE TABLE IF NOT EXISTS keystats_raw (
     key TEXT,
     hitCount INTEGER,
     missCount INTEGER,
-    timeToType_ms INTEGER
+    timeToType_ms INTEGER,
+    date TEXT,          -- substr(timeStamp, 1, 10), UTC day
+    epoch_ms INTEGER,   -- lesson timestamp as milliseconds since 1970-01-01 UTC
+    lesson_hash TEXT,   -- identity of the lesson this row belongs to
+    UNIQUE (lesson_hash, codePoint)
 );
 
 CREATE INDEX IF NOT EXISTS idx_keystats_timestamp ON keystats_raw(timeStamp);
 CREATE INDEX IF NOT EXISTS idx_keystats_key ON keystats_raw(key);
 
+-- Covering index for per-day/per-lesson scans of keystats_raw
+-- (lesson_metrics rebuild: GROUP BY date, epoch_ms)
+CREATE INDEX IF NOT EXISTS idx_keystats_date
+    ON keystats_raw(date, epoch_ms, hitCount, missCount, timeToType_ms);
+
+
+-- ROLLUP: keystats_raw of compacted (old) days, one row per day and key
+-- (see metrics/compaction.py); '' stands for an unknown key
+
+CREATE TABLE IF NOT EXISTS keystats_daily (
+    date TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rows INTEGER,             -- keystats_raw rows rolled up
+    hits INTEGER,
+    misses INTEGER,
+    latency_sum INTEGER,
+    latency_count INTEGER,
+    min_latency INTEGER,
+    min_miss_latency INTEGER,
+    last_timestamp TEXT,      -- MAX(timeStamp)
+    last_epoch_ms INTEGER,    -- MAX(epoch_ms)
+    PRIMARY KEY (date, key)
+) WITHOUT ROWID;
+
+
+-- RUNNING: per-lesson summary of keystats_raw, updated at ingest time
+-- (see metrics/lessons.py); the daily keystroke, latency and TTFE
+-- aggregates read one row per lesson from here
+
+CREATE TABLE IF NOT EXISTS lesson_metrics (
+    date TEXT,
+    epoch_ms INTEGER,   -- identifies the lesson (with date)
+    keystrokes INTEGER, -- SUM(hitCount + missCount)
+    misses INTEGER,     -- SUM(missCount)
+    latency_sum INTEGER,
+    latency_count INTEGER,
+    ttfe INTEGER,       -- MIN(timeToType_ms) over keys with missCount > 0
+    key_count INTEGER,  -- keystats rows of the lesson
+    PRIMARY KEY (date, epoch_ms)
+);
+
+
+-- RUNNING: per-key sufficient statistics, updated at ingest time
+-- (see update_keybr.update_key_accumulators)
+
+CREATE TABLE IF NOT EXISTS key_stats_acc (
+    key TEXT PRIMARY KEY,
+    hit_sum INTEGER,
+    miss_sum INTEGER,
+    latency_sum INTEGER,
+    latency_count INTEGER,
+    min_miss_latency INTEGER,
+    max_timestamp TEXT
+);
+
+
+-- RUNNING: per-key latency sketches per day (log-spaced buckets with
+-- counts, see metrics/sketch.py), updated at ingest time; any date range
+-- merges by adding up the counts per bucket
+
+CREATE TABLE IF NOT EXISTS key_latency_sketch (
+    key TEXT NOT NULL,
+    date TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, bucket, date)   -- GROUP BY key, bucket without sorting
+) WITHOUT ROWID;
+
+-- The same sketches merged over all days (what key_metrics.csv reports)
+
+CREATE TABLE IF NOT EXISTS key_latency_sketch_acc (
+    key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (key, bucket)
+) WITHOUT ROWID;
+
+
+-- RUNNING: cube over (date, layout, textType, key), updated at ingest time
+-- (see metrics/cube.py); '' stands for an unknown value
+
+CREATE TABLE IF NOT EXISTS lesson_cube (
+    date TEXT NOT NULL,
+    layout TEXT NOT NULL,
+    textType TEXT NOT NULL,
+    lessons INTEGER,
+    chars INTEGER,      -- SUM(length)
+    errors INTEGER,
+    speed_sum REAL,
+    speed_count INTEGER,
+    PRIMARY KEY (date, layout, textType)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS key_cube (
+    date TEXT NOT NULL,
+    layout TEXT NOT NULL,
+    textType TEXT NOT NULL,
+    key TEXT NOT NULL,
+    hits INTEGER,
+    misses INTEGER,
+    latency_sum INTEGER,
+    latency_count INTEGER,
+    min_miss_latency INTEGER,
+    last_timestamp TEXT,
+    PRIMARY KEY (date, layout, textType, key)
+) WITHOUT ROWID;
 
 -- AGGREGATED: per day
 
 CREATE TABLE IF NOT EXISTS daily_metrics (
     date TEXT PRIMARY KEY,
+    num_lessons INTEGER,
+    total_chars INTEGER,
+    total_errors INTEGER,
     total_keystrokes INTEGER,
     avg_wpm REAL,
     avg_accuracy REAL,
@@ -42,7 +163,17 @@ CREATE TABLE IF NOT EXISTS daily_metrics (
     ttfe REAL,
     ttke REAL,
     rolling_7d_wpm REAL,
-    rolling_30d_wpm REAL
+    rolling_30d_wpm REAL,
+    rolling_7d_error_rate REAL,
+    rolling_30d_error_rate REAL,
+    rolling_7d_latency REAL
+);
+
+
+-- INCREMENTAL: dates touched by imports since the last metric build
+
+CREATE TABLE IF NOT EXISTS pending_dates (
+    date TEXT PRIMARY KEY
 );
 
 
@@ -56,3 +187,21 @@ CREATE TABLE IF NOT EXISTS key_metrics (
     avg_latency REAL,
     last_timestamp TEXT
 );
+
+
+-- INCREMENTAL: rolling-window state, per day the running sums and counts
+-- of the daily values since the first day (see metrics/rolling.py);
+-- *_sum_err holds the rounding error of the running sum (compensation)
+
+CREATE TABLE IF NOT EXISTS rolling_state (
+    date TEXT PRIMARY KEY,
+    wpm_sum REAL,
+    wpm_sum_err REAL,
+    wpm_count INTEGER,
+    error_rate_sum REAL,
+    error_rate_sum_err REAL,
+    error_rate_count INTEGER,
+    latency_sum REAL,
+    latency_sum_err REAL,
+    latency_count INTEGER
+);
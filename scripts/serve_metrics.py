@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Local HTTP server for the metrics in db/keybr.db, for dashboards that poll.
+
+Endpoints (JSON by default, CSV with format=csv):
+    /daily       daily metrics        ?from=YYYY-MM-DD&to=YYYY-MM-DD
+    /keys        key metrics          ?key=a&key=b  (or key=a,b)
+    /weak-keys   weakest keys         ?limit=20&min_attempts=200
+    /health      data version and cache state
+
+The metrics are held in memory. Before answering, the server asks SQLite
+for PRAGMA data_version, which changes whenever another connection (the
+pipeline) has committed to the DB; only then the tables are read again.
+Rendered responses are cached per query until the data changes, and every
+response carries an ETag (hash of its body): a client sending it back in
+If-None-Match gets an empty 304 as long as nothing changed.
+
+The DB is opened read-only: the server never migrates the schema or
+rebuilds derived tables, that is left to the pipeline. Until it has run
+on a DB (old schema, empty running tables) requests are answered with
+503; unknown endpoints and keys with 404.
+
+Only stdlib plus pandas; binds to localhost by default.
+
+Examples:
+    python3 scripts/serve_metrics.py                       # http://127.0.0.1:8765
+    curl 'http://127.0.0.1:8765/daily?from=2025-01-01'
+    curl 'http://127.0.0.1:8765/keys?key=e,t&format=csv'
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from pandas.errors import DatabaseError
+
+from build_metrics import read_daily_metrics
+from metrics import compute_key_metrics, get_weak_keys
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Rendered responses kept per data version (distinct queries)
+MAX_CACHED_RESPONSES = 256
+
+
+class BadRequest(ValueError):
+    """Invalid query parameters (answered with 400)."""
+
+
+class NotFound(LookupError):
+    """Unknown endpoint or key (answered with 404)."""
+
+
+class Unavailable(RuntimeError):
+    """The metrics cannot be read from the DB as it is (answered with 503)."""
+
+
+class MetricsCache:
+    """
+    In-memory copy of the metrics, reloaded when the DB's data version
+    changes. One read-only SQLite connection, shared by all request threads.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(
+            self.db_path.resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False
+        )
+        self.lock = threading.Lock()
+        self.version = None
+        self.loads = 0
+        self.daily = None
+        self.keys = None
+        self.responses = {}
+
+    def refresh(self) -> None:
+        """
+        Reload the metrics if another connection has committed since the last
+        load. Raises Unavailable if the DB cannot be read (old schema, a
+        rebuild the read-only connection cannot do); the next call tries again.
+        """
+        with self.lock:
+            try:
+                version = self.conn.execute("PRAGMA data_version;").fetchone()[0]
+                if version == self.version:
+                    return
+                daily = read_daily_metrics(self.conn)
+                keys = compute_key_metrics(self.conn)
+            except (sqlite3.Error, DatabaseError) as exc:
+                raise Unavailable(str(exc)) from exc
+            self.daily = daily
+            self.keys = keys
+            self.responses = {}
+            self.version = version
+            self.loads += 1
+
+    def response(self, path: str, params: dict) -> tuple:
+        """(body, content type, etag) for a request, rendered once per data version."""
+        self.refresh()
+        cache_key = (path, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        with self.lock:
+            cached = self.responses.get(cache_key)
+            daily, keys, version = self.daily, self.keys, self.version
+        if cached is not None:
+            return cached
+
+        body, content_type = render(path, params, daily, keys, self)
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with self.lock:
+            # A refresh() while rendering: the body belongs to the old data,
+            # answer with it but keep it out of the new version's cache
+            if self.version == version:
+                if len(self.responses) >= MAX_CACHED_RESPONSES:
+                    self.responses.clear()
+                self.responses[cache_key] = (body, content_type, etag)
+        return body, content_type, etag
+
+
+def _single(params: dict, name: str, default=None):
+    values = params.get(name)
+    return values[-1] if values else default
+
+
+def _int_param(params: dict, name: str, default: int) -> int:
+    value = _single(params, name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer") from None
+    if number < 0:
+        raise BadRequest(f"{name} must not be negative")
+    return number
+
+
+def _encode(df, params: dict) -> tuple:
+    fmt = _single(params, "format", "json")
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8"), "text/csv; charset=utf-8"
+    if fmt == "json":
+        return df.to_json(orient="records").encode("utf-8"), "application/json"
+    raise BadRequest("format must be json or csv")
+
+
+def render(path: str, params: dict, daily, keys, cache: MetricsCache) -> tuple:
+    """Body and content type for one endpoint; raises NotFound for unknown paths and keys."""
+    if path == "/daily":
+        df = daily
+        since = _single(params, "from")
+        until = _single(params, "to")
+        if since is not None:
+            df = df[df["date"] >= since]
+        if until is not None:
+            df = df[df["date"] <= until]
+        return _encode(df, params)
+
+    if path == "/keys":
+        wanted = [k for value in params.get("key", []) for k in value.split(",") if k]
+        unknown = sorted(set(wanted) - set(keys["key"]))
+        if unknown:
+            raise NotFound(f"Unknown key(s): {', '.join(unknown)}")
+        df = keys[keys["key"].isin(wanted)] if wanted else keys
+        return _encode(df, params)
+
+    if path == "/weak-keys":
+        df = get_weak_keys(
+            keys,
+            min_attempts=_int_param(params, "min_attempts", 200),
+            top_n=_int_param(params, "limit", 20),
+        )
+        return _encode(df, params)
+
+    if path == "/health":
+        body = {
+            "db": str(cache.db_path),
+            "data_version": cache.version,
+            "loads": cache.loads,
+            "days": len(daily),
+            "keys": len(keys),
+        }
+        return json.dumps(body).encode("utf-8"), "application/json"
+
+    raise NotFound(f"Unknown endpoint: {path}")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    cache: MetricsCache = None
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        try:
+            body, content_type, etag = self.cache.response(url.path.rstrip("/") or "/", params)
+        except NotFound as exc:
+            self.send_error(HTTPStatus.NOT_FOUND, str(exc))
+            return
+        except BadRequest as exc:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(exc))
+            return
+        except Unavailable as exc:
+            # e.g. a DB the pipeline has not migrated/built yet
+            self.log_error("Metrics not available: %s", exc)
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Metrics not available, run the pipeline")
+            return
+        except Exception:
+            self.log_error("%s", traceback.format_exc().rstrip())
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR)
+            return
+
+        if _etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        # Clients may keep the response but have to revalidate it (cheap 304)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def make_server(db_path: Path = DB_PATH, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """HTTP server with its own cache; call serve_forever() on it."""
+    handler = type("Handler", (MetricsHandler,), {"cache": MetricsCache(db_path)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the KeyBR metrics over local HTTP.")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help=f"SQLite DB (default: {DB_PATH}).")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Bind address (default: {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT}).")
+    args = parser.parse_args()
+
+    if not args.db.exists():
+        raise SystemExit(f"DB not found: {args.db}")
+
+    server = make_server(args.db, args.host, args.port)
+    print(f"Serving metrics from {args.db} on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,23 @@
+import argparse
 import json
 import sqlite3
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-import pandas as pd
+from bulk_writer import (
+    BulkWriter,
+    add_pragma_arguments,
+    apply_pragmas,
+    deferred_indexes,
+    pragmas_from_args,
+)
+from columnar_store import ColumnarStore, mirror_dir_for, open_store
+from lesson_identity import lesson_hash
+from metrics.cube import update_cube
+from metrics.lessons import update_lesson_metrics
+from metrics.sketch import update_latency_sketches
+from metrics.codepoints import code_point_key
+from schema import ensure_schema
 
 # Base directory of the repo: .../keybr_analytics
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -11,6 +26,47 @@ ROOT_DIR = Path(__file__).resolve().parents[1]
 DB_PATH = ROOT_DIR / "db" / "keybr.db"
 JSON_PATH = ROOT_DIR / "raw" / "typing-data.json"
 
+# Streaming ingest: lessons per DB write and characters per file read
+STREAM_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 1 << 16
+
+# Largest single lesson the streaming reader buffers (characters); a real
+# lesson is a few KB, anything near this is a broken export
+MAX_LESSON_SIZE = 16 << 20
+
+# Longest non-string token that can be cut off at the end of the read
+# buffer (-Infinity, \uXXXX escapes, ...); a decode error further in
+# means the input itself is malformed
+_MAX_PARTIAL_TOKEN = 16
+
+LESSON_COLUMNS = (
+    "timeStamp",
+    "layout",
+    "textType",
+    "length",
+    "time_ms",
+    "errors",
+    "speed",
+    "date",
+    "epoch_ms",
+    "lesson_hash",
+)
+
+KEYSTATS_COLUMNS = (
+    "timeStamp",
+    "codePoint",
+    "key",
+    "hitCount",
+    "missCount",
+    "timeToType_ms",
+    "date",
+    "epoch_ms",
+    "lesson_hash",
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MS = timedelta(milliseconds=1)
+
 
 def get_last_timestamp(conn: sqlite3.Connection):
     """Read the last lesson timestamp from the DB (for incremental import)."""
@@ -20,12 +76,12 @@ def get_last_timestamp(conn: sqlite3.Connection):
     return row[0] if row and row[0] is not None else None
 
 
-def load_json():
+def load_json(path: Path = JSON_PATH):
     """Load the full KeyBR JSON export file."""
-    if not JSON_PATH.exists():
-        raise FileNotFoundError(f"JSON file not found: {JSON_PATH}")
+    if not path.exists():
+        raise FileNotFoundError(f"JSON file not found: {path}")
 
-    with JSON_PATH.open("r", encoding="utf-8") as f:
+    with path.open("r", encoding="utf-8") as f:
         data = json.load(f)
 
     if not isinstance(data, list):
@@ -34,97 +90,524 @@ def load_json():
     return data
 
 
+def _may_be_truncated(err: json.JSONDecodeError, buf: str) -> bool:
+    """True if a decode error could be the end of the buffer cutting a value short."""
+    # Strings report their start; everything else the position it failed at
+    return err.msg.startswith("Unterminated string") or len(buf) - err.pos <= _MAX_PARTIAL_TOKEN
+
+
+def iter_json_lessons(
+    path: Path = JSON_PATH,
+    chunk_size: int = READ_CHUNK_SIZE,
+    max_lesson_size: int = MAX_LESSON_SIZE,
+):
+    """
+    Yield the lessons of a KeyBR export one by one.
+
+    The top-level array is decoded element by element from a sliding read
+    buffer, so only the current chunk and the current lesson are in memory,
+    no matter how large the export is. Malformed JSON raises right where
+    it is found; a lesson larger than `max_lesson_size` characters raises
+    ValueError instead of being buffered.
+    """
+    if not path.exists():
+        raise FileNotFoundError(f"JSON file not found: {path}")
+
+    decoder = json.JSONDecoder()
+
+    with path.open("r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill() -> bool:
+            """Append the next chunk to the buffer; False at end of file."""
+            nonlocal buf, pos, eof
+            if eof:
+                return False
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buf = buf[pos:] + chunk
+            pos = 0
+            return True
+
+        def next_char() -> str:
+            """Skip whitespace and return the next significant character."""
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if not fill():
+                    return ""
+
+        if next_char() != "[":
+            raise ValueError("Expected top-level JSON array (list of lessons).")
+        pos += 1
+
+        if next_char() == "]":
+            return
+
+        while True:
+            if next_char() == "":
+                raise ValueError("Unexpected end of JSON file.")
+
+            while True:
+                try:
+                    lesson, end = decoder.raw_decode(buf, pos)
+                    break
+                except json.JSONDecodeError as err:
+                    # Lesson spans the end of the buffer -> read more and retry
+                    if not _may_be_truncated(err, buf) or not fill():
+                        raise
+                    if len(buf) > max_lesson_size:
+                        raise ValueError(
+                            f"Lesson larger than {max_lesson_size} characters in JSON export."
+                        ) from None
+            pos = end
+
+            if not isinstance(lesson, dict):
+                raise ValueError("Expected lesson objects inside the JSON array.")
+            yield lesson
+
+            sep = next_char()
+            if sep == ",":
+                pos += 1
+            elif sep == "]":
+                return
+            else:
+                raise ValueError(f"Unexpected character in JSON array: {sep!r}")
+
+
+def is_new_lesson(lesson, last_ts) -> bool:
+    """True if the lesson comes *after* the last timestamp in the DB."""
+    if last_ts is None:
+        return True
+
+    # ISO-8601 timestamp strings can be compared lexicographically
+    ts = lesson.get("timeStamp")
+    return ts is not None and ts > last_ts
+
+
 def filter_new_lessons(all_lessons, last_ts):
     """Filter only lessons that come *after* the last timestamp in the DB."""
     if last_ts is None:
         # First full load from JSON
         return all_lessons
 
-    # ISO-8601 timestamp strings can be compared lexicographically
-    return [l for l in all_lessons if l.get("timeStamp") > last_ts]
+    return [l for l in all_lessons if is_new_lesson(l, last_ts)]
 
 
-def lessons_to_dataframe(lessons):
-    """Convert lesson objects into a DataFrame matching lessons_raw."""
-    rows = []
-    for l in lessons:
-        rows.append(
-            {
-                "timeStamp": l.get("timeStamp"),
-                "layout": l.get("layout"),
-                "textType": l.get("textType"),
-                "length": l.get("length"),
-                "time_ms": l.get("time"),
-                "errors": l.get("errors"),
-                "speed": l.get("speed"),
-            }
+def timestamp_keys(ts) -> tuple:
+    """
+    (date, epoch_ms) for an ISO-8601 lesson timestamp: the UTC day as
+    'YYYY-MM-DD' (same as substr(timeStamp, 1, 10)) and milliseconds since
+    the Unix epoch. Naive timestamps are taken as UTC.
+    """
+    if not ts:
+        return None, None
+
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return ts[:10], None
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return ts[:10], (dt - _EPOCH) // _ONE_MS
+
+
+def lesson_to_row(lesson) -> tuple:
+    """Map one lesson object to a lessons_raw row (LESSON_COLUMNS order)."""
+    ts = lesson.get("timeStamp")
+    fields = (
+        ts,
+        lesson.get("layout"),
+        lesson.get("textType"),
+        lesson.get("length"),
+        lesson.get("time"),
+        lesson.get("errors"),
+        lesson.get("speed"),
+    )
+    return (*fields, *timestamp_keys(ts), lesson_hash(*fields))
+
+
+def histogram_to_rows(lesson, lesson_id: str = None):
+    """
+    Yield keystats_raw rows (KEYSTATS_COLUMNS order) for one lesson.
+    `lesson_id` is the lesson's hash (computed if not given).
+    """
+    ts = lesson.get("timeStamp")
+    date, epoch_ms = timestamp_keys(ts)
+    if lesson_id is None:
+        lesson_id = lesson_to_row(lesson)[-1]
+    histogram = lesson.get("histogram") or []
+    for h in histogram:
+        code_point = h.get("codePoint")
+        yield (
+            ts,
+            code_point,
+            code_point_key(code_point),
+            h.get("hitCount"),
+            h.get("missCount"),
+            h.get("timeToType"),
+            date,
+            epoch_ms,
+            lesson_id,
         )
-    return pd.DataFrame(rows)
 
 
-def histogram_to_keystats_dataframe(lessons):
-    """Flatten histogram entries into rows for keystats_raw."""
-    rows = []
-    for l in lessons:
-        ts = l.get("timeStamp")
-        histogram = l.get("histogram") or []
-        for h in histogram:
-            code_point = h.get("codePoint")
-            try:
-                key_char = chr(code_point) if code_point is not None else None
-            except (TypeError, ValueError):
-                key_char = None
-
-            rows.append(
-                {
-                    "timeStamp": ts,
-                    "codePoint": code_point,
-                    "key": key_char,
-                    "hitCount": h.get("hitCount"),
-                    "missCount": h.get("missCount"),
-                    "timeToType_ms": h.get("timeToType"),
-                }
+def mark_pending_dates(conn: sqlite3.Connection, dates) -> None:
+    """Remember the days touched by this import for the incremental metric build."""
+    dates = sorted({d for d in dates if d})
+    conn.executemany(
+        "INSERT OR IGNORE INTO pending_dates (date) VALUES (?);",
+        [(d,) for d in dates],
+    )
+
+
+# Merge a batch aggregate into the running per-key statistics.
+# Scalar MIN/MAX return NULL if one side is NULL, COALESCE picks the other.
+KEY_ACC_UPSERT_SQL = """
+    INSERT INTO key_stats_acc (
+        key, hit_sum, miss_sum, latency_sum, latency_count,
+        min_miss_latency, max_timestamp
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        hit_sum = hit_sum + excluded.hit_sum,
+        miss_sum = miss_sum + excluded.miss_sum,
+        latency_sum = latency_sum + excluded.latency_sum,
+        latency_count = latency_count + excluded.latency_count,
+        min_miss_latency = COALESCE(
+            MIN(min_miss_latency, excluded.min_miss_latency),
+            min_miss_latency,
+            excluded.min_miss_latency
+        ),
+        max_timestamp = COALESCE(
+            MAX(max_timestamp, excluded.max_timestamp),
+            max_timestamp,
+            excluded.max_timestamp
+        );
+"""
+
+
+def update_key_accumulators(conn: sqlite3.Connection, keystats_rows) -> None:
+    """
+    Fold keystats rows (KEYSTATS_COLUMNS order) into key_stats_acc.
+    Aggregates the batch in Python first, so there is one upsert per key.
+    """
+    acc = {}
+    for row in keystats_rows:
+        ts, _code_point, key, hits, misses, latency = row[:6]
+        if not key:
+            continue
+
+        a = acc.get(key)
+        if a is None:
+            a = acc[key] = [key, 0, 0, 0, 0, None, None]
+
+        a[1] += hits or 0
+        a[2] += misses or 0
+        if latency is not None:
+            a[3] += latency
+            a[4] += 1
+            if misses and (a[5] is None or latency < a[5]):
+                a[5] = latency
+        if ts is not None and (a[6] is None or ts > a[6]):
+            a[6] = ts
+
+    conn.executemany(KEY_ACC_UPSERT_SQL, acc.values())
+
+
+def existing_lesson_hashes(conn: sqlite3.Connection, timestamps) -> set:
+    """Hashes of lessons already in lessons_raw for the given timestamps."""
+    timestamps = [ts for ts in set(timestamps) if ts is not None]
+    found = set()
+    # Stay well below SQLite's host-parameter limit
+    for i in range(0, len(timestamps), 500):
+        chunk = timestamps[i:i + 500]
+        found.update(
+            row[0]
+            for row in conn.execute(
+                f"SELECT lesson_hash FROM lessons_raw "
+                f"WHERE timeStamp IN ({', '.join('?' * len(chunk))});",
+                chunk,
             )
-    return pd.DataFrame(rows)
-
-
-def import_new_data():
-    print(f"Connecting to DB: {DB_PATH}")
-    print(f"Reading JSON from: {JSON_PATH}")
-
-    conn = sqlite3.connect(DB_PATH)
+        )
+    return found
+
+
+def write_lessons_batch(
+    conn: sqlite3.Connection,
+    lessons,
+    writer: BulkWriter = None,
+    store: ColumnarStore = None,
+    touched_dates: set = None,
+) -> tuple:
+    """
+    Insert one batch of lessons and their histograms into lessons_raw and
+    keystats_raw, and update pending_dates, key_stats_acc,
+    key_latency_sketch, lesson_metrics and the cube in the same transaction. Does not commit; returns (lesson_rows, keystats_rows).
+    With a `store`, the new rows are also appended to the columnar mirror
+    (published by the caller after the commit); the dates of the new
+    lessons are added to `touched_dates` if given.
+
+    Lessons already in the DB (same timeStamp + content hash) or repeated
+    within the batch are skipped, so only rows that are really new reach
+    the raw tables and the derived statistics. The inserts are
+    INSERT OR IGNORE on top, backed by the unique constraints.
+    """
+    writer = writer or BulkWriter(conn)
+
+    seen = existing_lesson_hashes(conn, (l.get("timeStamp") for l in lessons))
+    lesson_rows = []
+    keystats_rows = []
+    for l in lessons:
+        row = lesson_to_row(l)
+        if row[-1] in seen:
+            continue
+        seen.add(row[-1])
+        lesson_rows.append(row)
+        keystats_rows.extend(histogram_to_rows(l, row[-1]))
+
+    writer.insert("lessons_raw", LESSON_COLUMNS, lesson_rows, verb="INSERT OR IGNORE")
+    writer.insert("keystats_raw", KEYSTATS_COLUMNS, keystats_rows, verb="INSERT OR IGNORE")
+    dates = {row[LESSON_COLUMNS.index("date")] for row in lesson_rows}
+    mark_pending_dates(conn, dates)
+    if touched_dates is not None:
+        touched_dates.update(dates)
+    update_key_accumulators(conn, keystats_rows)
+    update_latency_sketches(conn, keystats_rows)
+    update_lesson_metrics(conn, keystats_rows)
+    update_cube(conn, lesson_rows, keystats_rows)
+    if store is not None:
+        store.append("lessons_raw", LESSON_COLUMNS, lesson_rows)
+        store.append("keystats_raw", KEYSTATS_COLUMNS, keystats_rows)
+    return len(lesson_rows), len(keystats_rows)
+
+
+def import_new_data(
+    pragmas: dict = None,
+    refeed: bool = False,
+    db_path: Path = DB_PATH,
+    json_path: Path = JSON_PATH,
+    columnar: bool = False,
+    columnar_dir: Path = None,
+):
+    """
+    Import lessons newer than the last one in the DB. With `refeed`, every
+    lesson of the export is checked against the DB instead (safe to re-run
+    on overlapping or already imported exports). With `columnar`, the
+    columnar mirror (default: next to the DB) is created if needed; an
+    existing mirror is always kept up to date.
+    """
+    print(f"Connecting to DB: {db_path}")
+    print(f"Reading JSON from: {json_path}")
+
+    conn = sqlite3.connect(db_path)
+    store = open_store(columnar, columnar_dir or mirror_dir_for(db_path))
 
     try:
+        apply_pragmas(conn, **(pragmas or {}))
+        ensure_schema(conn)
         last_ts = get_last_timestamp(conn)
         print("Last lesson timestamp in DB:", last_ts)
 
-        all_lessons = load_json()
+        all_lessons = load_json(json_path)
         print(f"Total lessons in JSON: {len(all_lessons)}")
 
-        new_lessons = filter_new_lessons(all_lessons, last_ts)
-        print(f"New lessons to import: {len(new_lessons)}")
+        new_lessons = filter_new_lessons(all_lessons, None if refeed else last_ts)
+        print(f"Candidate lessons to import: {len(new_lessons)}")
 
         if not new_lessons:
             print("No new lessons found. Nothing to do.")
+            if store is not None:
+                store.publish(conn)
             return
 
-        # DataFrames for lessons_raw and keystats_raw
-        lessons_df = lessons_to_dataframe(new_lessons)
-        keystats_df = histogram_to_keystats_dataframe(new_lessons)
+        # Write into DB (raw tables plus everything maintained alongside them)
+        writer = BulkWriter(conn)
+        lesson_rows, keystats_rows = write_lessons_batch(conn, new_lessons, writer, store)
 
-        print(f"New lesson rows: {len(lessons_df)}")
-        print(f"New keystats rows: {len(keystats_df)}")
+        if not lesson_rows:
+            print("All lessons already imported. Nothing to do.")
+            if store is not None:
+                store.publish(conn)
+            return
 
-        # Write into DB
-        lessons_df.to_sql("lessons_raw", conn, if_exists="append", index=False)
-        keystats_df.to_sql("keystats_raw", conn, if_exists="append", index=False)
+        print(f"New lesson rows: {lesson_rows}")
+        print(f"New keystats rows: {keystats_rows}")
 
         conn.commit()
+        writer.report()
+        if store is not None:
+            store.publish(conn)
         print("Update finished successfully.")
 
     finally:
+        if store is not None:
+            store.discard()
         conn.close()
 
 
+def ingest_stream(
+    conn: sqlite3.Connection,
+    json_path: Path = JSON_PATH,
+    batch_size: int = STREAM_BATCH_SIZE,
+    defer_indexes: bool = None,
+    refeed: bool = False,
+    store: ColumnarStore = None,
+) -> set:
+    """
+    Ingest stage on an open, schema-checked connection (streaming import).
+
+    Walks the JSON array lesson by lesson, drops already-imported lessons
+    right away and writes the new ones in batches of `batch_size`, so peak
+    memory is bounded by the batch size instead of the export size.
+    Everything is committed in one transaction at the end, then the
+    columnar mirror (`store`) is published.
+
+    `defer_indexes` drops and rebuilds the raw-table indexes around the load;
+    by default this happens for a full load into an empty DB. `refeed` checks
+    every lesson against the DB instead of skipping by timestamp.
+
+    Returns the dates of the newly imported lessons (empty: nothing new).
+    """
+    last_ts = get_last_timestamp(conn)
+    print("Last lesson timestamp in DB:", last_ts)
+
+    if defer_indexes is None:
+        defer_indexes = last_ts is None
+    if refeed:
+        last_ts = None
+
+    writer = BulkWriter(conn)
+    touched_dates = set()
+    total_lessons = 0
+    lesson_rows = 0
+    keystats_rows = 0
+    batch = []
+
+    with deferred_indexes(conn, ["lessons_raw", "keystats_raw"] if defer_indexes else []):
+        for lesson in iter_json_lessons(json_path):
+            total_lessons += 1
+            if not is_new_lesson(lesson, last_ts):
+                continue
+
+            batch.append(lesson)
+            if len(batch) >= batch_size:
+                n_lessons, n_keystats = write_lessons_batch(conn, batch, writer, store, touched_dates)
+                lesson_rows += n_lessons
+                keystats_rows += n_keystats
+                batch = []
+
+        if batch:
+            n_lessons, n_keystats = write_lessons_batch(conn, batch, writer, store, touched_dates)
+            lesson_rows += n_lessons
+            keystats_rows += n_keystats
+
+    print(f"Total lessons in JSON: {total_lessons}")
+
+    if not lesson_rows:
+        # Nothing written; ends the transaction opened for deferred indexes
+        conn.commit()
+        print("No new lessons found. Nothing to do.")
+        if store is not None:
+            store.publish(conn)
+        return touched_dates
+
+    print(f"New lesson rows: {lesson_rows}")
+    print(f"New keystats rows: {keystats_rows}")
+
+    conn.commit()
+    writer.report()
+    if store is not None:
+        store.publish(conn)
+    print("Update finished successfully.")
+    return touched_dates
+
+
+def import_new_data_streaming(
+    batch_size: int = STREAM_BATCH_SIZE,
+    pragmas: dict = None,
+    defer_indexes: bool = None,
+    refeed: bool = False,
+    db_path: Path = DB_PATH,
+    json_path: Path = JSON_PATH,
+    columnar: bool = False,
+    columnar_dir: Path = None,
+) -> set:
+    """Streaming variant of import_new_data(); see ingest_stream()."""
+    print(f"Connecting to DB: {db_path}")
+    print(f"Reading JSON from: {json_path} (streaming, batch size {batch_size})")
+
+    conn = sqlite3.connect(db_path)
+    store = open_store(columnar, columnar_dir or mirror_dir_for(db_path))
+
+    try:
+        apply_pragmas(conn, **(pragmas or {}))
+        ensure_schema(conn)
+        return ingest_stream(conn, json_path, batch_size, defer_indexes, refeed, store)
+    finally:
+        if store is not None:
+            store.discard()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import new KeyBR lessons into the SQLite DB.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the JSON export lesson by lesson (bounded memory).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=STREAM_BATCH_SIZE,
+        help=f"Lessons per DB write in streaming mode (default: {STREAM_BATCH_SIZE}).",
+    )
+    parser.add_argument(
+        "--defer-indexes",
+        action="store_true",
+        default=None,
+        help="Drop and rebuild raw-table indexes around the load "
+        "(streaming mode; default: only when the DB is empty).",
+    )
+    parser.add_argument(
+        "--refeed",
+        action="store_true",
+        help="Check every lesson of the export against the DB instead of only "
+        "those after the last timestamp (for overlapping exports or recovery).",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Maintain the columnar (Arrow) mirror of the raw tables, creating it "
+        "if needed; an existing mirror is always kept up to date. Needs pyarrow.",
+    )
+    add_pragma_arguments(parser)
+    args = parser.parse_args()
+
+    if args.stream:
+        import_new_data_streaming(
+            batch_size=args.batch_size,
+            pragmas=pragmas_from_args(args),
+            defer_indexes=args.defer_indexes,
+            refeed=args.refeed,
+            columnar=args.columnar,
+        )
+    else:
+        import_new_data(
+            pragmas=pragmas_from_args(args),
+            refeed=args.refeed,
+            columnar=args.columnar,
+        )
+
+
 if __name__ == "__main__":
-    import_new_data()
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Long-running ingest mode: watch the raw/ inbox for new or updated KeyBR
+exports and ingest them as soon as they are complete.
+
+Every few seconds (--interval) the inbox is scanned for export files
+(typing-data*.json by default, the name KeyBR gives its exports; other
+JSON files in raw/ such as synthetic test data are left alone, and
+dotfiles and *.tmp/*.part are ignored). A file is
+picked up once its size and mtime have not changed for --settle seconds,
+so an export that is still being copied is not read half-written. If it
+still does not parse as a complete export, the ingest is rolled back and
+the file is retried as soon as it changes again.
+
+A cycle that fails is rolled back and logged, and the watcher keeps
+polling. If the DB is locked (e.g. by a concurrent pipeline run), the
+cycle's files are retried after the next settle period, up to
+MAX_RETRIES times; any other error leaves them alone until they change.
+
+Files that settle in the same scan are ingested one after the other in
+that cycle (SQLite has a single writer), each through update_keybr's
+streaming ingest with duplicate detection, so overlapping or backdated
+exports are fine. The metrics are then refreshed once for the whole
+cycle, incrementally, and only if some lesson was actually new.
+
+Per file the watcher records size, mtime and content hash next to the DB
+(inbox_manifest.json): a file that is touched or re-copied without new
+content is not parsed again. After a refresh the DB version and CSV
+hashes are written to the pipeline manifest as well, so a following
+run_pipeline.py run does not repeat the metric build.
+
+Examples:
+    python3 scripts/watch_inbox.py                   # watch raw/ until Ctrl+C
+    python3 scripts/watch_inbox.py --once            # ingest what is there, then exit
+    python3 scripts/watch_inbox.py --inbox ~/Downloads --pattern 'keybr-*.json'
+"""
+
+import argparse
+import signal
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+from bulk_writer import apply_pragmas
+from columnar_store import mirror_dir_for, open_store
+from pipeline_manifest import (
+    db_data_version,
+    describe_input,
+    load_manifest,
+    manifest_path_for,
+    output_digests,
+    same_content,
+    save_manifest,
+)
+from schema import ensure_schema
+from update_keybr import get_last_timestamp, ingest_stream
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DB_PATH = ROOT_DIR / "db" / "keybr.db"
+INBOX_DIR = ROOT_DIR / "raw"
+OUTPUT_DIR = ROOT_DIR / "output"
+
+PATTERN = "typing-data*.json"
+POLL_SECONDS = 2.0
+SETTLE_SECONDS = 5.0
+# Retries of a file whose cycle hit a locked DB, before waiting for it to change
+MAX_RETRIES = 3
+
+# Per-file state of the inbox, next to the DB (same format as the pipeline manifest)
+INBOX_MANIFEST_NAME = "inbox_manifest.json"
+
+# Names of files that are still being written by common tools
+_PARTIAL_SUFFIXES = (".tmp", ".part", ".crdownload", ".download")
+
+
+def log(message: str) -> None:
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def scan_inbox(inbox: Path, pattern: str = PATTERN) -> dict:
+    """(size, mtime_ns) of every export candidate in the inbox, by path."""
+    found = {}
+    for path in sorted(Path(inbox).glob(pattern)):
+        if path.name.startswith(".") or path.name.endswith(_PARTIAL_SUFFIXES):
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if path.is_file():
+            found[path] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+class InboxWatcher:
+    """
+    Debounces the inbox: settled() returns the files whose size and mtime
+    have been stable for `settle` seconds and that were not handed out with
+    this signature before.
+    """
+
+    def __init__(self, inbox: Path, pattern: str = PATTERN, settle: float = SETTLE_SECONDS):
+        self.inbox = Path(inbox)
+        self.pattern = pattern
+        self.settle = settle
+        self._pending = {}  # path -> (signature, first seen with it)
+        self._handled = {}  # path -> signature handed out last
+        self._retries = {}  # path -> (signature, retries so far)
+
+    def settled(self, now: float = None) -> list:
+        now = time.monotonic() if now is None else now
+        current = scan_inbox(self.inbox, self.pattern)
+
+        for path in list(self._pending):
+            if path not in current:
+                del self._pending[path]
+        for path in list(self._handled):
+            if path not in current:
+                del self._handled[path]
+        for path in list(self._retries):
+            if path not in current:
+                del self._retries[path]
+
+        ready = []
+        for path, signature in current.items():
+            if self._handled.get(path) == signature:
+                continue
+            seen = self._pending.get(path)
+            if seen is None or seen[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - seen[1] >= self.settle:
+                ready.append(path)
+                self._handled[path] = signature
+                del self._pending[path]
+        return ready
+
+    def retry(self, paths, limit: int = MAX_RETRIES) -> list:
+        """
+        Hands `paths` out again once they have settled anew, at most `limit`
+        times per signature; returns the files given up on (until they change).
+        """
+        given_up = []
+        for path in paths:
+            signature = self._handled.get(path)
+            seen, count = self._retries.get(path, (signature, 0))
+            if seen != signature:
+                count = 0
+            if count >= limit:
+                given_up.append(path)
+                continue
+            self._retries[path] = (signature, count + 1)
+            del self._handled[path]
+        return given_up
+
+
+def ingest_files(conn: sqlite3.Connection, db_path: Path, paths, state: dict) -> set:
+    """
+    Ingest the given exports one after the other; returns the dates of all
+    newly imported lessons. Files whose content matches their record in
+    `state` are skipped; `state` is updated for every file handled.
+    """
+    dates = set()
+    for path in paths:
+        name = str(path)
+        export = describe_input(path, state.get(name))
+        if same_content(export, state.get(name)):
+            log(f"{path.name}: content unchanged – skipped.")
+            state[name] = export
+            continue
+
+        log(f"{path.name}: ingesting ({export['size']} bytes) ...")
+        store = open_store(root=mirror_dir_for(db_path))
+        try:
+            dates |= ingest_stream(conn, path, refeed=True, store=store)
+        except (ValueError, UnicodeDecodeError) as exc:
+            # Not a complete export (yet): retried when the file changes
+            conn.rollback()
+            log(f"{path.name}: not a complete export, rolled back ({exc}).")
+            continue
+        except sqlite3.OperationalError:
+            raise  # DB locked etc.: the whole cycle is retried
+        except Exception:
+            # Any other failure stays with this file; the others are still ingested
+            conn.rollback()
+            log(f"{path.name}: ingest failed, rolled back:\n{traceback.format_exc().rstrip()}")
+            continue
+        finally:
+            if store is not None:
+                store.discard()
+        state[name] = export
+    return dates
+
+
+def refresh_metrics(conn: sqlite3.Connection, db_path: Path, output_dir: Path, dates) -> None:
+    """Incremental metric build for the new dates; records the result in the pipeline manifest."""
+    import build_metrics
+    from run_pipeline import METRIC_CSVS
+
+    build_metrics.build(
+        conn,
+        incremental=True,
+        output_dir=output_dir,
+        dates=dates,
+    )
+
+    manifest_path = manifest_path_for(db_path)
+    manifest = load_manifest(manifest_path)
+    manifest.update(
+        {
+            "last_lesson": get_last_timestamp(conn),
+            "db": db_data_version(conn),
+            "outputs": output_digests(output_dir / name for name in METRIC_CSVS),
+        }
+    )
+    save_manifest(manifest_path, manifest)
+
+
+def run_cycle(conn, db_path: Path, output_dir: Path, paths, state_path: Path) -> bool:
+    """Ingest `paths`, refresh the metrics if anything was new. True if data changed."""
+    state = load_manifest(state_path).get("files", {})
+    start = time.perf_counter()
+    dates = ingest_files(conn, db_path, paths, state)
+    save_manifest(state_path, {"files": state})
+
+    # Days imported but not built yet (e.g. an earlier refresh failed)
+    dates |= {row[0] for row in conn.execute("SELECT date FROM pending_dates;")}
+    if not dates:
+        log("No new lessons – metrics not refreshed.")
+        return False
+
+    log(f"{len(dates)} day(s) changed – refreshing metrics ...")
+    refresh_metrics(conn, db_path, output_dir, dates)
+    log(f"Cycle finished in {time.perf_counter() - start:.2f}s.")
+    return True
+
+
+def watch(
+    inbox: Path = INBOX_DIR,
+    db_path: Path = DB_PATH,
+    output_dir: Path = OUTPUT_DIR,
+    pattern: str = PATTERN,
+    interval: float = POLL_SECONDS,
+    settle: float = SETTLE_SECONDS,
+    once: bool = False,
+) -> None:
+    """Watch `inbox` until interrupted (SIGINT/SIGTERM); with `once`, one pass without debouncing."""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    inbox = Path(inbox).resolve()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        apply_pragmas(conn)
+        ensure_schema(conn)
+        state_path = Path(db_path).parent / INBOX_MANIFEST_NAME
+
+        if once:
+            paths = list(scan_inbox(inbox, pattern))
+            if paths:
+                run_cycle(conn, db_path, output_dir, paths, state_path)
+            else:
+                log(f"No exports in {inbox}.")
+            return
+
+        watcher = InboxWatcher(inbox, pattern, settle)
+        log(f"Watching {inbox} for {pattern} (settle {settle:g}s, poll {interval:g}s) ...")
+        while not stop.is_set():
+            paths = watcher.settled()
+            if paths:
+                try:
+                    run_cycle(conn, db_path, output_dir, paths, state_path)
+                except sqlite3.OperationalError as exc:
+                    # e.g. the DB is locked by a concurrent pipeline run: try again later
+                    conn.rollback()
+                    log(f"Cycle failed, will retry: {exc}")
+                    for path in watcher.retry(paths):
+                        log(f"{path.name}: giving up after {MAX_RETRIES} retries until it changes.")
+                except Exception:
+                    # Keep watching; the files are picked up again when they change
+                    conn.rollback()
+                    log(f"Cycle failed:\n{traceback.format_exc().rstrip()}")
+            stop.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+        log("Stopped.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Watch raw/ for new KeyBR exports and ingest them.")
+    parser.add_argument("--inbox", type=Path, default=INBOX_DIR, help=f"Directory to watch (default: {INBOX_DIR}).")
+    parser.add_argument("--pattern", default=PATTERN, help=f"Export file pattern (default: {PATTERN}).")
+    parser.add_argument("--db", type=Path, default=DB_PATH, help=f"SQLite DB (default: {DB_PATH}).")
+    parser.add_argument("--output", type=Path, default=OUTPUT_DIR, help=f"CSV directory (default: {OUTPUT_DIR}).")
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=POLL_SECONDS,
+        help=f"Seconds between inbox scans (default: {POLL_SECONDS:g}).",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=SETTLE_SECONDS,
+        help=f"Seconds a file must stay unchanged before it is read (default: {SETTLE_SECONDS:g}).",
+    )
+    parser.add_argument("--once", action="store_true", help="Ingest the current inbox once and exit.")
+    args = parser.parse_args()
+
+    watch(args.inbox, args.db, args.output, args.pattern, args.interval, args.settle, args.once)
+
+
+if __name__ == "__main__":
+    main()
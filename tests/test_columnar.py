@@ -0,0 +1,10 @@
+from metrics.columnar import MANIFEST_NAME, read_manifest
+
+
+def test_corrupt_manifest_counts_as_no_mirror(tmp_path, capsys):
+    assert read_manifest(tmp_path) is None
+    (tmp_path / MANIFEST_NAME).write_text('{"version": 1, "tables": {"lessons_raw"')
+    assert read_manifest(tmp_path) is None
+    assert "unreadable" in capsys.readouterr().out
+    (tmp_path / MANIFEST_NAME).write_text("[]")
+    assert read_manifest(tmp_path) is None
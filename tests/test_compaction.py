@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+from compact_keystats import compact
+from generate_synthetic_export import iter_lessons
+from metrics.chunked import compute_all_metrics_chunked
+from metrics.engine import compute_all_metrics
+from schema import DERIVED_TABLES, ensure_schema
+from test_engines import assert_same_metrics, sql_metrics
+from test_incremental import assert_same_outputs, build, write_export
+from update_keybr import ingest_stream
+
+
+@pytest.fixture
+def lessons():
+    return sorted(iter_lessons(300, 60, seed=13), key=lambda lesson: lesson["timeStamp"])
+
+
+def import_into(db_path, export, **kwargs):
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        return ingest_stream(conn, export, **kwargs)
+    finally:
+        conn.close()
+
+
+def build_into(db_path, output_dir):
+    conn = sqlite3.connect(db_path)
+    try:
+        build(conn, output_dir)
+    finally:
+        conn.close()
+
+
+def test_compaction_does_not_change_the_outputs(tmp_path, lessons):
+    db_path = tmp_path / "keybr.db"
+    import_into(db_path, write_export(tmp_path / "full.json", lessons))
+    build_into(db_path, tmp_path / "before")
+
+    assert compact(db_path, before=lessons[len(lessons) // 2]["timeStamp"][:10], vacuum=False) > 0
+    build_into(db_path, tmp_path / "after")
+    assert_same_outputs(tmp_path / "after", tmp_path / "before")
+
+    # Derived tables rebuilt from what is left raw plus the rollup
+    conn = sqlite3.connect(db_path)
+    for rebuild in DERIVED_TABLES.values():
+        rebuild(conn)
+    conn.commit()
+    expected = sql_metrics(conn)
+    assert_same_metrics(compute_all_metrics(conn), expected)
+    assert_same_metrics(compute_all_metrics_chunked(conn, memory_mb=0.1), expected)
+    conn.close()
+    build_into(db_path, tmp_path / "rebuilt")
+    assert_same_outputs(tmp_path / "rebuilt", tmp_path / "before")
+
+
+def test_lessons_imported_for_compacted_days_are_rolled_in(tmp_path, lessons):
+    import_into(tmp_path / "reference.db", write_export(tmp_path / "full.json", lessons))
+    build_into(tmp_path / "reference.db", tmp_path / "reference")
+
+    db_path = tmp_path / "keybr.db"
+    import_into(db_path, write_export(tmp_path / "part.json", [l for i, l in enumerate(lessons) if i % 4]))
+    horizon = lessons[len(lessons) // 2]["timeStamp"][:10]
+    compact(db_path, before=horizon, vacuum=False)
+    # Every fourth lesson arrives late, partly for days already compacted
+    import_into(db_path, tmp_path / "full.json", refeed=True)
+    build_into(db_path, tmp_path / "late")
+    assert_same_outputs(tmp_path / "late", tmp_path / "reference")
+
+    compact(db_path, before=horizon, vacuum=False)
+    build_into(db_path, tmp_path / "recompacted")
+    assert_same_outputs(tmp_path / "recompacted", tmp_path / "reference")
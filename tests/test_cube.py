@@ -0,0 +1,82 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from generate_synthetic_export import iter_lessons
+from metrics.cube import rebuild_cube, rollup
+from metrics.daily import compute_daily_metrics
+from metrics.keys import compute_key_metrics
+from schema import ensure_schema
+from test_incremental import write_export
+from update_keybr import ingest_stream
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("cube")
+    lessons = sorted(
+        iter_lessons(300, 30, layouts=["en-us", "de-de"], seed=11), key=lambda lesson: lesson["timeStamp"]
+    )
+    conn = sqlite3.connect(tmp / "keybr.db")
+    ensure_schema(conn)
+    # The cube is maintained batch by batch while ingesting
+    ingest_stream(conn, write_export(tmp / "part.json", lessons[:120]))
+    ingest_stream(conn, write_export(tmp / "full.json", lessons))
+    yield conn
+    conn.close()
+
+
+def cube_tables(conn):
+    return [
+        pd.read_sql_query(f"SELECT * FROM {table} ORDER BY 1, 2, 3{extra};", conn)
+        for table, extra in (("lesson_cube", ""), ("key_cube", ", 4"))
+    ]
+
+
+def test_cube_maintained_at_ingest_equals_a_rebuild(conn):
+    maintained = cube_tables(conn)
+    rebuild_cube(conn)
+    for got, want in zip(maintained, cube_tables(conn)):
+        pd.testing.assert_frame_equal(got, want, rtol=1e-12)
+
+
+def test_rollup_by_date_matches_the_daily_metrics(conn):
+    columns = ["date", "num_lessons", "total_chars", "total_errors", "avg_wpm", "total_keystrokes", "avg_latency"]
+    daily = compute_daily_metrics(conn).sort_values("date").reset_index(drop=True)
+    pd.testing.assert_frame_equal(rollup(conn)[columns], daily[columns], check_dtype=False, rtol=1e-9)
+
+
+def test_rollup_by_key_matches_the_key_metrics(conn):
+    columns = ["key", "attempts", "errors", "miss_rate", "avg_latency", "last_timestamp"]
+    keys = compute_key_metrics(conn).sort_values("key").reset_index(drop=True)
+    pd.testing.assert_frame_equal(rollup(conn, ("key",))[columns], keys[columns], check_dtype=False, rtol=1e-9)
+
+
+def test_filtered_rollup_matches_raw_aggregates(conn):
+    got = rollup(conn, ("layout", "textType"), since="2024-01-10", until="2024-01-20", layout="de-de")
+    want = pd.read_sql_query(
+        """
+        SELECT layout, textType, COUNT(*) AS num_lessons, SUM(length) AS total_chars, SUM(errors) AS total_errors
+        FROM lessons_raw
+        WHERE date BETWEEN '2024-01-10' AND '2024-01-20' AND layout = 'de-de'
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """,
+        conn,
+    )
+    assert len(want) > 0
+    pd.testing.assert_frame_equal(got[list(want.columns)], want, check_dtype=False)
+
+    key_attempts = pd.read_sql_query(
+        """
+        SELECT k.key, SUM(k.hitCount) + SUM(k.missCount) AS attempts
+        FROM keystats_raw k JOIN lessons_raw l ON l.lesson_hash = k.lesson_hash AND l.timeStamp = k.timeStamp
+        WHERE l.layout = 'de-de'
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        conn,
+    )
+    got = rollup(conn, ("key",), layout="de-de")
+    pd.testing.assert_frame_equal(got[["key", "attempts"]], key_attempts, check_dtype=False)
@@ -0,0 +1,83 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from generate_synthetic_export import generate_export
+from metrics.chunked import compute_all_metrics_chunked
+from metrics.daily import compute_daily_metrics
+from metrics.engine import compute_all_metrics
+from metrics.keys import compute_key_metrics
+from schema import DERIVED_TABLES, ensure_schema
+from test_schema_upgrade import lesson
+from update_keybr import import_new_data_streaming, write_lessons_batch
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("engines")
+    export = tmp / "typing-data.json"
+    generate_export(export, lessons=400, days=60, layouts=["en-us", "de-de"])
+    import_new_data_streaming(db_path=tmp / "keybr.db", json_path=export)
+    conn = sqlite3.connect(tmp / "keybr.db")
+    yield conn
+    conn.close()
+
+
+def sql_metrics(conn):
+    return compute_daily_metrics(conn).sort_values("date"), compute_key_metrics(conn)
+
+
+def assert_same_metrics(actual, expected):
+    """Same rows and columns; float sums may differ from SQLite's in the last bits."""
+    for got, want in zip(actual, expected):
+        pd.testing.assert_frame_equal(
+            got.reset_index(drop=True)[list(want.columns)],
+            want.reset_index(drop=True),
+            check_dtype=False,
+            rtol=1e-9,
+        )
+
+
+def test_memory_engine_matches_sql(conn):
+    assert_same_metrics(compute_all_metrics(conn), sql_metrics(conn))
+
+
+def test_chunked_engine_matches_sql(conn):
+    # A budget of a few hundred rows forces many batches
+    assert_same_metrics(compute_all_metrics_chunked(conn, memory_mb=0.1), sql_metrics(conn))
+
+
+def test_engines_handle_null_timestamps_and_unlinked_keystats(tmp_path):
+    conn = sqlite3.connect(tmp_path / "keybr.db")
+    ensure_schema(conn)
+    write_lessons_batch(
+        conn,
+        [
+            lesson("2024-01-01T10:00:00.000Z", [(97, 20, 1, 250), (98, 10, 0, 300)]),
+            lesson("2024-01-02T10:00:00.000Z", [(97, 30, 2, 200), (99, 5, 1, 400)]),
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO keystats_raw (timeStamp, codePoint, key, hitCount, missCount, timeToType_ms, date, epoch_ms, lesson_hash) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+        [
+            # No timestamp at all
+            (None, 97, "a", 5, 3, 100, None, None, "no-ts"),
+            # A day but no epoch_ms: one lesson of its own, as in lesson_metrics
+            ("2024-01-02T11:00:00", 98, "b", 4, 1, 150, "2024-01-02", None, "no-epoch"),
+            # Keystats without a lesson row, and the latest timestamp of "d"
+            ("2024-01-03T09:00:00.000Z", 100, "d", 7, 2, 500, "2024-01-03", 1704272400000, "unlinked"),
+        ],
+    )
+    conn.commit()
+    for rebuild in DERIVED_TABLES.values():
+        rebuild(conn)
+    conn.commit()
+
+    expected = sql_metrics(conn)
+    assert expected[0]["date"].notna().all()
+    assert expected[1].set_index("key").loc["d", "last_timestamp"] == "2024-01-03T09:00:00.000Z"
+    assert_same_metrics(compute_all_metrics(conn), expected)
+    assert_same_metrics(compute_all_metrics_chunked(conn, memory_mb=0.001), expected)
+    conn.close()
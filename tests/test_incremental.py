@@ -0,0 +1,99 @@
+import json
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import build_metrics
+from generate_synthetic_export import iter_lessons
+from metrics.export import write_csv, write_csv_tail
+from schema import ensure_schema
+from update_keybr import ingest_stream
+
+OUTPUTS = ["daily_metrics.csv", "key_metrics.csv", "weak_keys.csv", "weak_keys_7d.csv"]
+
+
+def write_export(path, lessons):
+    path.write_text(json.dumps(lessons), encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def lessons():
+    return sorted(iter_lessons(400, 90, seed=7), key=lambda lesson: lesson["timeStamp"])
+
+
+def build(conn, output_dir, **kwargs):
+    build_metrics.build(conn, output_dir=output_dir, weak_windows=[7], **kwargs)
+
+
+def assert_same_outputs(actual_dir, expected_dir):
+    for name in OUTPUTS:
+        assert (actual_dir / name).read_bytes() == (expected_dir / name).read_bytes(), name
+
+
+def test_incremental_build_of_new_days_equals_full_build(tmp_path, lessons):
+    conn = sqlite3.connect(tmp_path / "keybr.db")
+    ensure_schema(conn)
+    ingest_stream(conn, write_export(tmp_path / "part.json", lessons[:250]))
+    build(conn, tmp_path / "incremental")
+
+    dates = ingest_stream(conn, write_export(tmp_path / "full.json", lessons))
+    assert dates
+    build(conn, tmp_path / "incremental", incremental=True, dates=dates)
+    build(conn, tmp_path / "full")
+
+    assert_same_outputs(tmp_path / "incremental", tmp_path / "full")
+    conn.close()
+
+
+def test_backdated_import_updates_rolling_windows_like_a_full_build(tmp_path, lessons):
+    conn = sqlite3.connect(tmp_path / "keybr.db")
+    ensure_schema(conn)
+    # Every third lesson arrives later, spread over the whole history
+    ingest_stream(conn, write_export(tmp_path / "part.json", [l for i, l in enumerate(lessons) if i % 3]))
+    build(conn, tmp_path / "incremental")
+
+    dates = ingest_stream(conn, write_export(tmp_path / "full.json", lessons), refeed=True)
+    assert min(dates) == lessons[0]["timeStamp"][:10]
+    build(conn, tmp_path / "incremental", incremental=True, dates=dates)
+    incremental_state = conn.execute("SELECT * FROM rolling_state ORDER BY date;").fetchall()
+    build(conn, tmp_path / "full")
+
+    assert_same_outputs(tmp_path / "incremental", tmp_path / "full")
+    assert incremental_state == conn.execute("SELECT * FROM rolling_state ORDER BY date;").fetchall()
+    conn.close()
+
+
+def test_tail_only_csv_update_equals_full_rewrite(tmp_path, lessons, monkeypatch):
+    conn = sqlite3.connect(tmp_path / "keybr.db")
+    ensure_schema(conn)
+    ingest_stream(conn, write_export(tmp_path / "part.json", lessons[:250]))
+    build(conn, tmp_path / "incremental")
+
+    calls = []
+    write_csv_tail = build_metrics.write_csv_tail
+
+    def spy(df, path, column, since=None):
+        calls.append(since)
+        return write_csv_tail(df, path, column, since)
+
+    monkeypatch.setattr(build_metrics, "write_csv_tail", spy)
+    dates = ingest_stream(conn, write_export(tmp_path / "full.json", lessons))
+    build(conn, tmp_path / "incremental", incremental=True, dates=dates)
+    assert calls == [min(dates)]
+    build(conn, tmp_path / "full")
+
+    assert_same_outputs(tmp_path / "incremental", tmp_path / "full")
+    conn.close()
+
+
+def test_tail_update_falls_back_to_a_full_rewrite_when_the_head_does_not_match(tmp_path):
+    path = tmp_path / "daily.csv"
+    df = pd.DataFrame({"date": ["2024-01-01", "2024-01-02", "2024-01-03"], "wpm": [40.0, 41.5, 42.0]})
+    write_csv(df.assign(wpm=[40.0, 41.0, 42.0]), path)
+
+    # The kept row 2024-01-02 differs from the frame: everything is rewritten
+    assert write_csv_tail(df, path, "date", "2024-01-03")
+    assert path.read_bytes() == df.to_csv(index=False).encode("utf-8")
+    assert not write_csv_tail(df, path, "date", "2024-01-02")
@@ -0,0 +1,79 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import initial_import
+from generate_synthetic_export import iter_lessons
+from schema import ensure_schema
+from test_schema_upgrade import lesson
+from update_keybr import write_lessons_batch
+
+TABLES = {
+    "lessons_raw": "timeStamp, lesson_hash",
+    "keystats_raw": "timeStamp, lesson_hash, codePoint",
+    "lesson_cube": "date, layout, textType",
+    "key_cube": "date, layout, textType, key",
+    "key_stats_acc": "key",
+}
+
+
+@pytest.fixture(scope="module")
+def csvs(tmp_path_factory):
+    """raw/lessons.csv and raw/keystats.csv with shared timestamps (unlinked keystats) and gaps."""
+    tmp = tmp_path_factory.mktemp("raw")
+    conn = sqlite3.connect(tmp / "source.db")
+    ensure_schema(conn)
+    shared = "2024-01-05T12:00:00.000Z"
+    write_lessons_batch(
+        conn,
+        [
+            *iter_lessons(150, 20, seed=17),
+            lesson(shared, [(97, 20, 1, 250), (98, 10, 0, 300)]),
+            {**lesson(shared, [(97, 12, 3, 280)]), "layout": "de-de"},
+        ],
+    )
+    conn.commit()
+    lessons = pd.read_sql_query(
+        "SELECT timeStamp, layout, textType, length, time_ms, errors, speed FROM lessons_raw ORDER BY id;", conn
+    )
+    keystats = pd.read_sql_query(
+        "SELECT timeStamp, codePoint, key, hitCount, missCount, timeToType_ms FROM keystats_raw ORDER BY id;",
+        conn,
+    )
+    conn.close()
+    lessons.loc[3, "speed"] = None
+    keystats.loc[5, "timeToType_ms"] = None
+    lessons.to_csv(tmp / "lessons.csv", index=False)
+    keystats.to_csv(tmp / "keystats.csv", index=False)
+    return tmp / "lessons.csv", tmp / "keystats.csv"
+
+
+def load(db_path, csvs, **kwargs):
+    initial_import.main(db_path=db_path, lessons_csv=csvs[0], keystats_csv=csvs[1], **kwargs)
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {}
+        for table, order in TABLES.items():
+            df = pd.read_sql_query(f"SELECT * FROM {table} ORDER BY {order};", conn)
+            tables[table] = df.drop(columns="id", errors="ignore").reset_index(drop=True)
+        return tables
+    finally:
+        conn.close()
+
+
+def assert_same_tables(actual, expected):
+    for table in TABLES:
+        pd.testing.assert_frame_equal(actual[table], expected[table], obj=table)
+
+
+def test_initial_import_is_idempotent(tmp_path, csvs):
+    first = load(tmp_path / "keybr.db", csvs)
+    assert first["keystats_raw"]["lesson_hash"].notna().all()
+    assert_same_tables(load(tmp_path / "keybr.db", csvs), first)
+
+
+@pytest.mark.parametrize("workers, chunk_mb", [(1, 0.001), (2, 0.002), (3, 64)])
+def test_initial_import_does_not_depend_on_blocks_or_workers(tmp_path, csvs, workers, chunk_mb):
+    expected = load(tmp_path / "reference.db", csvs)
+    assert_same_tables(load(tmp_path / "keybr.db", csvs, workers=workers, chunk_mb=chunk_mb), expected)
@@ -0,0 +1,55 @@
+import os
+import sqlite3
+
+import pytest
+
+from generate_synthetic_export import iter_lessons
+from instrumentation import RunReport
+from run_pipeline import METRIC_CSVS, run_stages
+from test_incremental import write_export
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    """run(): one pipeline run on the same DB, export and output dir; returns its report."""
+    db_path = tmp_path / "db" / "keybr.db"
+    db_path.parent.mkdir()
+    lessons = sorted(iter_lessons(100, 20, seed=3), key=lambda lesson: lesson["timeStamp"])
+    export = write_export(tmp_path / "typing-data.json", lessons)
+    output_dir = tmp_path / "output"
+
+    def run():
+        report = RunReport()
+        conn = sqlite3.connect(db_path)
+        try:
+            run_stages(conn, db_path, export, output_dir, report)
+        finally:
+            conn.close()
+        return report
+
+    run.export = export
+    run.output_dir = output_dir
+    return run
+
+
+def skipped(report):
+    return {name: stage.get("skipped", False) for name, stage in report.stages.items()}
+
+
+def test_unchanged_inputs_skip_both_stages(pipeline):
+    assert skipped(pipeline()) == {"ingest": False, "metrics": False}
+    assert skipped(pipeline()) == {"ingest": True, "metrics": True}
+
+    # Touched but identical export: recognised by its hash
+    stat = pipeline.export.stat()
+    os.utime(pipeline.export, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert skipped(pipeline()) == {"ingest": True, "metrics": True}
+
+
+def test_modified_output_is_rebuilt(pipeline):
+    pipeline()
+    expected = {name: (pipeline.output_dir / name).read_bytes() for name in METRIC_CSVS}
+
+    (pipeline.output_dir / "key_metrics.csv").write_text("edited\n")
+    assert skipped(pipeline()) == {"ingest": True, "metrics": False}
+    assert {name: (pipeline.output_dir / name).read_bytes() for name in METRIC_CSVS} == expected
@@ -0,0 +1,122 @@
+import sqlite3
+
+from metrics.keys import rebuild_key_accumulators
+from metrics.sketch import ZERO_BUCKET, bucket_index, key_latency_percentiles
+from schema import ensure_schema
+from update_keybr import write_lessons_batch
+
+# Raw tables as created before key_stats_acc (and the derived columns) existed
+OLD_SCHEMA = """
+CREATE TABLE lessons_raw (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timeStamp TEXT, layout TEXT, textType TEXT,
+    length INTEGER, time_ms INTEGER, errors INTEGER, speed REAL
+);
+CREATE TABLE keystats_raw (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timeStamp TEXT, codePoint INTEGER, key TEXT,
+    hitCount INTEGER, missCount INTEGER, timeToType_ms INTEGER
+);
+"""
+
+
+def lesson(ts, histogram):
+    return {
+        "timeStamp": ts,
+        "layout": "en-us",
+        "textType": "generated",
+        "length": 100,
+        "time": 30000,
+        "errors": 2,
+        "speed": 200.0,
+        "histogram": [
+            {"codePoint": cp, "hitCount": hits, "missCount": misses, "timeToType": latency}
+            for cp, hits, misses, latency in histogram
+        ],
+    }
+
+
+def key_stats(conn):
+    return conn.execute("SELECT * FROM key_stats_acc ORDER BY key;").fetchall()
+
+
+def test_key_accumulators_survive_upgrade_and_import(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.executescript(OLD_SCHEMA)
+    old = lesson("2024-01-01T10:00:00.000Z", [(97, 20, 1, 250), (98, 10, 0, 300)])
+    conn.execute(
+        "INSERT INTO lessons_raw (timeStamp, layout, textType, length, time_ms, errors, speed) "
+        "VALUES (?, 'en-us', 'generated', 100, 30000, 2, 200.0);",
+        (old["timeStamp"],),
+    )
+    conn.executemany(
+        "INSERT INTO keystats_raw (timeStamp, codePoint, key, hitCount, missCount, timeToType_ms) "
+        "VALUES (?, ?, ?, ?, ?, ?);",
+        [(old["timeStamp"], h["codePoint"], chr(h["codePoint"]), h["hitCount"], h["missCount"], h["timeToType"])
+         for h in old["histogram"]],
+    )
+    conn.commit()
+
+    ensure_schema(conn)
+    write_lessons_batch(conn, [lesson("2024-01-02T10:00:00.000Z", [(97, 30, 2, 200)])])
+    conn.commit()
+
+    ingested = key_stats(conn)
+    rebuild_key_accumulators(conn)
+    assert ingested == key_stats(conn)
+    assert ingested == [
+        ("a", 50, 3, 450, 2, 200, "2024-01-02T10:00:00.000Z"),
+        ("b", 10, 0, 300, 1, None, "2024-01-01T10:00:00.000Z"),
+    ]
+
+
+def test_identity_migration_keeps_keystats_of_lessons_sharing_a_timestamp(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.executescript(OLD_SCHEMA)
+    ts = "2024-01-01T10:00:00.000Z"
+    # Two different lessons with the same timestamp, the first one imported twice
+    conn.executemany(
+        "INSERT INTO lessons_raw (timeStamp, layout, textType, length, time_ms, errors, speed) "
+        "VALUES (?, 'en-us', 'generated', ?, 30000, 2, 200.0);",
+        [(ts, 100), (ts, 120), (ts, 100)],
+    )
+    conn.executemany(
+        "INSERT INTO keystats_raw (timeStamp, codePoint, key, hitCount, missCount, timeToType_ms) "
+        "VALUES (?, 97, 'a', ?, 0, 250);",
+        [(ts, 20), (ts, 30)],
+    )
+    conn.commit()
+
+    ensure_schema(conn)
+
+    assert conn.execute("SELECT COUNT(*) FROM lessons_raw;").fetchone() == (2,)
+    assert conn.execute("SELECT SUM(hitCount) FROM keystats_raw;").fetchone() == (50,)
+    assert conn.execute("SELECT COUNT(*) FROM keystats_raw WHERE lesson_hash IS NULL;").fetchone() == (0,)
+    assert conn.execute("SELECT hit_sum FROM key_stats_acc WHERE key = 'a';").fetchone() == (50,)
+
+
+def test_zero_latency_bucket_moves_out_of_the_index_range(tmp_path):
+    assert bucket_index(0) == ZERO_BUCKET
+    assert bucket_index(0.97) == -1
+
+    conn = sqlite3.connect(tmp_path / "keybr.db")
+    ensure_schema(conn)
+    write_lessons_batch(conn, [lesson("2024-01-01T10:00:00.000Z", [(97, 20, 1, 0), (98, 10, 0, 300)])])
+    conn.commit()
+    ingested = conn.execute("SELECT * FROM key_latency_sketch_acc ORDER BY key, bucket;").fetchall()
+
+    # As written before ZERO_BUCKET moved: latency 0 in bucket -1
+    conn.execute("UPDATE key_latency_sketch SET bucket = -1 WHERE bucket = ?;", (ZERO_BUCKET,))
+    conn.execute("UPDATE key_latency_sketch_acc SET bucket = -1 WHERE bucket = ?;", (ZERO_BUCKET,))
+    conn.execute("PRAGMA user_version = 0;")
+    conn.commit()
+
+    ensure_schema(conn)
+    assert conn.execute("SELECT * FROM key_latency_sketch_acc ORDER BY key, bucket;").fetchall() == ingested
+    assert key_latency_percentiles(conn).set_index("key").loc["a", "latency_p50"] == 0.0
+
+    # Once migrated, -1 is an ordinary bucket again
+    conn.execute("INSERT INTO key_latency_sketch_acc (key, bucket, count) VALUES ('c', -1, 1);")
+    conn.commit()
+    ensure_schema(conn)
+    assert conn.execute("SELECT bucket FROM key_latency_sketch_acc WHERE key = 'c';").fetchall() == [(-1,)]
@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import build_metrics
+import serve_metrics
+from schema import ensure_schema
+from test_schema_upgrade import OLD_SCHEMA, lesson
+from update_keybr import write_lessons_batch
+
+
+def ingest_and_build(db_path, output_dir, lessons):
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        write_lessons_batch(conn, lessons)
+        conn.commit()
+        build_metrics.build(conn, output_dir=output_dir)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "keybr.db"
+    ingest_and_build(
+        path, tmp_path / "output", [lesson("2024-01-01T10:00:00.000Z", [(97, 20, 1, 250), (98, 10, 0, 300)])]
+    )
+    return path
+
+
+@pytest.fixture
+def server(db_path):
+    server = serve_metrics.make_server(db_path, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path, etag=None):
+    """(status, headers, body) of a GET request."""
+    host, port = server.server_address[:2]
+    request = urllib.request.Request(f"http://{host}:{port}{path}")
+    if etag is not None:
+        request.add_header("If-None-Match", etag)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.headers, exc.read()
+
+
+def test_etag_revalidation_until_the_data_changes(server, db_path, tmp_path):
+    status, headers, body = get(server, "/daily")
+    assert status == 200
+    assert [day["date"] for day in json.loads(body)] == ["2024-01-01"]
+    etag = headers["ETag"]
+
+    status, headers, body = get(server, "/daily", etag)
+    assert (status, body, headers["ETag"]) == (304, b"", etag)
+
+    ingest_and_build(db_path, tmp_path / "output", [lesson("2024-01-02T10:00:00.000Z", [(97, 30, 2, 200)])])
+    status, headers, body = get(server, "/daily", etag)
+    assert status == 200
+    assert headers["ETag"] != etag
+    assert [day["date"] for day in json.loads(body)] == ["2024-01-01", "2024-01-02"]
+
+
+def test_response_rendered_from_a_replaced_snapshot_is_not_cached(db_path, tmp_path, monkeypatch):
+    cache = serve_metrics.MetricsCache(db_path)
+    render = serve_metrics.render
+
+    def render_while_the_pipeline_commits(path, params, daily, keys, cache):
+        # The pipeline commits and another request reloads during rendering
+        monkeypatch.setattr(serve_metrics, "render", render)
+        ingest_and_build(db_path, tmp_path / "output", [lesson("2024-01-02T10:00:00.000Z", [(97, 30, 2, 200)])])
+        cache.refresh()
+        return render(path, params, daily, keys, cache)
+
+    monkeypatch.setattr(serve_metrics, "render", render_while_the_pipeline_commits)
+    stale, _, stale_etag = cache.response("/daily", {})
+    assert len(json.loads(stale)) == 1
+
+    fresh, _, fresh_etag = cache.response("/daily", {})
+    assert len(json.loads(fresh)) == 2
+    assert fresh_etag != stale_etag
+
+
+def test_server_opens_the_db_read_only(db_path):
+    cache = serve_metrics.MetricsCache(db_path)
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        cache.conn.execute("DELETE FROM key_stats_acc;")
+
+
+def test_error_statuses(server, monkeypatch):
+    assert get(server, "/nope")[0] == 404
+    assert get(server, "/keys?key=a,zz")[0] == 404
+    assert get(server, "/keys?key=a")[0] == 200
+    assert get(server, "/weak-keys?limit=x")[0] == 400
+
+    def broken(*args):
+        raise KeyError("internal")
+
+    monkeypatch.setattr(serve_metrics, "render", broken)
+    assert get(server, "/daily")[0] == 500
+
+
+def test_unmigrated_db_is_unavailable(tmp_path):
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.executescript(OLD_SCHEMA)
+    conn.close()
+    server = serve_metrics.make_server(tmp_path / "old.db", port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert get(server, "/daily")[0] == 503
+    finally:
+        server.shutdown()
+        server.server_close()
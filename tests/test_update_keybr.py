@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from update_keybr import iter_json_lessons
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_lessons_spanning_read_chunks(tmp_path):
+    lessons = [{"timeStamp": f"2024-01-0{i}T10:00:00.000Z", "text": "x" * 50, "n": -1.5e3, "ok": True, "none": None} for i in range(1, 8)]
+    path = write(tmp_path / "export.json", json.dumps(lessons))
+    assert list(iter_json_lessons(path, chunk_size=7)) == lessons
+
+
+def test_malformed_lesson_raises_without_reading_the_rest(tmp_path):
+    # The broken first lesson is followed by far more data than the size cap
+    text = '[{"a": 1 "b": 2},' + ",".join(['{"a": 1}'] * 10_000) + "]"
+    path = write(tmp_path / "export.json", text)
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_lessons(path, chunk_size=64, max_lesson_size=1024))
+
+
+def test_oversized_lesson_raises(tmp_path):
+    path = write(tmp_path / "export.json", '[{"text": "' + "x" * 5000 + '"}]')
+    with pytest.raises(ValueError, match="larger than"):
+        list(iter_json_lessons(path, chunk_size=64, max_lesson_size=1024))
@@ -0,0 +1,51 @@
+import watch_inbox
+from watch_inbox import InboxWatcher
+
+
+def test_locked_cycle_is_retried_a_limited_number_of_times(tmp_path):
+    path = tmp_path / "typing-data.json"
+    path.write_text("[]", encoding="utf-8")
+    watcher = InboxWatcher(tmp_path, settle=1.0)
+
+    assert watcher.settled(now=0.0) == []
+    assert watcher.settled(now=1.0) == [path]
+    for attempt in range(2):
+        assert watcher.retry([path], limit=2) == []
+        assert watcher.settled(now=10.0 * attempt + 10) == []
+        assert watcher.settled(now=10.0 * attempt + 11) == [path]
+    assert watcher.retry([path], limit=2) == [path]
+    assert watcher.settled(now=100.0) == []
+
+    # A changed file starts over
+    path.write_text("[ ]", encoding="utf-8")
+    assert watcher.settled(now=200.0) == []
+    assert watcher.settled(now=201.0) == [path]
+    assert watcher.retry([path], limit=2) == []
+
+
+def test_failing_cycle_is_logged_and_polling_continues(tmp_path, monkeypatch):
+    path = tmp_path / "typing-data.json"
+    calls = {"settled": 0, "cycles": 0}
+
+    class FakeWatcher:
+        def __init__(self, *args):
+            pass
+
+        def settled(self):
+            calls["settled"] += 1
+            if calls["settled"] > 3:
+                raise KeyboardInterrupt
+            return [path] if calls["settled"] == 1 else []
+
+        def retry(self, paths):
+            raise AssertionError("only a locked DB is retried")
+
+    def failing_cycle(conn, *args):
+        calls["cycles"] += 1
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(watch_inbox, "InboxWatcher", FakeWatcher)
+    monkeypatch.setattr(watch_inbox, "run_cycle", failing_cycle)
+    watch_inbox.watch(tmp_path, tmp_path / "keybr.db", tmp_path / "output", interval=0)
+
+    assert calls == {"settled": 4, "cycles": 1}
@@ -0,0 +1,69 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from generate_synthetic_export import generate_export
+from metrics.keys import finalize_key_metrics
+from metrics.weak_keys import get_weak_keys, key_prefix_sums, window_key_totals, windowed_weak_keys
+from update_keybr import import_new_data_streaming
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("weak_keys")
+    export = tmp / "typing-data.json"
+    generate_export(export, lessons=300, days=40, layouts=["en-us", "de-de"], seed=5)
+    import_new_data_streaming(db_path=tmp / "keybr.db", json_path=export)
+    conn = sqlite3.connect(tmp / "keybr.db")
+    yield conn
+    conn.close()
+
+
+def raw_window_totals(conn, since, until):
+    """Key metrics of the days in [since, until] straight from keystats_raw."""
+    df = pd.read_sql_query(
+        """
+        SELECT
+            key,
+            SUM(hitCount) + SUM(missCount) AS attempts,
+            SUM(missCount) AS errors,
+            CAST(SUM(timeToType_ms) AS REAL) / NULLIF(COUNT(timeToType_ms), 0) AS avg_latency
+        FROM keystats_raw
+        WHERE key IS NOT NULL AND date IS NOT NULL
+          AND date >= COALESCE(?, date) AND date <= COALESCE(?, date)
+        GROUP BY key
+        ORDER BY key
+        """,
+        conn,
+        params=(since, until),
+    )
+    return finalize_key_metrics(df)
+
+
+@pytest.mark.parametrize(
+    "since, until",
+    [
+        (None, None),
+        ("2024-01-15", None),
+        (None, "2024-01-07"),
+        ("2024-01-10", "2024-01-16"),
+        ("2024-01-04", "2024-01-04"),
+        ("2023-12-01", "2023-12-31"),
+    ],
+)
+def test_window_totals_match_raw_data(conn, since, until):
+    got = window_key_totals(key_prefix_sums(conn), since, until)
+    want = raw_window_totals(conn, since, until)
+    assert (len(want) == 0) == (since == "2023-12-01")
+    pd.testing.assert_frame_equal(
+        got.reset_index(drop=True), want[list(got.columns)], check_dtype=False, rtol=1e-9
+    )
+
+
+def test_windowed_weak_keys_rank_like_the_raw_totals(conn):
+    prefix = key_prefix_sums(conn)
+    got = windowed_weak_keys(prefix, "2024-01-10", "2024-01-30", min_attempts=50, top_n=5)
+    want = get_weak_keys(raw_window_totals(conn, "2024-01-10", "2024-01-30"), min_attempts=50, top_n=5)
+    assert len(got) == 5
+    assert list(got["key"]) == list(want["key"])